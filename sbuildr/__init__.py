@@ -1,9 +1,32 @@
-from sbuildr.project.project import Project
-from sbuildr.project.profile import Profile
-from sbuildr.tools.flags import BuildFlags
-from sbuildr.tools import compiler, linker
-from sbuildr.graph.node import Library
 from sbuildr.logger import G_LOGGER, SBuildrException, Verbosity
+import importlib
 __version__ = "0.6.2"
 
+# Public names are only imported on first access, so that tools which only need part of the package,
+# such as the sbuildr command-line utility, do not pay for importing all of it at startup.
+# Maps each name to the module that defines it, and the attribute within that module (None for modules).
+_LAZY_ATTRIBUTES = {
+    "Project": ("sbuildr.project.project", "Project"),
+    "Profile": ("sbuildr.project.profile", "Profile"),
+    "BuildFlags": ("sbuildr.tools.flags", "BuildFlags"),
+    "Library": ("sbuildr.graph.node", "Library"),
+    "compiler": ("sbuildr.tools.compiler", None),
+    "linker": ("sbuildr.tools.linker", None),
+    "backends": ("sbuildr.backends", None),
+    "dependencies": ("sbuildr.dependencies", None),
+}
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    module_name, attr = _LAZY_ATTRIBUTES[name]
+    module = importlib.import_module(module_name)
+    value = getattr(module, attr) if attr else module
+    # Cache the value so that subsequent accesses bypass __getattr__.
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()))
+
 G_LOGGER.debug(f"Loading SBuildr {__version__} from {__path__}")
@@ -2,10 +2,9 @@ from sbuildr.backends.backend import Backend
 from sbuildr.graph.graph import Graph
 from sbuildr.graph.node import Node
 from sbuildr.logger import G_LOGGER
-from sbuildr.misc import utils
+from sbuildr.misc import utils, jobs
 
 from typing import List, Dict
-import multiprocessing
 import subprocess
 import time
 import os
@@ -58,6 +57,9 @@ class RBuildBackend(Backend):
             return subprocess.CompletedProcess(args=[], returncode=0, stdout=b"", stderr=b"No targets specified"), 0
 
         paths = [node.path for node in nodes]
-        cmd = ["rbuild", "--threads", str(multiprocessing.cpu_count()), f"{self.config_file}"] + paths
-        G_LOGGER.verbose(f"Build command: {' '.join(cmd)}\nTarget file paths: {paths}")
-        return utils.time_subprocess(cmd)
+        # Concurrent builds, e.g. of nested dependencies, share job slots so that they do not oversubscribe the machine.
+        # The jobserver backing the slots is passed on, so that tools run by rbuild can also take part in it.
+        with jobs.G_JOB_SLOTS.reserve() as threads:
+            cmd = ["rbuild", "--threads", str(threads), f"{self.config_file}"] + paths
+            G_LOGGER.verbose(f"Build command: {' '.join(cmd)}\nTarget file paths: {paths}")
+            return utils.time_subprocess(cmd, **jobs.G_JOB_SLOTS.subprocess_kwargs())
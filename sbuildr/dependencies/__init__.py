@@ -1,3 +1,4 @@
 from sbuildr.dependencies.builder import DependencyBuilder
 from sbuildr.dependencies.fetcher import DependencyFetcher
 from sbuildr.dependencies.dependency import Dependency, DependencyLibrary
+from sbuildr.dependencies.resolver import DependencyResolver
@@ -0,0 +1,221 @@
+# Prebuilt package archives. Packages from the dependency cache can be packed into compressed archives, which are
+# stored in an archive directory shared between machines, for example on NFS or behind an HTTP server.
+# Dependency.setup() checks the archive directory before building packages from source.
+from sbuildr.dependencies.meta import DependencyMetadata
+from sbuildr.dependencies.cache import DependencyCache
+from sbuildr.misc.locks import FileLock
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import utils
+
+from typing import Dict
+import contextlib
+import urllib.request
+import urllib.error
+import tempfile
+import tarfile
+import shutil
+import json
+import io
+import os
+
+# The environment variable used to specify the default archive directory, e.g. "/mnt/nfs/sbuildr" or "http://cache.local/sbuildr".
+ARCHIVE_DIR_ENV_VAR = "SBUILDR_ARCHIVE_DIR"
+ARCHIVE_EXTENSION = ".tar.gz"
+# Describes the archived package. Stored alongside the package contents in each archive.
+ARCHIVE_INFO_FILENAME = "archive.json"
+# Holds the packages of the dependencies that an archived package was built with, so that the archive is self-contained.
+ARCHIVE_DEPENDENCIES_DIR = "dependencies"
+
+def default_archive_dir() -> str:
+    """
+    Returns the archive directory specified by the SBUILDR_ARCHIVE_DIR environment variable, or None if it is not set.
+    """
+    return os.environ.get(ARCHIVE_DIR_ENV_VAR) or None
+
+
+def is_url(path: str) -> bool:
+    return path.startswith("http://") or path.startswith("https://")
+
+
+def archive_location(archive_dir: str, archive_name: str) -> str:
+    return f"{archive_dir.rstrip('/')}/{archive_name}" if is_url(archive_dir) else os.path.join(archive_dir, archive_name)
+
+
+def transitive_dependencies(package_root: str) -> Dict[str, str]:
+    """
+    Finds the packages of all dependencies that a package was built with, directly or indirectly.
+
+    :param package_root: The package directory.
+
+    :returns: A mapping of dependency names to the roots of their packages.
+    """
+    dependencies: Dict[str, str] = {}
+    pending = [package_root]
+    while pending:
+        metadata_path = os.path.join(pending.pop(), DependencyMetadata.FILENAME)
+        if not os.path.exists(metadata_path):
+            continue
+        for name, root in DependencyMetadata.load(metadata_path).dependencies.items():
+            if name not in dependencies:
+                dependencies[name] = root
+                pending.append(root)
+    return dependencies
+
+
+def pack(package_root: str, archive_dir: str, archive_name: str) -> str:
+    """
+    Packs a package from the dependency cache into a compressed archive. The packages of any dependencies that the package was built with are included in the archive.
+
+    :param package_root: The package directory, containing headers, libraries, executables and metadata.
+    :param archive_dir: The directory in which to write the archive. Must be a local path.
+    :param archive_name: The file name of the archive.
+
+    :returns: The path to the archive.
+    """
+    if is_url(archive_dir):
+        G_LOGGER.critical(f"Cannot pack into: {archive_dir}. Archives can only be written to local or network file system paths.")
+
+    dependencies = transitive_dependencies(package_root)
+    missing = sorted([root for root in dependencies.values() if not os.path.isdir(root)])
+    if missing:
+        G_LOGGER.critical(f"Cannot pack: {package_root} since the packages of dependencies it was built with are missing: {missing}")
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_location(archive_dir, archive_name)
+    # Concurrent readers must never see partial archives.
+    with utils.atomic_write(path, "wb") as f, tarfile.open(fileobj=f, mode="w:gz") as archive:
+        for entry in sorted(os.listdir(package_root)):
+            archive.add(os.path.join(package_root, entry), arcname=entry)
+        for name, root in sorted(dependencies.items()):
+            archive.add(root, arcname=os.path.join(ARCHIVE_DEPENDENCIES_DIR, os.path.basename(root)))
+        info = json.dumps({"package_root": package_root, "dependencies": dependencies}).encode()
+        info_member = tarfile.TarInfo(ARCHIVE_INFO_FILENAME)
+        info_member.size = len(info)
+        archive.addfile(info_member, io.BytesIO(info))
+    G_LOGGER.info(f"Packed: {package_root} into {path}{f' with dependencies: {sorted(dependencies)}' if dependencies else ''}")
+    return path
+
+
+def _download(url: str, dest: str) -> bool:
+    try:
+        with urllib.request.urlopen(url) as response, open(dest, "wb") as f:
+            shutil.copyfileobj(response, f)
+        return True
+    except urllib.error.HTTPError as err:
+        if err.code != 404:
+            G_LOGGER.warning(f"Failed to download: {url} ({err})")
+    except urllib.error.URLError as err:
+        G_LOGGER.warning(f"Failed to download: {url} ({err})")
+    return False
+
+
+def unpack(archive_path: str, dest_dir: str) -> Dict:
+    """
+    Unpacks an archive created by :func:`pack` .
+
+    :param archive_path: A path or HTTP(S) URL to the archive.
+    :param dest_dir: The directory into which to unpack the archive. It should be empty or nonexistent.
+
+    :returns: The archive info, including the path of the package that was packed, or None if the archive does not exist.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if is_url(archive_path):
+            local_path = os.path.join(tmpdir, os.path.basename(archive_path))
+            if not _download(archive_path, local_path):
+                return None
+        elif not os.path.exists(archive_path):
+            return None
+        else:
+            local_path = archive_path
+
+        os.makedirs(dest_dir, exist_ok=True)
+        with tarfile.open(local_path, "r:gz") as archive:
+            # Reject absolute paths and links that point outside the destination, where supported.
+            if hasattr(tarfile, "data_filter"):
+                archive.extractall(dest_dir, filter="data")
+            else:
+                archive.extractall(dest_dir)
+
+    info_path = os.path.join(dest_dir, ARCHIVE_INFO_FILENAME)
+    with open(info_path, "r") as f:
+        info = json.load(f)
+    os.remove(info_path)
+    G_LOGGER.info(f"Unpacked: {archive_path} into {dest_dir}")
+    return info
+
+
+def _is_valid(meta: DependencyMetadata) -> bool:
+    return meta is not None and meta.META_API_VERSION == DependencyMetadata.META_API_VERSION
+
+
+def _load_metadata(package_root: str) -> DependencyMetadata:
+    metadata_path = os.path.join(package_root, DependencyMetadata.FILENAME)
+    return DependencyMetadata.load(metadata_path) if os.path.exists(metadata_path) else None
+
+
+def _install_bundled_package(bundled_root: str, package_root: str, relocations: Dict[str, str]):
+    # Packages that already exist in the cache are kept, unless they lack libraries that the bundled package provides.
+    existing = _load_metadata(package_root)
+    bundled = _load_metadata(bundled_root)
+    if _is_valid(existing) and set(bundled.libraries.keys()) <= set(existing.libraries.keys()):
+        G_LOGGER.verbose(f"Using existing package: {package_root} instead of the package bundled in the archive")
+        return
+    for old_root, new_root in relocations.items():
+        bundled.relocate(old_root, new_root)
+    bundled.save(os.path.join(bundled_root, DependencyMetadata.FILENAME))
+    # The existing package may still be in use, so it is replaced without ever being partially removed.
+    utils.replace_dir(bundled_root, package_root)
+    G_LOGGER.info(f"Installed bundled dependency package: {package_root}")
+
+
+def unpack_package(archive_path: str, packages_dir: str, package_name: str=None, cache: DependencyCache=None) -> DependencyMetadata:
+    """
+    Unpacks an archive created by :func:`pack` into a package directory, and updates the package metadata to point to it. The package directory is replaced atomically.
+    The packages of dependencies included in the archive are installed alongside it, and all paths to them are updated.
+
+    :param archive_path: A path or HTTP(S) URL to the archive.
+    :param packages_dir: The directory containing packages in the dependency cache.
+    :param package_name: The name of the package directory. Defaults to the name of the package that was packed.
+    :param cache: The dependency cache containing the packages directory. If provided, packages of dependencies are installed while holding their locks in the cache, and their usage is recorded.
+
+    :returns: The metadata of the unpacked package, or None if the archive does not exist or is incompatible.
+    """
+    os.makedirs(packages_dir, exist_ok=True)
+    tmp_root = tempfile.mkdtemp(prefix=f".{package_name or 'archive'}.", dir=packages_dir)
+    try:
+        info = unpack(archive_path, tmp_root)
+        if info is None:
+            G_LOGGER.debug(f"No prebuilt package found at: {archive_path}")
+            return None
+
+        metadata_path = os.path.join(tmp_root, DependencyMetadata.FILENAME)
+        meta = _load_metadata(tmp_root)
+        if not _is_valid(meta):
+            G_LOGGER.warning(f"Ignoring prebuilt package: {archive_path} since its metadata is missing or incompatible")
+            return None
+
+        package_root = os.path.join(packages_dir, package_name or os.path.basename(info["package_root"]))
+        dependencies: Dict[str, str] = info.get("dependencies", {})
+        relocations = {info["package_root"]: package_root}
+        relocations.update({old_root: os.path.join(packages_dir, os.path.basename(old_root)) for old_root in dependencies.values()})
+
+        bundled_dir = os.path.join(tmp_root, ARCHIVE_DEPENDENCIES_DIR)
+        if not all([_is_valid(_load_metadata(os.path.join(bundled_dir, os.path.basename(old_root)))) for old_root in dependencies.values()]):
+            G_LOGGER.warning(f"Ignoring prebuilt package: {archive_path} since the metadata of a bundled dependency package is missing or incompatible")
+            return None
+        for name, old_root in sorted(dependencies.items()):
+            new_root = relocations[old_root]
+            with FileLock(cache.lock_path(name)) if cache else contextlib.nullcontext():
+                _install_bundled_package(os.path.join(bundled_dir, os.path.basename(old_root)), new_root, relocations)
+                if cache:
+                    cache.touch(new_root, name)
+        shutil.rmtree(bundled_dir, ignore_errors=True)
+
+        for old_root, new_root in relocations.items():
+            meta.relocate(old_root, new_root)
+        meta.save(metadata_path)
+        utils.replace_dir(tmp_root, package_root)
+        G_LOGGER.info(f"Installed prebuilt package: {archive_path} to {package_root}")
+        return meta
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
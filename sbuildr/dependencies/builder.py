@@ -1,14 +1,38 @@
 from sbuildr.dependencies.meta import DependencyMetadata
+from sbuildr.tools.utils import str_hash
+from sbuildr.tools import compiler
+
+from typing import List
+import functools
+import subprocess
+import platform
+
+@functools.lru_cache()
+def toolchain_signature() -> List[str]:
+    """
+    Identifies the host platform and the versions of the compilers available on it.
+    """
+    signature = [platform.system(), platform.machine()]
+    for comp in [compiler.clang, compiler.gcc]:
+        try:
+            status = subprocess.run([str(comp), "--version"], capture_output=True)
+            version = status.stdout.decode().splitlines()[0] if status.stdout else ""
+        except OSError:
+            version = "unavailable"
+        signature.append(f"{comp}: {version}")
+    return signature
 
 class DependencyBuilder(object):
     def __init__(self):
         """
         Builds a dependency.
+
+        Builders that run external build systems should do so while holding a reservation from :attr:`sbuildr.misc.jobs.G_JOB_SLOTS` ,
+        passing the reserved count as the job count, and ``G_JOB_SLOTS.subprocess_kwargs()`` to ``subprocess`` , which includes the environment advertising the jobserver, so that the build system can take part in sbuildr's jobserver.
         """
         pass
 
-    # TODO: Make this only install things actually needed by the dependee. 
-    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str) -> DependencyMetadata:
+    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
         """
         Builds a dependency and installs artifacts into the specified directories.
 
@@ -16,7 +40,27 @@ class DependencyBuilder(object):
         :param header_dir: A path to the output directory for public headers from this dependency.
         :param lib_dir: A path to the output directory for libraries generated by this dependency.
         :param exec_dir: A path to the output directory for executables generated by this dependency.
+        :param libraries: The names of the libraries required by the dependee. Builders may skip building any other libraries. Defaults to all libraries.
 
         :returns: Metadata for this dependency.
         """
         raise NotImplementedError()
+
+
+    def output_dirs(self) -> List[str]:
+        """
+        Specifies the directories, relative to the source directory, in which this builder writes build artifacts. These are preserved when the dependency is fetched again, so that rebuilds are incremental.
+
+        :returns: A list of relative paths.
+        """
+        return []
+
+
+    def signature(self) -> str:
+        """
+        Identifies everything, other than the dependency version, that affects the packages this builder produces, for example, build flags and compilers.
+        Prebuilt packages are only reused if they were produced by a builder with the same signature.
+
+        :returns: A hash of the builder's configuration.
+        """
+        return str_hash([type(self).__name__] + toolchain_signature())
@@ -1,32 +1,63 @@
-from sbuildr.dependencies.builder import DependencyBuilder
+from sbuildr.dependencies.builder import DependencyBuilder, toolchain_signature
+from sbuildr.tools.utils import str_hash
 from sbuildr.dependencies.meta import DependencyMetadata, LibraryMetadata
 from sbuildr.project.project import Project
 from sbuildr.graph.node import Library
 from sbuildr.logger import G_LOGGER
 from sbuildr.misc import utils, paths
-import subprocess
+from typing import List
+import threading
+import runpy
 import sys
 import os
 
+# Build scripts are run in-process, but expect to be run from their own directories, with their own arguments.
+# Since the working directory and arguments are global to the process, only one script may run at a time.
+# Other dependencies may be set up concurrently while a script runs, so dependencies and fetchers make their paths absolute when they are created.
+_SCRIPT_LOCK = threading.Lock()
+
 class SBuildrBuilder(DependencyBuilder):
     def __init__(self, build_script_path: str="build.py", project_save_path: str=os.path.join("build", Project.DEFAULT_SAVED_PROJECT_NAME), install_profile=None):
         f"""
         Builds projects using the SBuildr build system.
+        Build scripts are run in the current process, and the project they create is built directly, so nested builds share this process's job slots (see :class:`sbuildr.misc.jobs.JobSlots`) rather than each using every CPU.
 
         :param build_script_path: The path to the build script, relative to the project root. Defaults to "build.py".
-        :param project_save_path: The path at which the build script saves the project, relative to the project root. Defaults to {os.path.join("build", Project.DEFAULT_SAVED_PROJECT_NAME)}
+        :param project_save_path: The path at which the build script saves the project, relative to the project root. This is only used if the project cannot be found in the build script's global namespace. Defaults to {os.path.join("build", Project.DEFAULT_SAVED_PROJECT_NAME)}
         :param install_profile: The profile to use when building targets to install. Defaults to the project's default install profile.
         """
         self.build_script_path = build_script_path
         self.project_save_path = project_save_path
         self.install_profile = install_profile
 
-    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str) -> DependencyMetadata:
-        # Configuration scripts should export the project.
-        configure_status = subprocess.run([sys.executable, self.build_script_path], capture_output=True, cwd=source_dir, env={"PYTHONPATH": os.path.pathsep.join(sys.path)})
-        if configure_status.returncode:
-            G_LOGGER.critical(f"Failed to run build configuration script: {self.build_script_path} in {source_dir} with:\n{utils.subprocess_output(configure_status)}")
 
+    def _run_build_script(self, source_dir: str) -> Project:
+        script_path = os.path.join(source_dir, self.build_script_path)
+        if not os.path.exists(script_path):
+            G_LOGGER.critical(f"Build configuration script: {self.build_script_path} does not exist in {source_dir}")
+
+        with _SCRIPT_LOCK:
+            cwd, argv = os.getcwd(), sys.argv
+            os.chdir(source_dir)
+            sys.argv = [script_path]
+            try:
+                G_LOGGER.info(f"Running build configuration script: {script_path}")
+                script_globals = runpy.run_path(script_path, run_name="__main__")
+            except SystemExit as err:
+                if err.code:
+                    G_LOGGER.critical(f"Build configuration script: {script_path} exited with: {err.code}")
+                script_globals = {}
+            except Exception as err:
+                G_LOGGER.critical(f"Failed to run build configuration script: {self.build_script_path} in {source_dir} with:\n{err}")
+            finally:
+                os.chdir(cwd)
+                sys.argv = argv
+
+        projects = [obj for obj in script_globals.values() if isinstance(obj, Project)]
+        if len(projects) == 1:
+            return projects[0]
+
+        # Fall back to the exported project if the script does not expose exactly one project.
         saved_project = os.path.join(source_dir, self.project_save_path)
         if not os.path.exists(saved_project):
             G_LOGGER.critical(f"Project was not saved to: {saved_project}. Please ensure this path is correct, and that the build configuration script in {self.build_script_path} is saving the project")
@@ -34,17 +65,41 @@ class SBuildrBuilder(DependencyBuilder):
         project = Project.load(saved_project)
         if project.PROJECT_API_VERSION != Project.PROJECT_API_VERSION:
             G_LOGGER.critical(f"This project has an older API version. System Project API version: {Project.PROJECT_API_VERSION}, Project version: {project.PROJECT_API_VERSION}. Please specify the path to which the project is saved by this dependency's build script using the project_save_path parameter.")
+        return project
+
+
+    def output_dirs(self) -> List[str]:
+        # Projects are saved to their build directories.
+        build_dir = os.path.dirname(self.project_save_path)
+        return [build_dir] if build_dir else []
+
+
+    def signature(self) -> str:
+        # Build flags are defined by the dependency's build script, and are therefore covered by its version.
+        return str_hash([type(self).__name__, self.build_script_path, str(self.install_profile)] + toolchain_signature())
+
+
+    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+        project = self._run_build_script(source_dir)
+
+        # Only build the libraries that were requested.
+        targets = project.install_targets()
+        if libraries is not None:
+            targets = [target for target in targets if target.is_lib and target.name in libraries]
+        G_LOGGER.debug(f"Building targets: {[target.name for target in targets]} from {source_dir}")
 
-        self.install_profile = self.install_profile or project.install_profile()
-        project.configure(project.install_targets(), profile_names=[self.install_profile])
-        project.build(project.install_targets(), [self.install_profile])
+        install_profile = self.install_profile or project.install_profile()
+        project.configure(targets, profile_names=[install_profile])
+        project.build(targets, [install_profile])
 
-        project.install(targets=project.install_targets(), profile_names=[self.install_profile], header_install_path=header_dir, library_install_path=lib_dir, executable_install_path=exec_dir, dry_run=False)
+        project.install(targets=targets, profile_names=[install_profile], header_install_path=header_dir, library_install_path=lib_dir, executable_install_path=exec_dir, dry_run=False)
 
         libraries = {}
-        for name, target in project.libraries.items():
-            if not target.internal:
-                lib = target[self.install_profile]
-                libraries[name] = LibraryMetadata(path=os.path.join(lib_dir, paths.name_to_libname(name)), libs=lib.libs, lib_dirs=lib.lib_dirs)
+        for target in targets:
+            if target.is_lib:
+                lib = target[install_profile]
+                libraries[target.name] = LibraryMetadata(path=os.path.join(lib_dir, paths.name_to_libname(target.name)), libs=lib.libs, lib_dirs=lib.lib_dirs)
         include_dirs = project.files.include_dirs
-        return DependencyMetadata(libraries, include_dirs)
+        # Libraries and include directories may refer to the packages of this project's own dependencies, which must be available wherever this package is used.
+        dependencies = {dep.fetcher.dependency_name: dep.package_root for dep in project.dependencies(targets)}
+        return DependencyMetadata(libraries, include_dirs, dependencies)
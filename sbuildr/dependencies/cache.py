@@ -0,0 +1,261 @@
+from sbuildr.misc.locks import FileLock
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import paths, utils
+
+from typing import List, Set
+import hashlib
+import shutil
+import json
+import time
+import os
+
+# The environment variable used to specify a size budget for the dependency cache, e.g. "10G".
+# When set, least recently used entries are evicted automatically after dependencies are set up.
+MAX_SIZE_ENV_VAR = "SBUILDR_CACHE_MAX_SIZE"
+
+SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+def parse_size(size: str) -> int:
+    """
+    Parses a human readable size, like "512M" or "10G", into a number of bytes.
+
+    :param size: The size to parse. Suffixes are powers of 1024. A trailing "B" is optional.
+
+    :returns: The size in bytes.
+    """
+    normalized = size.strip().upper()
+    if normalized.endswith("B"):
+        normalized = normalized[:-1]
+    suffix = normalized[-1:] if normalized[-1:] in SIZE_SUFFIXES else ""
+    try:
+        return int(float(normalized[:len(normalized) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+    except ValueError:
+        G_LOGGER.critical(f"Could not parse size: {size}. Sizes should be specified like: 512M or 10G")
+
+
+def max_size_from_env() -> int:
+    """
+    Returns the size budget for the dependency cache specified by the SBUILDR_CACHE_MAX_SIZE environment variable, or None if it is not set.
+    """
+    size = os.environ.get(MAX_SIZE_ENV_VAR)
+    return parse_size(size) if size else None
+
+
+def package_dir_name(dependency_name: str, version: str) -> str:
+    """
+    Returns the name of the directory in the cache containing the package for the specified version of a dependency.
+    """
+    return f"{dependency_name}-{version}" if version else dependency_name
+
+
+def dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+# A single package or source checkout in the dependency cache.
+class CacheEntry(object):
+    def __init__(self, path: str, dependency_name: str, last_used: float, size: int):
+        self.path = path
+        self.dependency_name = dependency_name
+        self.last_used = last_used
+        self.size = size
+
+
+    def __str__(self) -> str:
+        return f"{self.path} ({self.size} bytes, last used: {time.ctime(self.last_used)})"
+
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class DependencyCache(object):
+    SOURCES_SUBDIR = "sources"
+    PACKAGES_SUBDIR = "packages"
+    LOCKS_SUBDIR = "locks"
+    # Data shared between fetches, like repository mirrors. This is not subject to garbage collection.
+    FETCHERS_SUBDIR = "fetchers"
+    # Access times are tracked in a sidecar index, so that the contents of packages and source checkouts are never modified.
+    # The index contains one file per cache entry, whose modification time is the last time the entry was used, and whose
+    # contents are the name of the dependency that the entry belongs to.
+    LAST_USED_SUBDIR = "last_used"
+    # Lockfiles that reference packages are tracked in another sidecar index, containing one directory per package, with one file per lockfile.
+    # Packages are not evicted while a lockfile that references them exists, since the projects they belong to may be built or run at any time.
+    REFERENCES_SUBDIR = "references"
+
+    def __init__(self, root: str=paths.dependency_cache_root()):
+        """
+        Tracks usage of, and evicts entries from a dependency cache.
+
+        :param root: The root directory of the dependency cache.
+        """
+        self.root = root
+
+
+    def lock_path(self, dependency_name: str) -> str:
+        """
+        Returns the path to the lock file that guards the sources and packages for the specified dependency.
+        """
+        return os.path.join(self.root, DependencyCache.LOCKS_SUBDIR, f"{dependency_name}.lock")
+
+
+    def _index_path(self, path: str, subdir: str=LAST_USED_SUBDIR) -> str:
+        relpath = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        return os.path.join(self.root, subdir, relpath)
+
+
+    def touch(self, path: str, dependency_name: str):
+        """
+        Records that a cache entry was just used.
+
+        :param path: The path to the package or source checkout.
+        :param dependency_name: The name of the dependency that the entry belongs to.
+        """
+        index_path = self._index_path(path)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "w") as f:
+            f.write(dependency_name)
+        G_LOGGER.verbose(f"Marked cache entry: {path} as used")
+
+
+    def add_reference(self, path: str, lockfile_path: str):
+        """
+        Records that a lockfile references a package. The package is not evicted while the lockfile exists and still pins the version of the dependency in the package.
+
+        :param path: The path to the package.
+        :param lockfile_path: The path to the lockfile.
+        """
+        lockfile_path = os.path.abspath(lockfile_path)
+        references_dir = self._index_path(path, DependencyCache.REFERENCES_SUBDIR)
+        os.makedirs(references_dir, exist_ok=True)
+        with utils.atomic_write(os.path.join(references_dir, hashlib.blake2b(lockfile_path.encode(), digest_size=8).hexdigest())) as f:
+            f.write(lockfile_path)
+        G_LOGGER.verbose(f"Marked cache entry: {path} as referenced by: {lockfile_path}")
+
+
+    @staticmethod
+    def _pins(lockfile_path: str, entry: CacheEntry) -> bool:
+        # Whether the lockfile pins the dependency to the version in the package. See sbuildr.dependencies.lockfile.Lockfile for the format.
+        try:
+            with open(lockfile_path, "r") as f:
+                lockfile_entry = json.load(f)["dependencies"][entry.dependency_name]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return package_dir_name(entry.dependency_name, lockfile_entry.get("version")) == os.path.basename(entry.path)
+
+
+    def referencing_lockfiles(self, entry: CacheEntry) -> List[str]:
+        """
+        Returns the lockfiles that currently reference a cache entry. Lockfiles that no longer exist, or that pin another version, are ignored.
+
+        :param entry: The cache entry.
+
+        :returns: The paths of the lockfiles.
+        """
+        references_dir = self._index_path(entry.path, DependencyCache.REFERENCES_SUBDIR)
+        if not os.path.isdir(references_dir):
+            return []
+        lockfiles = []
+        for name in os.listdir(references_dir):
+            try:
+                with open(os.path.join(references_dir, name), "r") as f:
+                    lockfile_path = f.read().strip()
+            except OSError:
+                continue
+            if DependencyCache._pins(lockfile_path, entry):
+                lockfiles.append(lockfile_path)
+        return lockfiles
+
+
+    def entries(self) -> List[CacheEntry]:
+        """
+        Returns all packages and source checkouts in the cache, sorted from least to most recently used.
+        Entries that have no recorded access time, e.g. from older caches, are treated as last used when they were modified.
+        """
+        entries = []
+        for subdir in [DependencyCache.SOURCES_SUBDIR, DependencyCache.PACKAGES_SUBDIR]:
+            dir = os.path.join(self.root, subdir)
+            if not os.path.isdir(dir):
+                continue
+            for name in os.listdir(dir):
+                path = os.path.join(dir, name)
+                # Hidden directories are packages that are still being installed.
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                index_path = self._index_path(path)
+                if os.path.exists(index_path):
+                    with open(index_path, "r") as f:
+                        dependency_name = f.read().strip()
+                    last_used = os.path.getmtime(index_path)
+                else:
+                    # Sources are named after the dependency, while packages are named <name>-<version>.
+                    dependency_name = name if subdir == DependencyCache.SOURCES_SUBDIR else name.rsplit("-", 1)[0]
+                    last_used = os.path.getmtime(path)
+                entries.append(CacheEntry(path, dependency_name, last_used, dir_size(path)))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+
+    def size(self) -> int:
+        """
+        Returns the total size of all packages and source checkouts in the cache, in bytes.
+        """
+        return sum([entry.size for entry in self.entries()])
+
+
+    def collect_garbage(self, max_size: int, keep: Set[str]=set(), dry_run: bool=False) -> List[CacheEntry]:
+        """
+        Evicts least recently used entries until the cache is no larger than max_size.
+        Entries belonging to dependencies that are currently locked, for example because another process is setting them up, are never evicted.
+        Neither are packages referenced by the lockfile of any project (see :func:`add_reference` ), since those projects may be built or run at any time.
+
+        :param max_size: The maximum size of the cache, in bytes.
+        :param keep: Paths to entries that must not be evicted, for example, packages used by the current project.
+        :param dry_run: Whether to only report the entries that would be evicted, without removing them.
+
+        :returns: The entries that were, or in the case of a dry run, would have been evicted.
+        """
+        entries = self.entries()
+        total_size = sum([entry.size for entry in entries])
+        keep = set([os.path.abspath(path) for path in keep])
+        G_LOGGER.debug(f"Dependency cache: {self.root} is {total_size} bytes. Budget: {max_size} bytes")
+
+        evicted = []
+        for entry in entries:
+            if total_size <= max_size:
+                break
+            if os.path.abspath(entry.path) in keep:
+                continue
+
+            lock = FileLock(self.lock_path(entry.dependency_name))
+            if not lock.acquire(blocking=False):
+                G_LOGGER.debug(f"Not evicting: {entry.path} since dependency: {entry.dependency_name} is locked")
+                continue
+            try:
+                # References are checked with the lock held, since projects record them after setting up their dependencies.
+                lockfiles = self.referencing_lockfiles(entry)
+                if lockfiles:
+                    G_LOGGER.debug(f"Not evicting: {entry.path} since it is referenced by: {lockfiles}")
+                    continue
+                G_LOGGER.info(f"{'Would evict' if dry_run else 'Evicting'}: {entry}")
+                if not dry_run:
+                    shutil.rmtree(entry.path)
+                    index_path = self._index_path(entry.path)
+                    if os.path.exists(index_path):
+                        os.remove(index_path)
+                    shutil.rmtree(self._index_path(entry.path, DependencyCache.REFERENCES_SUBDIR), ignore_errors=True)
+            finally:
+                lock.release()
+            total_size -= entry.size
+            evicted.append(entry)
+
+        if total_size > max_size:
+            G_LOGGER.warning(f"Dependency cache: {self.root} is {total_size} bytes, which exceeds the budget of {max_size} bytes, but no more entries can be evicted")
+        G_LOGGER.info(f"{'Would evict' if dry_run else 'Evicted'} {len(evicted)} cache entries, freeing {sum([entry.size for entry in evicted])} bytes")
+        return evicted
@@ -1,25 +1,68 @@
 from sbuildr.dependencies.builder import DependencyBuilder
+from sbuildr.dependencies.cache import DependencyCache, package_dir_name
+from sbuildr.dependencies import archive
 from sbuildr.dependencies.fetcher import DependencyFetcher
 from sbuildr.dependencies.meta import DependencyMetadata, LibraryMetadata
 from sbuildr.graph.node import Library
 from sbuildr.logger import G_LOGGER
-from sbuildr.misc import paths
+from sbuildr.misc.locks import FileLock
+from sbuildr.misc import paths, utils
 
-from typing import List
+from collections import defaultdict
+from typing import List, Dict
+import contextlib
+import threading
+import tempfile
+import shutil
 import os
 
+# Dependencies that share a source directory (i.e. have the same name) must not be set up concurrently.
+# This also deduplicates work, since the second setup of a dependency will find the package that the first
+# one installed. These locks handle threads within a process, while lock files in the cache handle processes.
+_SETUP_LOCKS: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+_SETUP_LOCKS_GUARD = threading.Lock()
+
+def _setup_lock(key: str) -> threading.Lock:
+    with _SETUP_LOCKS_GUARD:
+        return _SETUP_LOCKS[key]
+
+# The dependencies being set up by the current thread, outermost first, including those being set up by the threads that started it.
+# Build scripts of dependencies run in-process, so a dependency whose build requires a dependency with the same name would otherwise wait for its own setup lock forever.
+_SETUP_CHAIN = threading.local()
+
+def setup_chain() -> List["Dependency"]:
+    """
+    Returns the dependencies being set up by the current thread, outermost first.
+    """
+    return getattr(_SETUP_CHAIN, "dependencies", [])
+
+
+@contextlib.contextmanager
+def inherit_setup_chain(chain: List["Dependency"]):
+    """
+    Makes dependencies set up by the current thread nested within the specified chain, for example, when a thread sets up dependencies on behalf of another.
+
+    :param chain: A chain returned by :func:`setup_chain` in the other thread.
+    """
+    previous = setup_chain()
+    _SETUP_CHAIN.dependencies = chain
+    try:
+        yield
+    finally:
+        _SETUP_CHAIN.dependencies = previous
+
 # TODO: This does not support executables
 class Dependency(object):
-    CACHE_SOURCES_SUBDIR = "sources"
-    CACHE_PACKAGES_SUBDIR = "packages"
+    CACHE_SOURCES_SUBDIR = DependencyCache.SOURCES_SUBDIR
+    CACHE_PACKAGES_SUBDIR = DependencyCache.PACKAGES_SUBDIR
 
     PACKAGE_HEADER_SUBDIR = "include"
     PACKAGE_LIBRARY_SUBDIR = "lib"
     PACKAGE_EXECUTABLE_SUBDIR = "bin"
-    METADATA_FILENAME = "meta.pkl"
+    METADATA_FILENAME = DependencyMetadata.FILENAME
 
     # TODO: Make cache_root propagate to nested dependencies.
-    def __init__(self, fetcher: DependencyFetcher, builder: DependencyBuilder, cache_root: str=paths.dependency_cache_root()):
+    def __init__(self, fetcher: DependencyFetcher, builder: DependencyBuilder, cache_root: str=paths.dependency_cache_root(), archive_dir: str=None):
         """
         Manages a fetcher-builder pair for a single dependency.
 
@@ -27,11 +70,19 @@ class Dependency(object):
         :param builder: The builder to use to generate build artifacts for this dependency.
         :param version: The version number of the dependency to fetch.
         :param cache_root: The root directory to use for caching dependencies.
+        :param archive_dir: A directory or HTTP(S) URL containing prebuilt package archives created by :func:`pack` . If an archive matching this dependency's version and builder exists, it is unpacked instead of building the dependency from source. Defaults to the value of the SBUILDR_ARCHIVE_DIR environment variable.
         """
-        self.cache_root = cache_root
+        # Paths are made absolute, since build scripts of nested dependencies may change the working directory while dependencies are being set up.
+        self.cache_root = os.path.abspath(cache_root)
+        self.archive_dir = archive_dir or archive.default_archive_dir()
+        if self.archive_dir and not archive.is_url(self.archive_dir):
+            self.archive_dir = os.path.abspath(self.archive_dir)
+        self.cache = DependencyCache(self.cache_root)
         self.fetcher = fetcher
         self.fetcher.set_dest_dir(os.path.join(self.cache_root, Dependency.CACHE_SOURCES_SUBDIR, self.fetcher.dependency_name))
+        self.fetcher.set_cache_dir(os.path.join(self.cache_root, DependencyCache.FETCHERS_SUBDIR))
         self.builder = builder
+        self.fetcher.set_preserved_paths(self.builder.output_dirs())
         self.libraries: Dict[str, Library] = {}
 
         self.package_root = None
@@ -63,14 +114,78 @@ class Dependency(object):
 
         :returns: A list of include directories from this dependency.
         """
+        chain = setup_chain()
+        if any([dep.fetcher.dest_dir == self.fetcher.dest_dir for dep in chain]):
+            G_LOGGER.critical(f"Dependency: {self} is required while it is being set up: {' -> '.join([str(dep) for dep in chain + [self]])}. Dependencies with the same name cannot depend on each other.")
+        with inherit_setup_chain(chain + [self]), _setup_lock(self.fetcher.dest_dir), FileLock(self.lock_path()):
+            return self._setup(force)
+
+
+    def archive_name(self) -> str:
+        """
+        Returns the file name of the prebuilt package archive for this dependency. Archives are keyed by the dependency name and version, as well as the builder signature.
+        Dependencies without versions are keyed by a hash of their source code instead, if the fetcher provides one. Must be called after setup().
+        """
+        if not self.package_root:
+            G_LOGGER.critical(f"archive_name() must not be called before setup()")
+        name = self._archive_name()
+        if name is None:
+            G_LOGGER.critical(f"Dependency: {self} has no version, and its fetcher cannot identify its source code, so it cannot be archived")
+        return name
+
+
+    # Returns None if the dependency has no version and its source code cannot be identified.
+    def _archive_name(self) -> str:
+        key = os.path.basename(self.package_root)
+        if not self.version:
+            source_hash = self.fetcher.source_hash()
+            if source_hash is None:
+                return None
+            key += f"-{source_hash}"
+        return f"{key}-{self.builder.signature()}{archive.ARCHIVE_EXTENSION}"
+
+
+    def pack(self, archive_dir: str=None) -> str:
+        """
+        Packs this dependency's package into a prebuilt package archive. Must be called after setup().
+
+        :param archive_dir: The directory in which to write the archive. Defaults to this dependency's archive directory.
+
+        :returns: The path to the archive.
+        """
+        archive_dir = archive_dir or self.archive_dir
+        if not archive_dir:
+            G_LOGGER.critical(f"No archive directory specified for dependency: {self}")
+        with _setup_lock(self.fetcher.dest_dir), FileLock(self.lock_path()):
+            return archive.pack(self.package_root, archive_dir, self.archive_name())
+
+
+    # Unpacks a prebuilt package for this dependency, if one exists. Must be called with the setup lock held.
+    def _unpack_archive(self) -> DependencyMetadata:
+        name = self._archive_name()
+        if name is None:
+            G_LOGGER.debug(f"Not checking for prebuilt packages for: {self} since it has no version, and its source code cannot be identified")
+            return None
+        location = archive.archive_location(self.archive_dir, name)
+        return archive.unpack_package(location, os.path.dirname(self.package_root), os.path.basename(self.package_root), cache=self.cache)
+
+
+    def lock_path(self) -> str:
+        """
+        Returns the path to the lock file that guards the cached sources and packages for this dependency.
+        """
+        return self.cache.lock_path(self.fetcher.dependency_name)
+
+
+    def _setup(self, force: bool) -> DependencyMetadata:
         # Create the destination directory for the fetcher
         os.makedirs(self.fetcher.dest_dir, exist_ok=True)
 
         def update_package_root():
             name = self.fetcher.dependency_name
-            self.version = self.fetcher.version()
-            dir = f"{name}-{self.version}" if self.version else name
-            self.package_root = os.path.join(self.cache_root, Dependency.CACHE_PACKAGES_SUBDIR, dir)
+            # Pinned versions, e.g. from a lockfile, do not need to be resolved.
+            self.version = self.fetcher.version() if self.fetcher.pinned_version is None else self.fetcher.pinned_version
+            self.package_root = os.path.join(self.cache_root, Dependency.CACHE_PACKAGES_SUBDIR, package_dir_name(name, self.version))
 
         update_package_root()
         metadata_path = os.path.join(self.package_root, Dependency.METADATA_FILENAME)
@@ -78,20 +193,53 @@ class Dependency(object):
         if os.path.exists(metadata_path):
             meta = DependencyMetadata.load(metadata_path)
 
-        if force or meta is None or meta.META_API_VERSION != DependencyMetadata.META_API_VERSION:
-            G_LOGGER.info(f"{self.package_root} does not contain package metadata. Fetching dependency.")
+        def is_valid(meta):
+            return meta is not None and meta.META_API_VERSION == DependencyMetadata.META_API_VERSION
+
+        # Prefer prebuilt packages over building from source.
+        if not force and not is_valid(meta) and self.archive_dir:
+            meta = self._unpack_archive()
+
+        # Builders may only build the libraries that were requested, so packages built for other dependees may be missing libraries.
+        # In that case, the package is rebuilt with both the existing and requested libraries, so that it still serves both.
+        requested_libraries = set(self.libraries.keys())
+        missing_libraries = requested_libraries - set(meta.libraries.keys()) if is_valid(meta) else set()
+        if missing_libraries:
+            G_LOGGER.info(f"{self.package_root} does not contain libraries: {sorted(missing_libraries)}. Rebuilding dependency.")
+            requested_libraries.update(meta.libraries.keys())
+
+        if force or not is_valid(meta) or missing_libraries:
+            if not missing_libraries:
+                G_LOGGER.info(f"{self.package_root} does not contain package metadata. Fetching dependency.")
             self.fetcher.fetch()
-            # Install
-            lib_dir = os.path.join(self.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR)
-            exec_dir = os.path.join(self.package_root, Dependency.PACKAGE_EXECUTABLE_SUBDIR)
-            meta = self.builder.install(self.fetcher.dest_dir, header_dir=self.include_dir(), lib_dir=lib_dir, exec_dir=exec_dir)
-            meta.save(metadata_path)
+            # Install into a temporary directory first, then move it into place, so that the package root
+            # only ever contains complete packages, even if the build fails or is interrupted.
+            packages_dir = os.path.dirname(self.package_root)
+            os.makedirs(packages_dir, exist_ok=True)
+            tmp_root = tempfile.mkdtemp(prefix=f".{os.path.basename(self.package_root)}.", dir=packages_dir)
+            try:
+                meta = self.builder.install(self.fetcher.dest_dir,
+                                            header_dir=os.path.join(tmp_root, Dependency.PACKAGE_HEADER_SUBDIR),
+                                            lib_dir=os.path.join(tmp_root, Dependency.PACKAGE_LIBRARY_SUBDIR),
+                                            exec_dir=os.path.join(tmp_root, Dependency.PACKAGE_EXECUTABLE_SUBDIR),
+                                            libraries=sorted(requested_libraries))
+                meta.relocate(tmp_root, self.package_root)
+                meta.save(os.path.join(tmp_root, Dependency.METADATA_FILENAME))
+                # Any existing package must be incomplete or outdated at this point. It may still be in use, e.g. by other projects, if it is only missing libraries,
+                # so it is replaced without ever being partially removed.
+                utils.replace_dir(tmp_root, self.package_root)
+            finally:
+                shutil.rmtree(tmp_root, ignore_errors=True)
+
+        # Record usage so that garbage collection evicts least recently used entries first.
+        self.cache.touch(self.package_root, self.fetcher.dependency_name)
+        self.cache.touch(self.fetcher.dest_dir, self.fetcher.dependency_name)
 
         # TODO: FIXME: Make this more resilient to copies by moving this logic to Project. FileManager already tracks all dependency libraries as Library nodes.
         # Next, update all libraries that have been requested from this dependency.
         for name, lib in self.libraries.items():
             if name not in meta.libraries:
-                G_LOGGER.critical(f"Requested library: {name} is not present in dependency: {self.name}")
+                G_LOGGER.critical(f"Requested library: {name} is not present in dependency: {self}")
             metalib = meta.libraries[name]
             lib.path = metalib.path
             lib.libs.extend(metalib.libs)
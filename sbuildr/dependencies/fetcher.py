@@ -6,6 +6,9 @@ class DependencyFetcher(object):
     def __init__(self, name):
         self.dependency_name = name
         self.dest_dir = None
+        self.cache_dir = None
+        self.pinned_version = None
+        self.preserved_paths: List[str] = []
 
 
     def set_dest_dir(self, dest_dir: str):
@@ -17,6 +20,55 @@ class DependencyFetcher(object):
         self.dest_dir = dest_dir
 
 
+    def set_cache_dir(self, cache_dir: str):
+        """
+        Set the path to a directory that the fetcher may use to store data shared between fetches, for example, mirrors of remote repositories.
+        The directory may be shared by multiple fetchers and dependencies.
+
+        :param cache_dir: An absolute path to the cache directory.
+        """
+        self.cache_dir = cache_dir
+
+
+    def set_preserved_paths(self, paths: List[str]):
+        """
+        Set paths in the destination directory that fetches must not remove or overwrite, for example, the directories in which the dependency is built,
+        so that builds of the fetched source code are incremental.
+
+        :param paths: Paths relative to the destination directory.
+        """
+        self.preserved_paths = paths
+
+
+    def pin_version(self, version: str):
+        """
+        Pin the version of the dependency, for example, to a version recorded in a lockfile. Pinned versions are used without being resolved again.
+
+        :param version: A version previously returned by :func:`version` .
+        """
+        self.pinned_version = version
+
+
+    def source(self, relative_to: str=None) -> str:
+        """
+        Describes where the dependency is fetched from. This is used to detect changes to dependencies, for example, when deciding whether a lockfile entry still applies.
+
+        :param relative_to: A directory to which local paths in the description should be made relative, so that the description does not depend on where the project is located.
+
+        :returns: A string describing the source of the dependency - for example, a URL.
+        """
+        return self.dependency_name
+
+
+    def source_hash(self) -> str:
+        """
+        Identifies the source code of the dependency, without fetching it. This is used to key prebuilt package archives of dependencies without versions.
+
+        :returns: A hash of the source code, or None if it cannot be determined.
+        """
+        return None
+
+
     def fetch(self) -> str:
         """
         Fetches the dependency into the specified location.
@@ -1,27 +1,54 @@
 from sbuildr.dependencies.fetcher import DependencyFetcher
+from sbuildr.misc.sync import LinkMode, sync_tree, file_hash
 from sbuildr.logger import G_LOGGER
 
-import filecmp
-import shutil
+import hashlib
 import os
 
 class CopyFetcher(DependencyFetcher):
-    def __init__(self, path: str, version: str=""):
+    def __init__(self, path: str, version: str="", link_mode: LinkMode=LinkMode.REFLINK, compare_hashes: bool=False):
         """
         A dependency fetcher that copies source code from the specified path.
 
-        :param path: A path to the source code to copy. This fetcher will only copy if the path is newer than the cached source from any previous copies. The path should not be relative to the project, as that will break nested dependencies.
+        :param path: A path to the source code to copy. Copies are incremental: only files whose size or modification time differ from the cached source from any previous copies are copied, and files that no longer exist in the path are removed, except for the directories in which the dependency is built. Unchanged files keep their timestamps, so they do not trigger rebuilds. Relative paths are relative to the current working directory when the fetcher is created.
         :param version: The version of the dependency at the specified path. This is optional, and is used for caching dependency source code.
+        :param link_mode: How to copy files. By default, files are cloned if the filesystem supports it, and copied otherwise. Hardlinking is faster still, but means that any changes made to the cached source, e.g. by the dependency's build, also affect the original files.
+        :param compare_hashes: Whether to compare file contents when modification times differ, to avoid copying files that were touched without being modified.
         """
-        self.path = path
+        # Made absolute immediately, since build scripts of nested dependencies may change the working directory while dependencies are being set up.
+        self.path = os.path.abspath(path)
         self.version_tag = version
+        self.link_mode = link_mode
+        self.compare_hashes = compare_hashes
         super().__init__(os.path.basename(self.path))
 
 
     def fetch(self) -> str:
         super().fetch()
-        shutil.rmtree(self.dest_dir, ignore_errors=True)
-        return shutil.copytree(self.path, self.dest_dir)
+        stats = sync_tree(self.path, self.dest_dir, link_mode=self.link_mode, compare_hashes=self.compare_hashes, exclude=self.preserved_paths)
+        G_LOGGER.info(f"Copied: {self.path} to {self.dest_dir}: {stats}")
+        return self.dest_dir
+
+
+    def source(self, relative_to: str=None) -> str:
+        return os.path.relpath(self.path, relative_to) if relative_to else self.path
+
+
+    def source_hash(self) -> str:
+        # Hashes file contents rather than modification times, so that copies of the same source code on different machines are identified by the same hash.
+        preserved = set([os.path.normpath(path) for path in self.preserved_paths])
+        hasher = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(self.path):
+            relroot = os.path.relpath(root, self.path)
+            dirs[:] = sorted([dir for dir in dirs if os.path.normpath(os.path.join(relroot, dir)) not in preserved])
+            # Symlinks to directories are not followed, but their targets are part of the source code.
+            links = [dir for dir in dirs if os.path.islink(os.path.join(root, dir))]
+            for name in sorted(files + links):
+                path = os.path.join(root, name)
+                relpath = os.path.normpath(os.path.join(relroot, name))
+                if relpath not in preserved:
+                    hasher.update(f"{relpath}\0{os.readlink(path) if os.path.islink(path) else file_hash(path)}\n".encode())
+        return hasher.hexdigest()
 
 
     def version(self) -> str:
@@ -1,50 +1,183 @@
 from sbuildr.dependencies.fetcher import DependencyFetcher
 from sbuildr.logger import G_LOGGER
+from sbuildr.tools.utils import str_hash
+from sbuildr.misc.locks import FileLock
 from sbuildr.misc import utils
+from typing import Dict, List
 import subprocess
+import json
+import time
 import sys
 import os
 
-# TODO: Support local repos (they should be copied to the destination instead of downloaded)
 # TODO: Support better options for version, like >, <, == etc.
 class GitFetcher(DependencyFetcher):
-    def __init__(self, url, commit: str=None, tag: str=None, branch: str="master"):
+    # The name of the file in the cache directory that stores resolved versions.
+    VERSIONS_FILENAME = "git_versions.json"
+
+    def __init__(self, url, commit: str=None, tag: str=None, branch: str="master", version_ttl: float=300):
         """
         A dependency fetcher that fetches git repositories.
+        When a cache directory is set, all fetches go through a bare mirror of the repository in the cache directory, so that each repository is only downloaded once. Checkouts are shallow, and only contain the commit being built.
 
         :param url: The URL at which the repository is located. It will be cloned from this location.
+        :param commit: The commit to fetch. If this is specified, the tag and branch are ignored.
+        :param tag: The tag to fetch. If this is specified, the branch is ignored.
+        :param branch: The branch to fetch.
+        :param version_ttl: The number of seconds for which the commit that a tag or branch refers to is cached. Within this time, resolving the version does not require any network access.
         """
-        self.url = url
+        # Local repositories are made absolute immediately, since build scripts of nested dependencies may change the working directory while dependencies are being set up.
+        self.is_local = os.path.exists(url)
+        self.url = os.path.abspath(url) if self.is_local else url
         self.commit = commit
         self.tag = tag
         self.branch = branch
+        self.version_ttl = version_ttl
+        # Versions resolved by this fetcher. These are also persisted in the cache directory if one is set.
+        self.versions: Dict[str, Dict] = {}
         super().__init__(os.path.splitext(os.path.basename(self.url))[0])
 
 
+    def _git(self, args: List[str], cwd: str=None) -> subprocess.CompletedProcess:
+        G_LOGGER.verbose(f"Running: git {' '.join(args)} in {cwd}")
+        return subprocess.run(["git"] + args, cwd=cwd, capture_output=True)
+
+
+    def _check_git(self, args: List[str], cwd: str=None) -> str:
+        status = self._git(args, cwd)
+        if status.returncode:
+            G_LOGGER.critical(f"Failed to run: git {' '.join(args)} in {cwd} with:\n{utils.subprocess_output(status)}")
+        return status.stdout.strip().decode(sys.stdout.encoding)
+
+
+    # Shallow fetches are ignored for plain local paths, so local repositories need to be specified as file:// URLs.
+    @staticmethod
+    def _fetch_url(url: str) -> str:
+        return f"file://{os.path.abspath(url)}" if os.path.isdir(url) else url
+
+
+    def _has_commit(self, commit: str, cwd: str) -> bool:
+        return os.path.isdir(cwd) and not self._git(["cat-file", "-e", f"{commit}^{{commit}}"], cwd).returncode
+
+
+    def _mirror_dir(self) -> str:
+        return os.path.join(self.cache_dir, "mirrors", f"{self.dependency_name}-{str_hash(self.url)[:8]}.git")
+
+
+    def _versions_path(self) -> str:
+        return os.path.join(self.cache_dir, GitFetcher.VERSIONS_FILENAME)
+
+
+    def _load_versions(self) -> Dict[str, Dict]:
+        if not self.cache_dir or not os.path.exists(self._versions_path()):
+            return self.versions
+        try:
+            with open(self._versions_path(), "r") as f:
+                return {**json.load(f), **self.versions}
+        except (ValueError, OSError):
+            return self.versions
+
+
+    def _save_version(self, key: str, commit: str):
+        self.versions[key] = {"commit": commit, "time": time.time()}
+        if not self.cache_dir:
+            return
+        # Other fetchers, in this process or others, may be updating the file concurrently, so reading and writing it must be serialized.
+        with FileLock(f"{self._versions_path()}.lock"):
+            versions = self._load_versions()
+            with utils.atomic_write(self._versions_path()) as f:
+                json.dump(versions, f)
+
+
+    def _ls_remote(self, ref: str) -> str:
+        status = self._git(["ls-remote", self.url, ref, f"{ref}^{{}}"])
+        if status.returncode:
+            return None
+        refs = {}
+        for line in status.stdout.decode(sys.stdout.encoding).splitlines():
+            commit, name = line.split()
+            refs[name] = commit
+        # Annotated tags need to be peeled to get the commit they point to.
+        for name in [f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", f"refs/heads/{ref}", ref]:
+            if name in refs:
+                return refs[name]
+        return None
+
+
+    def _update_mirror(self, commit: str) -> str:
+        mirror_dir = self._mirror_dir()
+        if not os.path.isdir(mirror_dir):
+            G_LOGGER.info(f"Creating mirror of: {self.url} in {mirror_dir}")
+            os.makedirs(os.path.dirname(mirror_dir), exist_ok=True)
+            self._check_git(["init", "--bare", mirror_dir])
+            # Allows checkouts to fetch only the commit they need.
+            self._check_git(["config", "uploadpack.allowAnySHA1InWant", "true"], cwd=mirror_dir)
+        if not self._has_commit(commit, mirror_dir):
+            G_LOGGER.info(f"Updating mirror of: {self.url}")
+            self._check_git(["fetch", "--prune", "--tags", self.url, "+refs/heads/*:refs/heads/*"], cwd=mirror_dir)
+            if not self._has_commit(commit, mirror_dir):
+                # The commit may not be reachable from any branch or tag.
+                self._check_git(["fetch", self.url, commit], cwd=mirror_dir)
+        return mirror_dir
+
+
     def fetch(self) -> str:
         super().fetch()
-        init_status = subprocess.run(["git", "init"], cwd=self.dest_dir, capture_output=True)
+        commit = self.version()
+        source = self._update_mirror(commit) if self.cache_dir else self.url
+
+        os.makedirs(self.dest_dir, exist_ok=True)
+        self._check_git(["init"], cwd=self.dest_dir)
+        # Relative submodule URLs are resolved against the origin, so it should point to the original repository.
+        self._git(["remote", "remove", "origin"], cwd=self.dest_dir)
+        self._check_git(["remote", "add", "origin", self.url], cwd=self.dest_dir)
 
         # Stash any local changes made by external sources
         G_LOGGER.info(f"Stashing changes in {self.dest_dir}")
-        stash_status = subprocess.run(["git", "stash"], capture_output=False, cwd=self.dest_dir)
+        self._git(["stash"], cwd=self.dest_dir)
 
-        checkout = self.commit or self.tag or self.branch
-        G_LOGGER.info(f"Pulling: {self.url} at {checkout} into {self.dest_dir}")
-        # # TODO: Error checking here? Pull may fail if this is a local repo.
-        pull_status = subprocess.run(["git", "pull", "--force", "--recurse-submodules", "--tags", self.url, checkout], capture_output=False, cwd=self.dest_dir)
+        if not self._has_commit(commit, self.dest_dir):
+            G_LOGGER.info(f"Fetching: {self.url} at {commit} into {self.dest_dir}")
+            self._check_git(["fetch", "--depth", "1", self._fetch_url(source), commit], cwd=self.dest_dir)
 
-        G_LOGGER.info(f"Checking out: {checkout}")
-        checkout_status = subprocess.run(["git", "checkout", checkout], capture_output=True, cwd=self.dest_dir)
-        if checkout_status.returncode:
-            G_LOGGER.critical(f"Failed to checkout {checkout} with:\n{utils.subprocess_output(checkout_status)}")
+        G_LOGGER.info(f"Checking out: {commit}")
+        self._check_git(["checkout", "--force", "--detach", commit], cwd=self.dest_dir)
+        if os.path.exists(os.path.join(self.dest_dir, ".gitmodules")):
+            self._check_git(["submodule", "update", "--init", "--recursive", "--depth", "1"], cwd=self.dest_dir)
         return self.dest_dir
 
 
+    def source(self, relative_to: str=None) -> str:
+        url = os.path.relpath(self.url, relative_to) if relative_to and self.is_local else self.url
+        return f"{url}@{self.commit or self.tag or self.branch}"
+
+
     def version(self) -> str:
+        """
+        Resolves the commit to fetch. Tags and branches are resolved with ``git ls-remote``, so this does not fetch the repository. If the version has been pinned, the pinned commit is used instead.
+        Resolved commits are cached in the cache directory for ``version_ttl`` seconds. If the remote cannot be reached, the most recently resolved commit is used, regardless of its age.
+
+        :returns: The commit hash.
+        """
         super().version()
         if self.commit:
             return self.commit
-        self.fetch()
-        head_status = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, cwd=self.dest_dir)
-        return head_status.stdout.strip().decode(sys.stdout.encoding)
+        if self.pinned_version:
+            return self.pinned_version
+
+        ref = self.tag or self.branch
+        key = f"{self.url}@{ref}"
+        cached = self._load_versions().get(key)
+        if cached and time.time() - cached["time"] < self.version_ttl:
+            G_LOGGER.verbose(f"Using cached version for: {key}: {cached['commit']}")
+            return cached["commit"]
+
+        commit = self._ls_remote(ref)
+        if commit is None:
+            if cached:
+                G_LOGGER.warning(f"Could not resolve: {ref} in {self.url}. Using previously resolved commit: {cached['commit']}")
+                return cached["commit"]
+            G_LOGGER.critical(f"Could not resolve: {ref} in {self.url}. Does the repository exist, and does it contain this tag or branch?")
+        self._save_version(key, commit)
+        G_LOGGER.debug(f"Resolved: {key} to {commit}")
+        return commit
@@ -0,0 +1,79 @@
+from sbuildr.dependencies.dependency import Dependency
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import utils
+
+from typing import Dict, List
+import json
+import os
+
+# Records the versions that dependencies resolved to, so that subsequent configures can use the same versions
+# without having to resolve them again. Lockfiles are JSON, and are intended to be checked into version control,
+# so they must not contain anything specific to a machine or checkout. Local sources are recorded relative to the lockfile.
+class Lockfile(object):
+    DEFAULT_NAME = "sbuildr.lock"
+    LOCKFILE_VERSION = 1
+
+    def __init__(self, path: str):
+        """
+        Manages the lockfile at the specified path. If the file exists, entries are loaded from it.
+
+        :param path: The path to the lockfile.
+        """
+        self.path = path
+        # Maps dependency names to their entries.
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                contents = json.load(f)
+            if contents.get("version") != Lockfile.LOCKFILE_VERSION:
+                G_LOGGER.warning(f"Ignoring lockfile: {self.path} since it was created by an incompatible version of SBuildr")
+            else:
+                self.entries = contents["dependencies"]
+                G_LOGGER.debug(f"Loaded lockfile: {self.path} with entries for: {list(self.entries.keys())}")
+
+
+    def _source(self, dep: Dependency) -> str:
+        return dep.fetcher.source(relative_to=os.path.dirname(os.path.abspath(self.path)))
+
+
+    def _entry(self, dep: Dependency) -> Dict:
+        return {"fetcher": type(dep.fetcher).__name__, "source": self._source(dep), "version": dep.version}
+
+
+    def pin(self, deps: List[Dependency]) -> List[Dependency]:
+        """
+        Pins dependencies to the versions recorded in the lockfile.
+        Entries are only used if the dependency's fetcher type and source match what was recorded, so modifying a dependency in the build script causes it to be resolved again.
+
+        :param deps: The dependencies to pin.
+
+        :returns: The dependencies that were pinned.
+        """
+        pinned = []
+        for dep in deps:
+            entry = self.entries.get(dep.fetcher.dependency_name)
+            if entry and entry["fetcher"] == type(dep.fetcher).__name__ and entry["source"] == self._source(dep):
+                dep.fetcher.pin_version(entry["version"])
+                pinned.append(dep)
+            elif entry:
+                G_LOGGER.info(f"Dependency: {dep} has changed since the lockfile was written. It will be resolved again.")
+        return pinned
+
+
+    def update(self, deps: List[Dependency]):
+        """
+        Records the versions of the specified dependencies. Entries for other dependencies are preserved. Must be called after the dependencies are set up.
+        The dependencies' packages are marked as referenced by this lockfile in the dependency cache, so that they are not evicted while the lockfile pins them.
+
+        :param deps: The dependencies to record.
+        """
+        for dep in deps:
+            self.entries[dep.fetcher.dependency_name] = self._entry(dep)
+            dep.cache.add_reference(dep.package_root, self.path)
+
+
+    def save(self):
+        with utils.atomic_write(self.path) as f:
+            json.dump({"version": Lockfile.LOCKFILE_VERSION, "dependencies": self.entries}, f, indent=4, sort_keys=True)
+            f.write("\n")
+        G_LOGGER.debug(f"Wrote lockfile: {self.path}")
@@ -11,19 +11,42 @@ class LibraryMetadata(object):
         self.lib_dirs = lib_dirs
 
 class DependencyMetadata(object):
-    META_API_VERSION = 1.1
+    META_API_VERSION = 1.2
+    # The file name of metadata in packages.
+    FILENAME = "meta.pkl"
 
-    def __init__(self, libraries: Dict[str, LibraryMetadata], include_dirs: List[str]):
+    def __init__(self, libraries: Dict[str, LibraryMetadata], include_dirs: List[str], dependencies: Dict[str, str]={}):
         """
         Contains metadata about a dependency.
 
         :param libraries: Maps library names to libs/lib_dirs.
         :param include_dirs: Any include directories required by this dependency.
+        :param dependencies: Maps the names of the dependencies that this dependency was built with to the roots of their packages. Libraries and include directories may refer to paths in these packages.
         """
         self.libraries: Dict[str, LibraryMetadata] = libraries
         self.include_dirs = include_dirs
+        self.dependencies: Dict[str, str] = dict(dependencies)
         self.META_API_VERSION = DependencyMetadata.META_API_VERSION # Must be tied to the instance due to how pickling works.
 
+    def relocate(self, old_root: str, new_root: str):
+        """
+        Updates any paths in this metadata that are located in old_root so that they point to the corresponding paths in new_root.
+        This is required when a package is built in one directory, then moved to another.
+
+        :param old_root: The directory in which the package was built.
+        :param new_root: The directory to which the package was moved.
+        """
+        def relocate_path(path: str) -> str:
+            if path and os.path.commonpath([path, old_root]) == old_root:
+                return os.path.normpath(os.path.join(new_root, os.path.relpath(path, old_root)))
+            return path
+
+        for lib in self.libraries.values():
+            lib.path = relocate_path(lib.path)
+            lib.lib_dirs = [relocate_path(dir) for dir in lib.lib_dirs]
+        self.include_dirs = [relocate_path(dir) for dir in self.include_dirs]
+        self.dependencies = {name: relocate_path(root) for name, root in self.dependencies.items()}
+
     @staticmethod
     def load(path: str) -> Union[None, "DependencyMetadata"]:
         with open(path, "rb") as f:
@@ -0,0 +1,146 @@
+from sbuildr.dependencies.dependency import Dependency
+from sbuildr.dependencies import cache, archive
+from sbuildr.dependencies import dependency
+from sbuildr.dependencies.meta import DependencyMetadata
+from sbuildr.logger import G_LOGGER
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Set
+import multiprocessing
+import threading
+import time
+
+# Resolves are nested when dependencies' build scripts run in-process and resolve their own dependencies, possibly while other resolves are running in other threads.
+# Nested dependencies are only known once their parents' build scripts run, so rather than building the whole graph up front, all resolves in the process share
+# one bound on the number of dependencies being set up at once, set by the outermost resolve. A setup that resolves nested dependencies lends its slot to them while it waits.
+# Garbage collection is deferred until no resolves are running, so that it never evicts packages or sources that a running resolve has set up, but not yet used.
+class _ResolveTracker(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slot_available = threading.Condition(self.lock)
+        self.active = 0
+        self.slots = 0
+        # Whether the current thread holds a slot.
+        self.holder = threading.local()
+        # Paths to packages and sources set up by resolves since garbage collection last ran.
+        self.used: Set[str] = set()
+        # Maps cache roots to the smallest size budget requested for them since garbage collection last ran.
+        self.budgets: Dict[str, int] = {}
+
+
+    def start(self, max_workers: int):
+        with self.lock:
+            if not self.active:
+                self.slots = max_workers
+            self.active += 1
+
+
+    def acquire_slot(self):
+        with self.slot_available:
+            while not self.slots:
+                self.slot_available.wait()
+            self.slots -= 1
+        self.holder.holds_slot = True
+
+
+    def release_slot(self):
+        self.holder.holds_slot = False
+        with self.slot_available:
+            self.slots += 1
+            self.slot_available.notify()
+
+
+    # Releases the current thread's slot, if it holds one, and returns whether it did.
+    def lend_slot(self) -> bool:
+        if getattr(self.holder, "holds_slot", False):
+            self.release_slot()
+            return True
+        return False
+
+
+    def finish(self, used: Set[str], budgets: Dict[str, int]):
+        with self.lock:
+            self.used.update(used)
+            for cache_root, max_size in budgets.items():
+                self.budgets[cache_root] = min(max_size, self.budgets.get(cache_root, max_size))
+            self.active -= 1
+            if self.active:
+                return
+            used, budgets = self.used, self.budgets
+            self.used, self.budgets = set(), {}
+        # Other resolves may start while garbage is collected, but any entries they use are locked while they are set up.
+        for cache_root, max_size in budgets.items():
+            cache.DependencyCache(cache_root).collect_garbage(max_size, keep=used)
+
+_RESOLVES = _ResolveTracker()
+
+class DependencyResolver(object):
+    def __init__(self, max_workers: int=None, max_cache_size: int=None):
+        """
+        Sets up dependencies concurrently.
+        Dependencies that share a name and version are only fetched and built once, even across nested projects. Nested projects resolve their dependencies when their build scripts run,
+        and share the bound on concurrent setups of the outermost resolver. The order in which dependencies were set up, along with the time taken for each, is reported once all dependencies have been set up.
+
+        :param max_workers: The maximum number of dependencies to set up concurrently, including nested dependencies. Defaults to the number of CPUs. This is ignored for resolvers used while another resolve is running, which share its bound instead.
+        :param max_cache_size: The size budget for dependency caches, in bytes. Once dependencies are set up, least recently used cache entries are evicted until each cache fits within this budget. When resolves are nested, e.g. by dependencies' build scripts, entries are only evicted once the outermost resolve finishes. Defaults to the value of the SBUILDR_CACHE_MAX_SIZE environment variable. If that is not set, nothing is evicted.
+        """
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_cache_size = max_cache_size if max_cache_size is not None else cache.max_size_from_env()
+        # Populated by resolve(). Tracks the order in which dependencies finished setting up, and the time taken for each.
+        self.order: List[Dependency] = []
+        self.times: Dict[Dependency, float] = {}
+        self._lock = threading.Lock()
+
+
+    def resolve(self, dependencies: List[Dependency]) -> Dict[Dependency, DependencyMetadata]:
+        """
+        Sets up the specified dependencies.
+
+        :param dependencies: The dependencies to set up. Duplicates are ignored.
+
+        :returns: A mapping of each dependency to its metadata.
+        """
+        unique_deps: List[Dependency] = []
+        [unique_deps.append(dep) for dep in dependencies if dep not in unique_deps]
+        if not unique_deps:
+            return {}
+
+        # Nested dependencies are set up on behalf of the dependency being set up by this thread, if any.
+        chain = dependency.setup_chain()
+
+        def setup(dep: Dependency) -> Tuple[Dependency, DependencyMetadata]:
+            _RESOLVES.acquire_slot()
+            try:
+                start = time.time()
+                with dependency.inherit_setup_chain(chain):
+                    meta = dep.setup()
+                with self._lock:
+                    self.order.append(dep)
+                    self.times[dep] = time.time() - start
+                return dep, meta
+            finally:
+                _RESOLVES.release_slot()
+
+        num_workers = min(self.max_workers, len(unique_deps))
+        G_LOGGER.debug(f"Setting up {len(unique_deps)} dependencies using {num_workers} workers")
+        used, budgets = set(), {}
+        _RESOLVES.start(self.max_workers)
+        lent_slot = _RESOLVES.lend_slot()
+        try:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                metas = dict(executor.map(setup, unique_deps))
+
+            report = [f"{dep} (version: {dep.version}): {self.times[dep]:.2f} seconds" for dep in self.order]
+            G_LOGGER.info(f"Set up dependencies in order: {report}")
+
+            if self.max_cache_size is not None:
+                # Packages and sources required by these dependencies must be kept, even if they are the least recently used,
+                # as must the packages of the dependencies that those packages were built with.
+                for dep in unique_deps:
+                    used.update([dep.package_root, dep.fetcher.dest_dir] + list(archive.transitive_dependencies(dep.package_root).values()))
+                budgets = {cache_root: self.max_cache_size for cache_root in set([dep.cache_root for dep in unique_deps])}
+        finally:
+            if lent_slot:
+                _RESOLVES.acquire_slot()
+            _RESOLVES.finish(used, budgets)
+        return metas
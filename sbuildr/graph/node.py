@@ -74,26 +74,69 @@ class SourceNode(Node):
         super().__init__(path, inputs)
         # All include directories required for this file.
         self.include_dirs = include_dirs
+        # If set, the path of a file that changes only when the tokens of this file, or the files it includes, change. See FileManager.update_fingerprints().
+        self.fingerprint_path: str = None
+        self.token_hash: str = None
+        self.token_hash_mtime: int = None
+
+    def artifacts(self) -> List[Artifact]:
+        # Nodes that depend on this file are only rebuilt when its fingerprint changes, rather than whenever the file is modified.
+        if self.fingerprint_path:
+            return [Artifact(self.fingerprint_path, dependencies=self.inputs)]
+        return super().artifacts()
+
+# A generated source file that includes several other source files, so that they are compiled as a single translation unit.
+# Its include directories are those of the files it includes, so it can only be used once they have been scanned.
+class UnitySourceNode(SourceNode):
+    def __init__(self, path: str, inputs: List[SourceNode]):
+        super().__init__(path, inputs)
+
+    def update_include_dirs(self):
+        self.include_dirs = sorted(set([dir for inp in self.inputs for dir in (inp.include_dirs or [])]))
 
 class CompiledNode(Node):
     # These include_dirs are user-specified, since any scanned dirs would be in the SourceNode.
-    def __init__(self, path: str, input: SourceNode, compiler: compiler.Compiler, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags()):
+    def __init__(self, path: str, input: SourceNode, compiler: compiler.Compiler, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags(), precompiled_header: "PrecompiledHeaderNode"=None):
         super().__init__(path, [input])
         self.compiler = compiler
         # All include directories required for this file.
         self.include_dirs = include_dirs
         self.flags = flags
+        # The precompiled header is an input in addition to the source, so that it is built first.
+        self.precompiled_header = precompiled_header
+        if precompiled_header:
+            super().add_input(precompiled_header)
 
     def add_input(self, node: SourceNode):
-        if len(self.inputs) > 0:
+        if any([isinstance(inp, SourceNode) for inp in self.inputs]):
             G_LOGGER.critical(f"Cannot create a CompiledNode with more than one source. This node already has one input: {self.inputs}")
         super().add_input(node)
 
     def artifacts(self) -> List[Artifact]:
         # The CompiledNode's include dirs take precedence over the SourceNode's. The ones in the SourceNode are
         # automatically deduced, whereas the ones in the CompiledNode are provided by the user.
+        # Objects are compiled to an intermediate path, and only published to self.path if they changed, so that touching
+        # a file without changing the resulting object, e.g. editing a comment in a header, does not cause relinking.
+        # The intermediate file is removed first since it may be a hard link of self.path, which the compiler would otherwise overwrite in place.
         commands = [utils.color_print_cmd(f"COMPILING\t{pretty_path(self.inputs[0].path)}", [Color.LIGHT_BLUE])]
-        commands.append(self.compiler.compile(self.inputs[0].path, self.path, self.include_dirs + self.inputs[0].include_dirs, self.flags))
+        commands.append(paths.remove_cmd(self.compiled_path))
+        precompiled_header = self.precompiled_header.path if self.precompiled_header else None
+        commands.append(self.compiler.compile(self.inputs[0].path, self.compiled_path, self.include_dirs + self.inputs[0].include_dirs, self.flags, precompiled_header))
+        compiled_artifact = Artifact(self.compiled_path, self.inputs, commands)
+
+        public_artifact = Artifact(self.path, dependencies=[self], commands=[paths.publish_if_changed_cmd(self.compiled_path, self.path)])
+        return [compiled_artifact, public_artifact]
+
+    # The path to which the object is compiled before being published to self.path.
+    @property
+    def compiled_path(self) -> str:
+        return f"{self.path}.compiled"
+
+# A header compiled once per set of flags, and then used by CompiledNodes in place of parsing the header for every source file.
+class PrecompiledHeaderNode(CompiledNode):
+    def artifacts(self) -> List[Artifact]:
+        commands = [utils.color_print_cmd(f"PRECOMPILING\t{pretty_path(self.inputs[0].path)}", [Color.LIGHT_BLUE])]
+        commands.append(self.compiler.precompile(self.inputs[0].path, self.path, self.include_dirs + self.inputs[0].include_dirs, self.flags))
         return [Artifact(self.path, self.inputs, commands)]
 
 # Used to represent an external library. Project libraries are LinkedNodes
@@ -139,7 +182,21 @@ class LinkedNode(Library):
 
         always = [] if self.hashed_path == self.path else [paths.force_hardlink_cmd(self.hashed_path, self.path)]
         public_artifact = Artifact(self.path, dependencies=[self], always=always)
-        return [hashed_artifact, public_artifact]
+        if not self.is_shared_library():
+            return [hashed_artifact, public_artifact]
+
+        # Only the final artifact is visible to other nodes, so dependents depend on the library's interface rather than the library itself.
+        # The interface is only rewritten when exported symbols change, so changes to function bodies do not cause dependents to be relinked.
+        interface_artifact = Artifact(self.interface_path, dependencies=[self], commands=[paths.library_interface_cmd(self.path, self.interface_path)])
+        return [hashed_artifact, public_artifact, interface_artifact]
+
+    def is_shared_library(self) -> bool:
+        return bool(self.flags._shared)
+
+    # The path of the file describing the exported interface of a shared library.
+    @property
+    def interface_path(self) -> str:
+        return f"{self.hashed_path}.interface"
 
     def __str__(self):
         return Node.__str__(self)
@@ -0,0 +1,329 @@
+# Limits the total number of jobs run concurrently by all builds in this process, including nested dependency builds.
+# Job slots are backed by a GNU make jobserver, so the limit also applies across processes: when sbuildr runs under
+# `make -j`, it takes slots from make's jobserver, and otherwise it creates its own jobserver, which is advertised to
+# child processes (rbuild, foreign build systems, nested sbuildr processes) through the MAKEFLAGS environment variable
+# returned by :func:`JobSlots.subprocess_kwargs`. This process's own environment is never modified.
+from sbuildr.logger import G_LOGGER
+
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import multiprocessing
+import subprocess
+import threading
+import tempfile
+import weakref
+import shutil
+import stat
+import re
+import os
+
+# The environment variable used to override the number of job slots. Defaults to the number of CPUs.
+JOBS_ENV_VAR = "SBUILDR_JOBS"
+MAKEFLAGS_ENV_VAR = "MAKEFLAGS"
+# How often to check the jobserver for tokens while waiting for a slot, in seconds.
+POLL_INTERVAL = 0.05
+# The token written to jobservers created by sbuildr. This is the same token GNU make uses.
+TOKEN = b"+"
+# GNU make only understands named pipe jobservers (``--jobserver-auth=fifo:PATH``) from this version onwards.
+MAKE_FIFO_VERSION = (4, 4)
+JOBSERVER_REGEX = re.compile(r"--jobserver-(?:auth|fds)=")
+
+_MAKE_SUPPORTS_FIFO = None
+
+def make_supports_fifo() -> bool:
+    """
+    Returns whether the GNU make on the PATH, if any, understands named pipe jobservers. The result is cached.
+    """
+    global _MAKE_SUPPORTS_FIFO
+    if _MAKE_SUPPORTS_FIFO is None:
+        try:
+            output = subprocess.run(["make", "--version"], capture_output=True).stdout.decode()
+        except OSError:
+            output = ""
+        version = re.search(r"GNU Make (\d+)\.(\d+)", output)
+        _MAKE_SUPPORTS_FIFO = bool(version) and tuple(int(part) for part in version.groups()) >= MAKE_FIFO_VERSION
+    return _MAKE_SUPPORTS_FIFO
+
+
+def _close(fds: List[int], tmpdir: str=None):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    if tmpdir:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class JobServer(object):
+    def __init__(self, read_fd: int, write_fd: int, fifo_path: str=None, inherited_fds: Tuple[int, int]=None):
+        """
+        A GNU make jobserver: a pipe containing one byte (token) per available job slot. Each client implicitly owns one slot,
+        and must read a token from the pipe for each additional job it runs concurrently, then write the token back when the job is done.
+
+        :param read_fd: A non-blocking file descriptor from which to read tokens.
+        :param write_fd: A file descriptor to which to write tokens back.
+        :param fifo_path: The path of the named pipe, if the jobserver uses one.
+        :param inherited_fds: The file descriptors advertised in MAKEFLAGS, if the jobserver is an anonymous pipe. These must be passed on to child processes.
+        """
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.fifo_path = fifo_path
+        self.inherited_fds = inherited_fds
+
+
+    @staticmethod
+    def create(tokens: int, fifo: bool=None) -> "JobServer":
+        """
+        Creates a new jobserver. Its pipe is closed, and any temporary directory removed, when the jobserver is garbage collected.
+
+        :param tokens: The number of tokens to place in the pipe. This should be one less than the total number of slots, since the creating process owns one slot implicitly.
+        :param fifo: Whether to use a named pipe in a temporary directory rather than an anonymous pipe. Only GNU make 4.4 and later understand named pipe jobservers,
+                so this defaults to whether the GNU make on the PATH does. Anonymous pipes are used if named pipes are not requested, or if they cannot be opened non-blockingly.
+        """
+        fifo = make_supports_fifo() if fifo is None else fifo
+        if not fifo:
+            read_fd, write_fd = os.pipe()
+            try:
+                # Reading from the pipe non-blockingly must not affect child processes that share its file description, so open a separate one.
+                own_read_fd = os.open(f"/proc/self/fd/{read_fd}", os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as err:
+                G_LOGGER.debug(f"Could not create an anonymous pipe jobserver ({err}). Falling back to a named pipe")
+                _close([read_fd, write_fd])
+                return JobServer.create(tokens, fifo=True)
+            os.write(write_fd, TOKEN * tokens)
+            server = JobServer(own_read_fd, write_fd, inherited_fds=(read_fd, write_fd))
+            weakref.finalize(server, _close, [own_read_fd, read_fd, write_fd])
+            G_LOGGER.debug(f"Created jobserver: {read_fd},{write_fd} with {tokens} token(s)")
+            return server
+
+        tmpdir = tempfile.mkdtemp(prefix="sbuildr-jobserver-")
+        fifo_path = os.path.join(tmpdir, "fifo")
+        os.mkfifo(fifo_path, 0o600)
+        # The read end must be opened first, otherwise opening the write end blocks.
+        read_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        write_fd = os.open(fifo_path, os.O_WRONLY)
+        os.write(write_fd, TOKEN * tokens)
+        server = JobServer(read_fd, write_fd, fifo_path=fifo_path)
+        weakref.finalize(server, _close, [read_fd, write_fd], tmpdir)
+        G_LOGGER.debug(f"Created jobserver: {fifo_path} with {tokens} token(s)")
+        return server
+
+
+    @staticmethod
+    def from_makeflags(makeflags: str) -> "JobServer":
+        """
+        Connects to the jobserver advertised in MAKEFLAGS. Supports both named pipes (``--jobserver-auth=fifo:PATH``, GNU make 4.4 and later)
+        and anonymous pipes (``--jobserver-auth=R,W``, or ``--jobserver-fds=R,W`` prior to GNU make 4.2).
+
+        :param makeflags: The contents of the MAKEFLAGS environment variable.
+
+        :returns: The jobserver, or None if MAKEFLAGS does not specify one, or it is not usable by this process.
+        """
+        matches = re.findall(r"--jobserver-(?:auth|fds)=(\S+)", makeflags)
+        if not matches:
+            return None
+        # Nested makes append their own flags, so the last occurrence takes precedence.
+        auth = matches[-1]
+
+        if auth.startswith("fifo:"):
+            fifo_path = auth[len("fifo:"):]
+            try:
+                read_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+                write_fd = os.open(fifo_path, os.O_WRONLY)
+            except OSError as err:
+                G_LOGGER.warning(f"Could not open jobserver: {fifo_path} ({err})")
+                return None
+            server = JobServer(read_fd, write_fd, fifo_path=fifo_path)
+            weakref.finalize(server, _close, [read_fd, write_fd])
+            return server
+
+        try:
+            inherited_fds = tuple(int(fd) for fd in auth.split(","))
+            read_fd, write_fd = inherited_fds
+            if not all(stat.S_ISFIFO(os.fstat(fd).st_mode) for fd in inherited_fds):
+                raise OSError("not a pipe")
+            # Reading from the inherited file description non-blockingly would make it non-blocking for every process sharing it,
+            # so open a separate description of the same pipe instead.
+            own_read_fd = os.open(f"/proc/self/fd/{read_fd}", os.O_RDONLY | os.O_NONBLOCK)
+        except (ValueError, OSError) as err:
+            G_LOGGER.warning(f"Jobserver file descriptors: {auth} are not available ({err}). If sbuildr is run by make, prefix the command with '+' so that make passes the jobserver to it.")
+            return None
+        server = JobServer(own_read_fd, write_fd, inherited_fds=inherited_fds)
+        weakref.finalize(server, _close, [own_read_fd])
+        return server
+
+
+    def try_acquire(self) -> bytes:
+        """
+        Reads a token from the jobserver without blocking.
+
+        :returns: The token, or None if no tokens are available.
+        """
+        try:
+            token = os.read(self.read_fd, 1)
+        except (BlockingIOError, InterruptedError):
+            return None
+        return token or None
+
+
+    def release(self, token: bytes):
+        os.write(self.write_fd, token)
+
+
+    def makeflags(self, total: int) -> str:
+        """
+        Returns the MAKEFLAGS entries that advertise this jobserver to child processes.
+        Anonymous pipes are advertised with both ``--jobserver-auth`` and ``--jobserver-fds``, which GNU make used prior to 4.2.
+        """
+        if self.fifo_path:
+            return f"-j{total} --jobserver-auth=fifo:{self.fifo_path}"
+        read_fd, write_fd = self.inherited_fds
+        return f"-j{total} --jobserver-fds={read_fd},{write_fd} --jobserver-auth={read_fd},{write_fd}"
+
+
+class JobSlots(object):
+    def __init__(self, total: int, jobserver: JobServer=None, export: bool=False, makeflags: str=None):
+        """
+        A pool of job slots shared by concurrent builds. Each build reserves some number of slots, and runs at most that many jobs.
+
+        :param total: The total number of slots.
+        :param jobserver: The jobserver from which to take slots. If this is not provided, a new jobserver with ``total`` slots is created when slots are first needed.
+        :param export: Whether to advertise a newly created jobserver to child processes, through the environment returned by :func:`subprocess_kwargs` .
+        :param makeflags: The contents of MAKEFLAGS advertising an existing jobserver from which to take slots, if ``jobserver`` is not provided.
+                The jobserver is only connected to when slots are first needed. If it is not usable, slots are not shared with it, and there is only one slot.
+        """
+        self.total = max(total, 1)
+        # The number of slots not reserved by this process.
+        self.available = self.total
+        self.jobserver = jobserver
+        self.export = export
+        self.makeflags = makeflags
+        # Whether the jobserver was created by this pool, rather than provided or inherited.
+        self.created = False
+        # Every jobserver client owns one slot implicitly. In this process, it is shared by all threads.
+        self.implicit_available = True
+        # The number of reservations in this process that are held or being waited for.
+        self.reservations = 0
+        self.condition = threading.Condition()
+
+
+    @staticmethod
+    def from_environment() -> "JobSlots":
+        """
+        Creates job slots backed by the jobserver in MAKEFLAGS if there is one. Otherwise, the number of slots is given by :func:`default_job_count`,
+        and the jobserver created for them is exported to child processes. In either case, no jobserver is opened or created until slots are first needed.
+        """
+        makeflags = os.environ.get(MAKEFLAGS_ENV_VAR, "")
+        if JOBSERVER_REGEX.search(makeflags):
+            total = re.findall(r"(?:^|\s)-?j(\d+)\b", makeflags)
+            return JobSlots(int(total[-1]) if total else default_job_count(), makeflags=makeflags)
+        return JobSlots(default_job_count(), export=True)
+
+
+    def _jobserver(self) -> JobServer:
+        # Must be called with the condition held, before any slots are reserved.
+        if self.jobserver is None and self.makeflags:
+            self.jobserver = JobServer.from_makeflags(self.makeflags)
+            if self.jobserver is None:
+                # Like make, run serially rather than risk exceeding the outer limit.
+                self.total = self.available = 1
+            else:
+                G_LOGGER.debug(f"Using jobserver from {MAKEFLAGS_ENV_VAR}: {self.makeflags}")
+            self.makeflags = None
+        if self.jobserver is None:
+            self.jobserver = JobServer.create(self.total - 1)
+            self.created = True
+        return self.jobserver
+
+
+    def subprocess_kwargs(self, env: Dict[str, str]=None) -> Dict:
+        """
+        Returns keyword arguments for ``subprocess`` functions that allow child processes to use this pool's jobserver.
+        Child processes should be run while holding a reservation, so that they can use the slot it implicitly gives them.
+
+        :param env: The environment for child processes. Defaults to this process's environment, which is not modified.
+
+        :returns: The keyword arguments, including an ``env`` that advertises the jobserver in MAKEFLAGS, if it is exported.
+        """
+        with self.condition:
+            jobserver = self._jobserver()
+        env = dict(os.environ if env is None else env)
+        if self.export and self.created:
+            makeflags = env.get(MAKEFLAGS_ENV_VAR, "")
+            env[MAKEFLAGS_ENV_VAR] = f"{makeflags} {jobserver.makeflags(self.total)}".strip()
+        kwargs = {"env": env}
+        if jobserver.inherited_fds:
+            kwargs["pass_fds"] = jobserver.inherited_fds
+        return kwargs
+
+
+    @contextmanager
+    def reserve(self, max_count: int=None) -> int:
+        """
+        Reserves job slots for the duration of the context. Blocks until at least one slot is available, then reserves as many available slots as possible, up to ``max_count``.
+
+        :param max_count: The maximum number of slots to reserve. Defaults to a fair share of all slots, i.e. the total divided by the number of reservations in this process
+                that are held or being waited for, including this one. This way, concurrent builds, e.g. of nested dependencies, do not leave one another with a single slot.
+
+        :returns: The number of slots reserved.
+        """
+        implicit = False
+        tokens = []
+        with self.condition:
+            jobserver = self._jobserver()
+            self.reservations += 1
+            waiting = False
+            while True:
+                if self.implicit_available:
+                    self.implicit_available = False
+                    implicit = True
+                    break
+                token = jobserver.try_acquire()
+                if token is not None:
+                    tokens.append(token)
+                    break
+                if not waiting:
+                    G_LOGGER.debug(f"Waiting for job slots")
+                    waiting = True
+                # Slots may be released by other threads in this process, which notify the condition, or by other processes, so poll the jobserver as well.
+                self.condition.wait(POLL_INTERVAL)
+
+            # The fair share is computed once the first slot is reserved, since reservations that finished in the meantime no longer need a share.
+            max_count = min(max_count or max(self.total // self.reservations, 1), self.total)
+            while implicit + len(tokens) < max_count:
+                token = jobserver.try_acquire()
+                if token is None:
+                    break
+                tokens.append(token)
+            count = implicit + len(tokens)
+            self.available -= count
+        G_LOGGER.verbose(f"Reserved {count} job slot(s). {self.available} of {self.total} remaining in this process")
+        try:
+            yield count
+        finally:
+            with self.condition:
+                for token in tokens:
+                    jobserver.release(token)
+                if implicit:
+                    self.implicit_available = True
+                self.available += count
+                self.reservations -= 1
+                self.condition.notify_all()
+
+
+def default_job_count() -> int:
+    """
+    Returns the number of job slots specified by the SBUILDR_JOBS environment variable, or the number of CPUs if it is not set.
+    """
+    jobs = os.environ.get(JOBS_ENV_VAR)
+    if jobs:
+        try:
+            return int(jobs)
+        except ValueError:
+            G_LOGGER.warning(f"Ignoring invalid value for {JOBS_ENV_VAR}: {jobs}")
+    return multiprocessing.cpu_count()
+
+
+# The job slots shared by everything in this process. Connecting to or creating the jobserver is deferred until slots are first needed.
+G_JOB_SLOTS = JobSlots.from_environment()
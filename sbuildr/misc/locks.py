@@ -0,0 +1,56 @@
+from sbuildr.logger import G_LOGGER
+
+import fcntl
+import time
+import os
+
+class FileLock(object):
+    def __init__(self, path: str):
+        """
+        An exclusive, inter-process lock backed by a lock file. The lock is released automatically if the process holding it exits.
+        Can be used as a context manager, in which case acquisition blocks until the lock is available.
+
+        :param path: The path of the lock file. It is created if it does not already exist.
+        """
+        self.path = path
+        self.fd = None
+
+
+    def acquire(self, blocking: bool=True) -> bool:
+        """
+        Acquires the lock.
+
+        :param blocking: Whether to wait for the lock if it is held by someone else.
+
+        :returns: Whether the lock was acquired.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not blocking:
+                os.close(fd)
+                return False
+            G_LOGGER.info(f"Waiting for lock: {self.path}")
+            start = time.time()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            G_LOGGER.debug(f"Acquired lock: {self.path} after {time.time() - start} seconds")
+        self.fd = fd
+        return True
+
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -5,6 +5,10 @@ from typing import List
 import pathlib
 import os
 
+# The default file name of exported projects. This lives here rather than in Project so that the sbuildr
+# command-line utility can use it without importing the entire project module.
+DEFAULT_SAVED_PROJECT_NAME = "project.sbuildr"
+
 # TODO: Edit these functions to take into account other platforms, and maybe move to another location.
 # Inserts suffix into path, just before the extension
 def insert_suffix(path: str, suffix: str) -> str:
@@ -16,6 +20,25 @@ def insert_suffix(path: str, suffix: str) -> str:
 def force_hardlink_cmd(source: str, dest: str) -> List[str]:
     return ["ln", "-f", source, dest]
 
+def remove_cmd(path: str) -> List[str]:
+    return ["rm", "-f", path]
+
+# Hard links source to dest unless their contents are already identical, in which case dest, and its timestamp, are left untouched.
+# This provides early cutoff for timestamp-based executors: artifacts that depend on dest are not rebuilt when source is rebuilt without changing.
+def publish_if_changed_cmd(source: str, dest: str) -> List[str]:
+    return ["sh", "-c", 'cmp -s "$0" "$1" || ln -f "$0" "$1"', source, dest]
+
+# Writes the interface of a shared library, i.e. its exported dynamic symbols and SONAME, to dest, unless it is unchanged, in which case dest, and its timestamp, are left untouched.
+# Addresses and function sizes are omitted, since they change whenever function bodies do, but sizes of data symbols are kept, since they are part of the ABI.
+def library_interface_cmd(library: str, dest: str) -> List[str]:
+    script = """set -e
+nm -D --defined-only -P "$0" > "$1.nm"
+awk '{ print $1, $2, ($2 ~ /^[BbDdGgRrSsVv]$/ ? $4 : "") }' "$1.nm" | LC_ALL=C sort > "$1.new"
+rm -f "$1.nm"
+readelf --dynamic --wide "$0" | grep "(SONAME)" | sed 's/^ *0x[0-9a-f]* *//' >> "$1.new" || true
+if cmp -s "$1.new" "$1"; then rm -f "$1.new"; else mv -f "$1.new" "$1"; fi"""
+    return ["sh", "-c", script, library, dest]
+
 def dependency_cache_root():
     """
     Returns the path to the root of the dependency cache directory.
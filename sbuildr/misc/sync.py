@@ -0,0 +1,223 @@
+# Incremental, rsync-like copying of files and directory trees.
+from sbuildr.logger import G_LOGGER
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import hashlib
+import shutil
+import fcntl
+import enum
+import uuid
+import os
+
+class LinkMode(enum.Enum):
+    # Always make full copies. Where supported, copy_file_range(2) is used so that data is copied within the kernel.
+    COPY = "copy"
+    # Use copy-on-write clones (e.g. on btrfs or XFS) if the filesystem supports them, and copy otherwise.
+    # Clones share storage with the source, but are otherwise independent files.
+    REFLINK = "reflink"
+    # Hardlink files. This is the fastest mode, but since the source and destination share the same file,
+    # any modification to the destination also modifies the source. Falls back to copying when the source
+    # and destination are on different filesystems.
+    HARDLINK = "hardlink"
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Tracks what a sync did.
+class SyncStats(object):
+    def __init__(self):
+        self.copied: List[str] = []
+        self.skipped: List[str] = []
+        self.deleted: List[str] = []
+        self.failed: List[str] = []
+
+
+    def __str__(self) -> str:
+        return f"{len(self.copied)} copied, {len(self.skipped)} unchanged, {len(self.deleted)} deleted" + (f", {len(self.failed)} failed" if self.failed else "")
+
+
+def file_hash(path: str) -> str:
+    hasher = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def is_up_to_date(src: str, dst: str, compare_hashes: bool=False) -> bool:
+    """
+    Determines whether dst is identical to src. Files are considered identical if they have the same size and modification time.
+
+    :param src: The source file.
+    :param dst: The destination file.
+    :param compare_hashes: Whether to compare file contents when modification times differ. This is slower, but avoids copying files that were touched without being modified.
+
+    :returns: Whether dst is up to date.
+    """
+    try:
+        src_stat, dst_stat = os.stat(src), os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    return compare_hashes and file_hash(src) == file_hash(dst)
+
+
+def _reflink(src: str, dst: str):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src: str, dst: str):
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        remaining = os.fstat(src_file.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src_file.fileno(), dst_file.fileno(), remaining)
+            if not copied:
+                break
+            remaining -= copied
+    shutil.copystat(src, dst)
+
+
+def _copy(src: str, dst: str):
+    if hasattr(os, "copy_file_range"):
+        try:
+            _copy_file_range(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def sync_file(src: str, dst: str, link_mode: LinkMode=LinkMode.REFLINK, compare_hashes: bool=False) -> bool:
+    """
+    Copies src to dst if dst is not already up to date. Up to date files are not modified, so their timestamps are preserved.
+    Files are replaced atomically, so readers never observe partially written files.
+
+    :param src: The source file.
+    :param dst: The destination path. Parent directories are created if they do not exist.
+    :param link_mode: How to copy the file.
+    :param compare_hashes: Whether to compare file contents when modification times differ.
+
+    :returns: Whether the file was copied.
+    """
+    if os.path.islink(src):
+        target = os.readlink(src)
+        if os.path.islink(dst) and os.readlink(dst) == target:
+            return False
+    elif not os.path.islink(dst) and is_up_to_date(src, dst, compare_hashes):
+        return False
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    # The temporary file is uniquely named, so that concurrent copies to the same destination, e.g. from other processes, do not clobber one another's files.
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.{uuid.uuid4().hex}.tmp")
+    try:
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), tmp_path)
+        elif link_mode == LinkMode.HARDLINK:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                _copy(src, tmp_path)
+        elif link_mode == LinkMode.REFLINK:
+            try:
+                _reflink(src, tmp_path)
+            except OSError:
+                _copy(src, tmp_path)
+        else:
+            _copy(src, tmp_path)
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    G_LOGGER.verbose(f"Copied: {src} to {dst} ({link_mode.value})")
+    return True
+
+
+def sync_tree(src: str, dst: str, link_mode: LinkMode=LinkMode.REFLINK, compare_hashes: bool=False, delete: bool=True, exclude: List[str]=[]) -> SyncStats:
+    """
+    Incrementally synchronizes the directory dst with src. Only files that are new or have changed are copied, and files in dst that are not present in src are deleted.
+
+    :param src: The source directory.
+    :param dst: The destination directory. It is created if it does not exist.
+    :param link_mode: How to copy files.
+    :param compare_hashes: Whether to compare file contents when modification times differ.
+    :param delete: Whether to delete files and directories in dst that do not exist in src.
+    :param exclude: Paths, relative to src and dst, that are neither copied nor deleted, for example, build directories in dst.
+
+    :returns: A summary of the files that were copied, skipped and deleted.
+    """
+    stats = SyncStats()
+    excluded = set([os.path.normpath(path) for path in exclude])
+    os.makedirs(dst, exist_ok=True)
+    for src_root, dirs, files in os.walk(src):
+        relroot = os.path.relpath(src_root, src)
+        dst_root = os.path.normpath(os.path.join(dst, relroot))
+        if src_root != src and os.path.lexists(dst_root) and (os.path.islink(dst_root) or not os.path.isdir(dst_root)):
+            os.remove(dst_root)
+        os.makedirs(dst_root, exist_ok=True)
+        is_excluded = lambda name: os.path.normpath(os.path.join(relroot, name)) in excluded
+        dirs[:] = [dir for dir in dirs if not is_excluded(dir)]
+        files = [name for name in files if not is_excluded(name)]
+        # Symlinks to directories are copied as links, rather than followed.
+        links = [dir for dir in dirs if os.path.islink(os.path.join(src_root, dir))]
+        dirs[:] = [dir for dir in dirs if dir not in links]
+        for name in files + links:
+            dst_path = os.path.join(dst_root, name)
+            if sync_file(os.path.join(src_root, name), dst_path, link_mode, compare_hashes):
+                stats.copied.append(dst_path)
+            else:
+                stats.skipped.append(dst_path)
+
+        if delete:
+            expected = set(dirs + files + links)
+            for name in os.listdir(dst_root):
+                if name in expected or is_excluded(name):
+                    continue
+                path = os.path.join(dst_root, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                stats.deleted.append(path)
+    G_LOGGER.debug(f"Synchronized: {src} to {dst}: {stats}")
+    return stats
+
+
+def sync_files(pairs: List[Tuple[str, str]], link_mode: LinkMode=LinkMode.REFLINK, compare_hashes: bool=False, max_workers: int=None) -> SyncStats:
+    """
+    Concurrently copies files that are not already up to date. See :func:`sync_file` for details.
+
+    :param pairs: Tuples of (source, destination) paths.
+    :param link_mode: How to copy files.
+    :param compare_hashes: Whether to compare file contents when modification times differ.
+    :param max_workers: The maximum number of files to copy at once. Defaults to the ThreadPoolExecutor default.
+
+    :returns: A summary of the files that were copied, skipped, and could not be written due to insufficient permissions.
+    """
+    def sync(src: str, dst: str) -> bool:
+        try:
+            return sync_file(src, dst, link_mode, compare_hashes)
+        except PermissionError:
+            G_LOGGER.error(f"Could not write to {dst}. Do you have sufficient privileges?")
+            return None
+
+    stats = SyncStats()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(dst, executor.submit(sync, src, dst)) for src, dst in pairs]
+        for dst, future in futures:
+            copied = future.result()
+            if copied is None:
+                stats.failed.append(dst)
+            elif copied:
+                stats.copied.append(dst)
+            else:
+                stats.skipped.append(dst)
+    return stats
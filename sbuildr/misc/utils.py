@@ -1,7 +1,9 @@
 from sbuildr.logger import G_LOGGER, Color, color_string
 
-from typing import List
+from contextlib import contextmanager
+from typing import IO, List
 import subprocess
+import tempfile
 import shutil
 import time
 import sys
@@ -24,6 +26,56 @@ def wrap_str(inp: str, wrap: str='='):
     terminal_width, _ = shutil.get_terminal_size()
     return inp.center(terminal_width, wrap)
 
+@contextmanager
+def atomic_write(path: str, mode: str="w") -> IO:
+    """
+    Opens a file for writing, such that readers never observe it partially written. Contents are written to a uniquely named temporary file
+    in the same directory, which replaces the file only once writing succeeds. Concurrent writers do not interfere with each other, and the last one to finish wins.
+
+    :param path: The path of the file.
+    :param mode: The mode in which to open the file, e.g. "w" or "wb".
+
+    :returns: The open temporary file.
+    """
+    dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        # Temporary files are only readable by their owner, unlike other files written by sbuildr, which may be shared, e.g. archives.
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def replace_dir(src: str, dst: str):
+    """
+    Moves a directory into place, replacing any existing directory at the destination. The existing directory is first renamed aside,
+    and only removed once the new one is in place, so the destination is never observed partially removed. Processes that have files
+    from the existing directory open can continue to use them.
+
+    :param src: The directory to move. It must be on the same filesystem as the destination.
+    :param dst: The destination path.
+    """
+    old = None
+    if os.path.lexists(dst):
+        # Hidden, so that it is not mistaken for a complete directory, e.g. by the dependency cache.
+        old = tempfile.mkdtemp(prefix=f".{os.path.basename(dst)}.old.", dir=os.path.dirname(os.path.abspath(dst)))
+        os.rename(dst, old)
+    try:
+        os.rename(src, dst)
+    except BaseException:
+        if old:
+            os.rename(old, dst)
+        raise
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+
 # Copies src to dst. dst may be either a complete path or containing directory.
 def copy_path(src: str, dst: str) -> bool:
     try:
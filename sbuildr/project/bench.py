@@ -0,0 +1,111 @@
+# Runs benchmark executables repeatedly, computes timing statistics, and compares them against a stored baseline.
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import utils
+
+from typing import Dict, List
+import subprocess
+import statistics
+import json
+import time
+import os
+
+class BenchmarkStats(object):
+    def __init__(self, samples: List[float]):
+        """
+        Timing statistics for a benchmark.
+
+        :param samples: The time taken by each repetition, in seconds.
+        """
+        self.samples = samples
+        self.median = statistics.median(samples)
+        # The median absolute deviation is robust to outliers, e.g. from other processes briefly running on the same CPU.
+        self.mad = statistics.median([abs(sample - self.median) for sample in samples])
+        self.mean = statistics.mean(samples)
+        self.min = min(samples)
+        self.max = max(samples)
+
+
+    def to_json(self) -> Dict:
+        return {"median": self.median, "mad": self.mad, "mean": self.mean, "min": self.min, "max": self.max, "samples": self.samples}
+
+
+    def __str__(self) -> str:
+        return f"median: {self.median:.6f}s, MAD: {self.mad:.6f}s, min: {self.min:.6f}s, max: {self.max:.6f}s ({len(self.samples)} repetitions)"
+
+
+def run_benchmark(cmd: List[str], env: Dict[str, str]=None, warmup: int=1, repetitions: int=10, cpu: int=None) -> BenchmarkStats:
+    """
+    Runs a benchmark repeatedly, timing each run.
+
+    :param cmd: The command to run.
+    :param env: The environment in which to run the command.
+    :param warmup: The number of untimed runs before timing begins, e.g. to warm up caches.
+    :param repetitions: The number of timed runs.
+    :param cpu: The index of a CPU to which to pin the benchmark. Ideally, this CPU should be isolated from the scheduler, e.g. with the ``isolcpus`` kernel parameter. Defaults to no pinning.
+
+    :returns: Statistics for the timed runs.
+    """
+    if repetitions < 1:
+        G_LOGGER.critical(f"Benchmarks must be run at least once, but {repetitions} repetitions were requested")
+
+    def pin():
+        os.sched_setaffinity(0, {cpu})
+
+    if cpu is not None and not hasattr(os, "sched_setaffinity"):
+        G_LOGGER.critical(f"Pinning benchmarks to a CPU is not supported on this platform")
+
+    def run() -> float:
+        start = time.perf_counter()
+        status = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=pin if cpu is not None else None)
+        elapsed = time.perf_counter() - start
+        if status.returncode:
+            G_LOGGER.critical(f"Benchmark: {' '.join(cmd)} failed with return code: {status.returncode}:\n{status.stdout.decode(errors='replace')}")
+        return elapsed
+
+    for _ in range(warmup):
+        run()
+    return BenchmarkStats([run() for _ in range(repetitions)])
+
+
+class Baseline(object):
+    BASELINE_VERSION = 1
+
+    def __init__(self, path: str):
+        """
+        Benchmark results to compare against. Baselines are JSON, and may be checked into version control.
+
+        :param path: The path to the baseline file. If the file exists, results are loaded from it.
+        """
+        self.path = path
+        # Maps benchmark names to their recorded statistics.
+        self.results: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                contents = json.load(f)
+            if contents.get("version") != Baseline.BASELINE_VERSION:
+                G_LOGGER.warning(f"Ignoring benchmark baseline: {self.path} since it was created by an incompatible version of SBuildr")
+            else:
+                self.results = contents["benchmarks"]
+
+
+    def change(self, name: str, stats: BenchmarkStats) -> float:
+        """
+        Computes the relative change in median time compared to the baseline, e.g. 0.1 if the benchmark is 10% slower.
+
+        :returns: The relative change, or None if the baseline has no result for the benchmark.
+        """
+        if name not in self.results or not self.results[name]["median"]:
+            return None
+        return (stats.median - self.results[name]["median"]) / self.results[name]["median"]
+
+
+    def update(self, results: Dict[str, BenchmarkStats]):
+        for name, stats in results.items():
+            self.results[name] = stats.to_json()
+
+
+    def save(self):
+        with utils.atomic_write(self.path) as f:
+            json.dump({"version": Baseline.BASELINE_VERSION, "benchmarks": self.results}, f, indent=4, sort_keys=True)
+            f.write("\n")
+        G_LOGGER.info(f"Wrote benchmark baseline: {self.path}")
@@ -0,0 +1,85 @@
+# Determines which files have changed since a git revision or a point in time.
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import utils
+
+from typing import Iterable, Set
+import subprocess
+import datetime
+import os
+
+def parse_timestamp(since: str) -> float:
+    """
+    Parses a point in time, specified either as seconds since the epoch, optionally prefixed with "@" as in ``date``, e.g. "@1578659400",
+    or in ISO 8601 format, e.g. "2020-01-10" or "2020-01-10T12:30:00".
+
+    :returns: The time in seconds since the epoch, or None if ``since`` is not a timestamp.
+    """
+    try:
+        return float(since[1:] if since.startswith("@") else since)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(since).timestamp()
+    except ValueError:
+        return None
+
+
+def _git(args, cwd: str) -> str:
+    status = subprocess.run(["git"] + args, cwd=cwd, capture_output=True)
+    if status.returncode:
+        G_LOGGER.critical(f"Failed to run: git {' '.join(args)} in {cwd} with:\n{utils.subprocess_output(status)}")
+    return status.stdout.decode()
+
+
+def is_revision(since: str, root: str) -> bool:
+    """
+    Determines whether ``since`` names a commit in the git repository containing ``root``.
+    Abbreviated commit hashes may consist only of digits, so this should be checked before interpreting ``since`` as a timestamp.
+
+    :param since: The string to check, for example a branch name or commit.
+    :param root: A directory, which need not be in a git repository.
+
+    :returns: Whether ``since`` is a git revision.
+    """
+    # Names starting with "-" would be interpreted as options.
+    if since.startswith("-"):
+        return False
+    try:
+        status = subprocess.run(["git", "rev-parse", "--verify", "--quiet", f"{since}^{{commit}}"], cwd=root, capture_output=True)
+    except FileNotFoundError:
+        return False
+    return status.returncode == 0
+
+
+def changed_since_revision(rev: str, root: str) -> Set[str]:
+    """
+    Finds files that differ from a git revision, including uncommitted and untracked files.
+
+    :param rev: The git revision, for example a branch name or commit.
+    :param root: A directory in the git repository.
+
+    :returns: The absolute paths of the changed files. Deleted files are included.
+    """
+    toplevel = _git(["rev-parse", "--show-toplevel"], cwd=root).strip()
+    changed = _git(["diff", "--name-only", "--no-renames", rev, "--"], cwd=toplevel).splitlines()
+    changed += _git(["ls-files", "--others", "--exclude-standard"], cwd=toplevel).splitlines()
+    return set([os.path.join(toplevel, path) for path in changed if path])
+
+
+def changed_since_time(timestamp: float, paths: Iterable[str]) -> Set[str]:
+    """
+    Finds files that were modified after the specified time.
+
+    :param timestamp: The time in seconds since the epoch.
+    :param paths: The files to check.
+
+    :returns: The paths of files that were modified after ``timestamp``, or no longer exist.
+    """
+    changed = set()
+    for path in paths:
+        try:
+            if os.path.getmtime(path) > timestamp:
+                changed.add(path)
+        except OSError:
+            changed.add(path)
+    return changed
@@ -2,7 +2,8 @@ from sbuildr.graph.node import Node, SourceNode
 from sbuildr.graph.graph import Graph
 from sbuildr.logger import G_LOGGER
 
-from typing import Set, Dict, Tuple, List
+from typing import Set, Dict, Tuple, List, Callable
+import hashlib
 import shutil
 import glob
 import os
@@ -13,9 +14,33 @@ import re
 INCLUDE_REGEX = re.compile(r'(?:(?<!\/\/\s))#include [<"]([^>"]*)[>"]')
 # Finds all tokens #include'd by a file.
 # These are not necessarily full paths.
-def _find_included(filename: str) -> Set[str]:
-    with open(filename, 'r') as file:
-        return set(INCLUDE_REGEX.findall(file.read()))
+def _find_included(contents: str) -> Set[str]:
+    return set(INCLUDE_REGEX.findall(contents))
+
+# Matches comments, as well as string and character literals, since these may contain sequences that look like comments.
+COMMENT_OR_LITERAL_REGEX = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+# Matches tokens: literals, identifiers and numbers, multi-character operators and any other single character.
+TOKEN_REGEX = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[\w.]+|->\*?|<<=|>>=|<=>|\+\+|--|<<|>>|&&|\|\||::|##|[-+*/%&|^!=<>]=|\S')
+# Computes a hash of the tokens in a file, which does not change when only comments or whitespace do.
+# Whitespace is significant in preprocessor directives though, e.g. `#define F(x) x` defines a function-like macro, but `#define F (x) x` does not,
+# so in directives, whether tokens are separated by whitespace is part of the hash, but not the amount or kind of whitespace.
+def _token_hash(contents: str) -> str:
+    contents = COMMENT_OR_LITERAL_REGEX.sub(lambda match: match.group(0) if match.group(0)[0] in "\"'" else " ", contents)
+    contents = contents.replace("\\\n", "")
+    tokens = []
+    for line in contents.splitlines():
+        matches = list(TOKEN_REGEX.finditer(line))
+        if matches and matches[0].group(0) == "#":
+            for previous, match in zip([None] + matches[:-1], matches):
+                # Whitespace between the '#' and the directive name is never significant.
+                if previous and previous is not matches[0] and previous.end() != match.start():
+                    tokens.append(" ")
+                tokens.append(match.group(0))
+            # Preprocessor directives end at the end of the line, so line breaks after them are significant.
+            tokens.append("\n")
+        else:
+            tokens.extend([match.group(0) for match in matches])
+    return hashlib.blake2b("\0".join(tokens).encode(), digest_size=16).hexdigest()
 
 def _is_in_directory(path: str, dir: str):
     # e.g. for _is_in_directory(/my/dir/my/path, /my/dir/), commonpath == dir.
@@ -38,7 +63,12 @@ class FileManager(object):
         self.include_dirs: List[str] = []
         self.header_files: List[str] = [] # List to enable header priority
 
-        self.files: Set[str] = set()
+        # The directories that were searched for files, so that the file index can be rebuilt. See files.
+        self.dirs: List[str] = []
+        self._files: Set[str] = set()
+        self._load_files: Callable[[], List[str]] = None
+        # If set, fingerprints of the tokens in each source file are written to this directory. See update_fingerprints().
+        self.fingerprint_dir: str = None
 
         self.root_dir = os.path.abspath(root_dir)
         if not os.path.isdir(self.root_dir):
@@ -54,6 +84,46 @@ class FileManager(object):
         self.graph = Graph()
 
 
+    @property
+    def files(self) -> Set[str]:
+        # The file index is not pickled, since it is large and not always needed. It is loaded on first access instead, or rebuilt if it cannot be loaded.
+        if self._files is None:
+            if self._load_files:
+                self._files = set(self._load_files())
+                self._load_files = None
+            else:
+                G_LOGGER.debug(f"Rebuilding file index from: {self.dirs}")
+                self._files = set([path for dir in self.dirs for path in self._files_in_dir(dir)])
+        return self._files
+
+    @files.setter
+    def files(self, files: Set[str]):
+        self._files = files
+        self._load_files = None
+
+    def set_files_loader(self, load_files: Callable[[], List[str]]):
+        """
+        Sets a function that loads the file index when it is first accessed, replacing the current index.
+
+        :param load_files: A function that returns the paths of all files in the project.
+        """
+        self._files = None
+        self._load_files = load_files
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_files"] = None
+        state["_load_files"] = None
+        return state
+
+    def __setstate__(self, state):
+        # Projects exported by older versions of SBuildr include the file index, but not the directories it was built from.
+        if "files" in state:
+            state["_files"] = state.pop("files")
+            state["_load_files"] = None
+        state.setdefault("dirs", [])
+        self.__dict__.update(state)
+
     # Finds all files recursively in the specified directory.
     def _files_in_dir(self, dir: str):
         dir = self.abspath(dir)
@@ -68,6 +138,7 @@ class FileManager(object):
 
     # TODO: FIXME: This does not handle directories inside exclude directories correctly.
     def add_dir(self, dir: str):
+        self.dirs.append(self.abspath(dir))
         self.files.update(self._files_in_dir(dir))
 
     def add_include_dir(self, dir: str):
@@ -155,6 +226,89 @@ class FileManager(object):
             return self.graph.add(SourceNode(candidates[0]))
         return node
 
+    # Returns all directories that contain files tracked by this FileManager.
+    def watch_dirs(self) -> Set[str]:
+        return set([self.root_dir] + [os.path.dirname(path) for path in list(self.files) + self.header_files])
+
+    # Updates the file index based on paths that were created, modified or removed.
+    # Returns the SourceNodes corresponding to the paths that changed.
+    def update(self, changed_paths: Set[str]) -> List[SourceNode]:
+        changed_nodes = []
+        for path in changed_paths:
+            if os.path.isfile(path):
+                if path not in self.files and not _is_in_directories(path, self.exclude_dirs):
+                    G_LOGGER.verbose(f"Adding new file: {path}")
+                    self.files.add(path)
+            else:
+                self.files.discard(path)
+            node = self.graph.find_node_with_path(path)
+            if isinstance(node, SourceNode):
+                changed_nodes.append(node)
+        return changed_nodes
+
+    # Rescans the specified nodes, along with any nodes that include them, since include directories propagate to includers.
+    # Returns all nodes that were rescanned.
+    def rescan(self, nodes: List[SourceNode]) -> List[SourceNode]:
+        to_rescan = []
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if node not in to_rescan:
+                to_rescan.append(node)
+                stack.extend([out for out in node.outputs if isinstance(out, SourceNode)])
+
+        for node in to_rescan:
+            [node.remove_input(inp) for inp in list(node.inputs) if isinstance(inp, SourceNode)]
+            node.include_dirs = None
+        for node in to_rescan:
+            # Nodes may already have been scanned while recursing over an includer.
+            if node.include_dirs is None:
+                if os.path.exists(node.path):
+                    self.scan(node)
+                else:
+                    node.include_dirs = []
+        return to_rescan
+
+    def fingerprint_path(self, path: str) -> str:
+        name = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+        return os.path.join(self.fingerprint_dir, f"{os.path.basename(path)}.{name}.tokens")
+
+    # Writes fingerprints for the specified nodes, which must have been scanned with fingerprint_dir set.
+    # A fingerprint combines the token hash of a file with the fingerprints of the files it includes, and is only rewritten when it changes,
+    # so that files that depend on it are not rebuilt when only comments or whitespace change.
+    # Returns the paths of the fingerprints that were written.
+    def update_fingerprints(self, nodes: List[SourceNode]) -> List[str]:
+        fingerprints: Dict[SourceNode, str] = {}
+        written = []
+
+        def fingerprint(node: SourceNode) -> str:
+            if node in fingerprints:
+                return fingerprints[node]
+            # Files that changed since they were last scanned need to be tokenized again.
+            mtime = os.stat(node.path).st_mtime_ns
+            if mtime != node.token_hash_mtime:
+                with open(node.path, "r") as f:
+                    node.token_hash = _token_hash(f.read())
+                node.token_hash_mtime = mtime
+
+            included = sorted([fingerprint(inp) for inp in node.inputs if isinstance(inp, SourceNode) and inp.fingerprint_path])
+            fingerprints[node] = "\n".join([node.token_hash] + included) + "\n"
+            try:
+                with open(node.fingerprint_path, "r") as f:
+                    unchanged = f.read() == fingerprints[node]
+            except FileNotFoundError:
+                unchanged = False
+            if not unchanged:
+                G_LOGGER.verbose(f"Tokens changed for: {node.path}. Writing fingerprint: {node.fingerprint_path}")
+                with open(node.fingerprint_path, "w") as f:
+                    f.write(fingerprints[node])
+                written.append(node.fingerprint_path)
+            return fingerprints[node]
+
+        self.mkdir(self.fingerprint_dir)
+        [fingerprint(node) for node in nodes if node.fingerprint_path]
+        return written
+
     def scan_all(self) -> None:
         # scan() will modify the graph, so cannot iterate over values() directly
         source_nodes = [node for node in self.graph if isinstance(node, SourceNode)]
@@ -208,7 +362,14 @@ class FileManager(object):
         include_dirs = set()
         external_includes = set()
         path = node.path
-        included_files = _find_included(path)
+        with open(path, "r") as f:
+            contents = f.read()
+        included_files = _find_included(contents)
+        if self.fingerprint_dir:
+            # Reuse the contents read for the include scan, so that fingerprinting does not require reading files again.
+            node.fingerprint_path = self.fingerprint_path(path)
+            node.token_hash = _token_hash(contents)
+            node.token_hash_mtime = os.stat(path).st_mtime_ns
         for included in included_files:
             # Determines the most likely file path based on an include.
             included_path = disambiguate_included_file(included, path)
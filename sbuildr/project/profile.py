@@ -27,12 +27,14 @@ class Profile(object):
     :param flags: The flags to use for this profile. These will be applied to all targets for this profile. Per-target flags always take precedence.
     :param build_dir: An absolute path to the build directory to use.
     :param suffix: A file suffix to attach to all artifacts generated for this profile.
+    :param unity_batch_size: If set, the source files of each target are compiled in unity batches of at most this many files. Targets may override this.
     """
-    def __init__(self, flags: BuildFlags, build_dir: str, suffix: str):
+    def __init__(self, flags: BuildFlags, build_dir: str, suffix: str, unity_batch_size: int=None):
         self.flags = flags
         self.build_dir = build_dir
         self.graph = Graph()
         self.suffix = suffix
+        self.unity_batch_size = unity_batch_size
 
 
     # Propagates library dirs from dependencies to their dependees.
@@ -1,29 +1,51 @@
-from sbuildr.graph.node import Node, CompiledNode, LinkedNode, Library
+from sbuildr.graph.node import Node, SourceNode, UnitySourceNode, CompiledNode, PrecompiledHeaderNode, LinkedNode, Library
 from sbuildr.dependencies.dependency import Dependency, DependencyLibrary
+from sbuildr.dependencies.resolver import DependencyResolver
+from sbuildr.dependencies.lockfile import Lockfile
 from sbuildr.project.file_manager import FileManager
 from sbuildr.backends.rbuild import RBuildBackend
 from sbuildr.project.target import ProjectTarget
 from sbuildr.backends.backend import Backend
-from sbuildr.logger import G_LOGGER, plural, Color
+from sbuildr.logger import G_LOGGER, SBuildrException, plural, Color
+from sbuildr.project.snapshot import ProjectSnapshot
+from sbuildr.project import snapshot
 from sbuildr.project.profile import Profile
+from sbuildr.project import runner, changes, bench, unity
+from sbuildr.project import watcher
 from sbuildr.tools import compiler, linker
 from sbuildr.tools.flags import BuildFlags
 from sbuildr.graph.graph import Graph
-from sbuildr.misc import paths, utils
+from sbuildr.misc import paths, utils, sync
 from sbuildr import logger
 import sbuildr
 
 from typing import List, Set, Union, Dict, Tuple
 from collections import OrderedDict, defaultdict
 import subprocess
+import hashlib
 import inspect
 import pickle
+import json
 import sys
+import re
 import os
 
 class Project(object):
-    DEFAULT_SAVED_PROJECT_NAME = "project.sbuildr"
-    PROJECT_API_VERSION = 1
+    DEFAULT_SAVED_PROJECT_NAME = paths.DEFAULT_SAVED_PROJECT_NAME
+    PROJECT_API_VERSION = snapshot.PROJECT_API_VERSION
+    # Records tests that passed, so that they are not run again unless they change.
+    TEST_CACHE_NAME = "test_cache.json"
+    # Records how long each test takes to run, so that tests can be sharded evenly.
+    TEST_DURATIONS_NAME = "test_durations.json"
+    # Records which targets and profiles each build artifact was built for, so that partial configurations do not treat other targets' artifacts as stale.
+    ARTIFACTS_MANIFEST_NAME = "artifacts.json"
+    ARTIFACTS_MANIFEST_VERSION = 1
+    # Holds fingerprints of source files, when enabled.
+    FINGERPRINTS_SUBDIR = "fingerprints"
+    # Holds generated unity batches.
+    UNITY_SUBDIR = "unity"
+    # Matches paths of build artifacts whose names include signatures, e.g. build/common/file.<signature>.o or build/common/file.<signature>.o.compiled
+    HASHED_ARTIFACT = re.compile(r"^(.*)\.([0-9a-f]{16,})(\.[^/]*)?$")
     """
     Represents a project. Projects include two default profiles with the following configuration:
     ``release``: ``BuildFlags().O(3).std(17).march("native").fpic()``
@@ -33,18 +55,24 @@ class Project(object):
     :param root: The path to the root directory for this project. All directories and files within the root directory are considered during searches for files. If no root directory is provided, defaults to the containing directory of the script calling this constructor.
     :param dirs: Additional directories outside the root directory that are part of the project. These directories and all contents will be considered during searches for files.
     :param build_dir: The build directory to use. If no build directory is provided, a directory named 'build' is created in the root directory.
+    :param precompiled_header: The name or path of a header to precompile for every target in the project that does not specify its own. See :func:`executable` for details.
+    :param fingerprint_sources: Whether to recompile object files only when the tokens of their sources change, rather than whenever the files are modified, so that changes to comments and whitespace do not trigger rebuilds. Note that line numbers in debug information and ``__LINE__`` are not updated when only whitespace changes.
     """
-    def __init__(self, root: str=None, dirs: Set[str]=set(), build_dir: str=None):
+    def __init__(self, root: str=None, dirs: Set[str]=set(), build_dir: str=None, precompiled_header: str=None, fingerprint_sources: bool=False):
         self.PROJECT_API_VERSION = Project.PROJECT_API_VERSION
         # The assumption is that the caller of the init function is the SBuildr file for the build.
         config_file = os.path.abspath(inspect.stack()[1][0].f_code.co_filename)
         # Keep track of all files present in project dirs. Since dirs is a set, files is guaranteed
         # to contain no duplicates as well.
         self.files = FileManager(root or os.path.abspath(os.path.dirname(config_file)), dirs)
+        self.config_file = config_file
         # The build directory will be writable, and excluded when the FileManager is searching for paths.
         self.build_dir = self.files.add_writable_dir(self.files.add_exclude_dir(build_dir or os.path.join(self.files.root_dir, "build")))
         # TODO: Make this a parameter?
         self.common_build_dir = os.path.join(self.build_dir, "common")
+        self.precompiled_header = precompiled_header
+        if fingerprint_sources:
+            self.files.fingerprint_dir = os.path.join(self.common_build_dir, Project.FINGERPRINTS_SUBDIR)
         # Backend
         self.backend = None
         # Profiles consist of a graph of compiled/linked nodes. Each linked node is a
@@ -54,6 +82,7 @@ class Project(object):
         # Each ProjectTarget maps profile names to their corresponding linked node for that target.
         self.executables: Dict[str, ProjectTarget] = {}
         self.tests: Dict[str, ProjectTarget] = {}
+        self.benchmarks: Dict[str, ProjectTarget] = {}
         self.libraries: Dict[str, ProjectTarget] = {}
         # Files installed by this project.
         self.public_headers: Set[str] = {}
@@ -64,6 +93,8 @@ class Project(object):
         self.profile(name="debug", flags=BuildFlags().O(0).std(17).debug().fpic().define("S_DEBUG"), file_suffix="_debug")
         # A graph describing the entire project. This is typically not constructed until just before the build
         self.graph: Graph = None
+        # Resolved dependency versions are recorded in a lockfile next to the build script.
+        self.lockfile_path = os.path.join(os.path.dirname(config_file), Lockfile.DEFAULT_NAME)
 
 
     @staticmethod
@@ -77,8 +108,33 @@ class Project(object):
         """
         path = path or os.path.abspath(os.path.join("build", Project.DEFAULT_SAVED_PROJECT_NAME))
         G_LOGGER.debug(f"Loading project from {path}")
-        with open(path, "rb") as f:
-            return pickle.load(f)
+        if not ProjectSnapshot.is_snapshot(path):
+            # Projects exported by older versions of SBuildr are plain pickles.
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        return Project.from_snapshot(ProjectSnapshot(path))
+
+
+    @staticmethod
+    def from_snapshot(snapshot: ProjectSnapshot) -> "Project":
+        """
+        Load a project from a snapshot created by :func:`export` .
+
+        :param snapshot: The snapshot from which to load the project.
+
+        :returns: The loaded project.
+        """
+        project = snapshot.section(ProjectSnapshot.PROJECT_SECTION)
+
+        # The file index is only loaded if it is needed, after which the snapshot is no longer required.
+        def load_files() -> List[str]:
+            try:
+                return snapshot.section(ProjectSnapshot.FILES_SECTION)
+            finally:
+                snapshot.close()
+
+        project.files.set_files_loader(load_files)
+        return project
 
 
     def export(self, path: str=None) -> None:
@@ -90,8 +146,21 @@ class Project(object):
         path = path or os.path.join(self.build_dir, Project.DEFAULT_SAVED_PROJECT_NAME)
         os.makedirs(os.path.dirname(path), exist_ok=True)
         G_LOGGER.info(f"Exporting project to {path}")
-        with open(path, "wb") as f:
-            pickle.dump(self, f)
+
+        # The project is saved as a snapshot, so that tools which only need basic information about targets, or
+        # the project API version, do not need to deserialize the entire project.
+        targets = []
+        for kind in ["libraries", "executables", "tests", "benchmarks"]:
+            for target in getattr(self, kind).values():
+                targets.append({"name": target.name, "kind": kind, "internal": target.internal, "is_lib": target.is_lib, "paths": {prof_name: node.path for prof_name, node in target.items()}})
+        metadata = {"api_version": self.PROJECT_API_VERSION, "profiles": self.all_profile_names(), "public_headers": sorted(self.public_headers)}
+
+        # The file index is not pickled with the file manager, so it is saved in its own section.
+        ProjectSnapshot.write(path, metadata, {
+            ProjectSnapshot.TARGETS_SECTION: ("json", targets),
+            ProjectSnapshot.FILES_SECTION: ("json", sorted(self.files.files)),
+            ProjectSnapshot.PROJECT_SECTION: ("pickle", self),
+        })
 
 
     def __contains__(self, target_name: str) -> bool:
@@ -99,7 +168,7 @@ class Project(object):
 
 
     def all_targets(self):
-        return list(self.libraries.values()) + list(self.executables.values()) + list(self.tests.values())
+        return list(self.libraries.values()) + list(self.executables.values()) + list(self.tests.values()) + list(self.benchmarks.values())
 
 
     def all_profile_names(self) -> List[str]:
@@ -118,7 +187,9 @@ class Project(object):
                 linker: linker.Linker,
                 depends: List[Dependency],
                 internal: bool,
-                is_lib: bool) -> ProjectTarget:
+                is_lib: bool,
+                precompiled_header: str=None,
+                unity_batch_size: int=None) -> ProjectTarget:
 
         if not all([isinstance(lib, ProjectTarget) or isinstance(lib, Library) or isinstance(lib, DependencyLibrary) for lib in libs]):
             G_LOGGER.critical(f"Libraries must be instances of either sbuildr.Library, sbuildr.dependencies.DependencyLibrary or sbuildr.ProjectTarget")
@@ -141,6 +212,10 @@ class Project(object):
 
         source_nodes: List[CompiledNode] = [self.files.source(path) for path in sources]
         G_LOGGER.verbose(f"For sources: {sources}, found source paths: {source_nodes}")
+        precompiled_header = utils.default_value(precompiled_header, self.precompiled_header)
+        header_node = self.files.source(precompiled_header) if precompiled_header else None
+        # Maps batch sizes to the sources to compile, since profiles may use different batch sizes.
+        unity_sources: Dict[int, List[SourceNode]] = {}
 
         target = ProjectTarget(name=name, internal=internal, is_lib=is_lib, dependencies=dependencies)
         for profile_name, profile in self.profiles.items():
@@ -153,11 +228,18 @@ class Project(object):
             # Per-target flags always overwrite profile flags.
             flags = profile.flags + flags
 
+            # The precompiled header is built with the same flags as the objects that use it, since compilers reject precompiled headers built with incompatible flags.
+            pch_node = self._precompiled_header_node(profile, header_node, compiler, include_dirs, flags) if header_node else None
+
+            batch_size = utils.default_value(unity_batch_size, profile.unity_batch_size)
+            if batch_size and batch_size not in unity_sources:
+                unity_sources[batch_size] = self._unity_sources(name, source_nodes, batch_size)
+
             # First, add or retrieve object nodes for each source.
-            for source_node in source_nodes:
+            for source_node in (unity_sources[batch_size] if batch_size else source_nodes):
                 obj_path = os.path.join(self.common_build_dir, f"{os.path.splitext(os.path.basename(source_node.path))[0]}.o")
                 # User defined includes are always prepended the ones deduced for SourceNodes.
-                obj_node = CompiledNode(obj_path, source_node, compiler, include_dirs, flags)
+                obj_node = CompiledNode(obj_path, source_node, compiler, include_dirs, flags, precompiled_header=pch_node)
                 input_nodes.append(profile.graph.add(obj_node))
 
             # Hard links are needed because during linkage, the library must have a clean name.
@@ -168,6 +250,52 @@ class Project(object):
         return target
 
 
+    # Groups sources into unity batches. Returns the batches, along with any sources that must be compiled individually.
+    def _unity_sources(self, name: str, source_nodes: List[SourceNode], batch_size: int) -> List[SourceNode]:
+        batches, excluded = unity.unity_batches([node.path for node in source_nodes], batch_size, self.files.root_dir)
+        nodes = {node.path: node for node in source_nodes}
+        individual = [nodes[path] for path in excluded] + [nodes[batch[0]] for batch in batches if len(batch) == 1]
+        unity_nodes = []
+        for batch in [batch for batch in batches if len(batch) > 1]:
+            # Batches are named after their contents, so that batches with different contents never share a file, even across profiles.
+            stem = os.path.splitext(os.path.basename(batch[0]))[0]
+            # Paths are hashed relative to the project root, so that names do not depend on where the project is located.
+            batch_hash = hashlib.blake2b("\n".join([os.path.relpath(path, self.files.root_dir) for path in batch]).encode(), digest_size=4).hexdigest()
+            path = os.path.join(self.common_build_dir, Project.UNITY_SUBDIR, f"{name}_unity_{stem}_{batch_hash}.cpp")
+            unity_nodes.append(UnitySourceNode(path, [nodes[source] for source in batch]))
+        G_LOGGER.debug(f"For target: {name}, grouped {len(source_nodes) - len(individual)} sources into {len(unity_nodes)} unity batches. Compiling {len(individual)} sources individually.")
+        return unity_nodes + individual
+
+
+    # Writes the specified unity batches, and returns the paths of those that were written.
+    # Batches are written when building rather than configuring, so that they are recreated after the build directory is cleaned,
+    # and only rewritten when their contents change, so that they are not needlessly recompiled.
+    def _write_unity_sources(self, nodes: List[UnitySourceNode]) -> List[str]:
+        written = []
+        if nodes:
+            self.files.mkdir(os.path.join(self.common_build_dir, Project.UNITY_SUBDIR))
+        for node in nodes:
+            contents = unity.batch_contents([inp.path for inp in node.inputs])
+            if os.path.exists(node.path):
+                with open(node.path, "r") as f:
+                    if f.read() == contents:
+                        continue
+            G_LOGGER.verbose(f"Writing unity batch: {node.path}")
+            with open(node.path, "w") as f:
+                f.write(contents)
+            written.append(node.path)
+        return written
+
+
+    # Returns the precompiled header node for the specified header and options in the profile, creating it if it does not exist, so that targets built with the same options share it.
+    def _precompiled_header_node(self, profile: Profile, header_node: SourceNode, compiler: compiler.Compiler, include_dirs: List[str], flags: BuildFlags) -> PrecompiledHeaderNode:
+        for node in profile.graph:
+            if isinstance(node, PrecompiledHeaderNode) and node.inputs[0] == header_node and str(node.compiler) == str(compiler) and node.include_dirs == include_dirs and node.flags._key() == flags._key():
+                return node
+        pch_path = os.path.join(self.common_build_dir, f"{os.path.basename(header_node.path)}{compiler.cdef.precompiled_header_extension()}")
+        return profile.graph.add(PrecompiledHeaderNode(pch_path, header_node, compiler, include_dirs, flags))
+
+
     # Both of these functions will modify name before passing it to profile so that the filename is correct.
     def executable(self,
                     name: str,
@@ -178,7 +306,9 @@ class Project(object):
                     include_dirs: List[str] = [],
                     linker: linker.Linker = linker.clang,
                     depends: List[Dependency] = [],
-                    internal = False) -> ProjectTarget:
+                    internal = False,
+                    precompiled_header: str = None,
+                    unity_batch_size: int = None) -> ProjectTarget:
         """
         Adds an executable target to all profiles within this project.
 
@@ -191,10 +321,12 @@ class Project(object):
         :param linker: The linker to use for this target. Defaults to clang.
         :param depends: Any additional dependencies not already captured in libs. This may include header only packages for example.
         :param internal: Whether this target is internal to the project, in which case it will not be installed.
+        :param precompiled_header: The name or path of a header to precompile, for example, one that includes heavy third-party headers. It is compiled once per profile, and used by all of the target's source files in place of parsing it, as though each source file included it first. Defaults to the project's precompiled header, if any.
+        :param unity_batch_size: The maximum number of source files to compile in each unity batch, overriding the profile's setting. A value of 0 disables unity mode for this target. See :func:`profile` for details.
 
         :returns: :class:`sbuildr.project.target.ProjectTarget`
         """
-        self.executables[name] = self._target(name, paths.name_to_execname(name), sources, flags, libs, compiler, include_dirs, linker, depends, internal, is_lib=False)
+        self.executables[name] = self._target(name, paths.name_to_execname(name), sources, flags, libs, compiler, include_dirs, linker, depends, internal, is_lib=False, precompiled_header=precompiled_header, unity_batch_size=unity_batch_size)
         return self.executables[name]
 
 
@@ -206,7 +338,9 @@ class Project(object):
                 compiler: compiler.Compiler = compiler.clang,
                 include_dirs: List[str] = [],
                 linker: linker.Linker = linker.clang,
-                depends: List[Dependency] = []) -> ProjectTarget:
+                depends: List[Dependency] = [],
+                precompiled_header: str = None,
+                unity_batch_size: int = None) -> ProjectTarget:
         """
         Adds an executable target to all profiles within this project. Test targets can be automatically built and run by using the ``test`` command on the CLI.
 
@@ -218,13 +352,46 @@ class Project(object):
         :param include_dirs: A list of paths for preprocessor include directories. These directories take precedence over automatically deduced include directories.
         :param linker: The linker to use for this target. Defaults to clang.
         :param depends: Any additional dependencies not already captured in libs. This may include header only packages for example.
+        :param precompiled_header: The name or path of a header to precompile, for example, one that includes heavy third-party headers. It is compiled once per profile, and used by all of the target's source files in place of parsing it, as though each source file included it first. Defaults to the project's precompiled header, if any.
+        :param unity_batch_size: The maximum number of source files to compile in each unity batch, overriding the profile's setting. A value of 0 disables unity mode for this target. See :func:`profile` for details.
 
         :returns: :class:`sbuildr.project.target.ProjectTarget`
         """
-        self.tests[name] = self._target(name, paths.name_to_execname(name), sources, flags, libs, compiler, include_dirs, linker, depends, internal=True, is_lib=False)
+        self.tests[name] = self._target(name, paths.name_to_execname(name), sources, flags, libs, compiler, include_dirs, linker, depends, internal=True, is_lib=False, precompiled_header=precompiled_header, unity_batch_size=unity_batch_size)
         return self.tests[name]
 
 
+    def benchmark(self,
+                name: str,
+                sources: List[str],
+                flags: BuildFlags = BuildFlags(),
+                libs: List[Union[DependencyLibrary, ProjectTarget, Library]] = [],
+                compiler: compiler.Compiler = compiler.clang,
+                include_dirs: List[str] = [],
+                linker: linker.Linker = linker.clang,
+                depends: List[Dependency] = [],
+                precompiled_header: str = None,
+                unity_batch_size: int = None) -> ProjectTarget:
+        """
+        Adds an executable target to all profiles within this project. Benchmark targets can be automatically built and run by using the ``bench`` command on the CLI.
+
+        :param name: The name of the target. This should NOT include platform-dependent extensions.
+        :param sources: A list of names or paths of source files to include in this target.
+        :param flags: Compiler and linker flags. See sbuildr.BuildFlags for details.
+        :param libs: A list containing either :class:`ProjectTarget` s, :class:`DependencyLibrary` s or :class:`Library` s.
+        :param compiler: The compiler to use for this target. Defaults to clang.
+        :param include_dirs: A list of paths for preprocessor include directories. These directories take precedence over automatically deduced include directories.
+        :param linker: The linker to use for this target. Defaults to clang.
+        :param depends: Any additional dependencies not already captured in libs. This may include header only packages for example.
+        :param precompiled_header: The name or path of a header to precompile, for example, one that includes heavy third-party headers. It is compiled once per profile, and used by all of the target's source files in place of parsing it, as though each source file included it first. Defaults to the project's precompiled header, if any.
+        :param unity_batch_size: The maximum number of source files to compile in each unity batch, overriding the profile's setting. A value of 0 disables unity mode for this target. See :func:`profile` for details.
+
+        :returns: :class:`sbuildr.project.target.ProjectTarget`
+        """
+        self.benchmarks[name] = self._target(name, paths.name_to_execname(name), sources, flags, libs, compiler, include_dirs, linker, depends, internal=True, is_lib=False, precompiled_header=precompiled_header, unity_batch_size=unity_batch_size)
+        return self.benchmarks[name]
+
+
     def library(self,
                 name: str,
                 sources: List[str],
@@ -234,7 +401,9 @@ class Project(object):
                 include_dirs: List[str] = [],
                 linker: linker.Linker = linker.clang,
                 depends: List[Dependency] = [],
-                internal = False) -> ProjectTarget:
+                internal = False,
+                precompiled_header: str = None,
+                unity_batch_size: int = None) -> ProjectTarget:
         """
         Adds a library target to all profiles within this project.
 
@@ -247,15 +416,17 @@ class Project(object):
         :param linker: The linker to use for this target. Defaults to clang.
         :param depends: Any additional dependencies not already captured in libs. This may include header only packages for example.
         :param internal: Whether this target is internal to the project, in which case it will not be installed.
+        :param precompiled_header: The name or path of a header to precompile, for example, one that includes heavy third-party headers. It is compiled once per profile, and used by all of the target's source files in place of parsing it, as though each source file included it first. Defaults to the project's precompiled header, if any.
+        :param unity_batch_size: The maximum number of source files to compile in each unity batch, overriding the profile's setting. A value of 0 disables unity mode for this target. See :func:`profile` for details.
 
         :returns: :class:`sbuildr.project.target.ProjectTarget`
         """
-        self.libraries[name] = self._target(name, paths.name_to_libname(name), sources, flags + BuildFlags()._enable_shared(), libs, compiler, include_dirs, linker, depends, internal, is_lib=True)
+        self.libraries[name] = self._target(name, paths.name_to_libname(name), sources, flags + BuildFlags()._enable_shared(), libs, compiler, include_dirs, linker, depends, internal, is_lib=True, precompiled_header=precompiled_header, unity_batch_size=unity_batch_size)
         return self.libraries[name]
 
 
     # Returns a profile if it exists, otherwise creates a new one and returns it.
-    def profile(self, name: str, flags: BuildFlags=BuildFlags(), build_dir: str=None, file_suffix: str="") -> Profile:
+    def profile(self, name: str, flags: BuildFlags=BuildFlags(), build_dir: str=None, file_suffix: str="", unity_batch_size: int=None) -> Profile:
         f"""
         Returns or creates a profile with the specified parameters.
 
@@ -263,13 +434,14 @@ class Project(object):
         :param flags: The flags to use for this profile. These will be applied to all targets for this profile. Per-target flags always take precedence.
         :param build_dir: The directory to use for build artifacts. Defaults to {os.path.join(self.build_dir, name)}
         :param file_suffix: A file suffix to attach to all artifacts generated for this profile. For example, the default debug profile attaches a ``_debug`` suffix to all library and executable names.
+        :param unity_batch_size: If set, targets in this profile are built in unity mode, where their source files are compiled in batches of at most this many files. This can significantly speed up clean builds. Source files that are unlikely to compile correctly in a batch, e.g. because they define macros, are compiled individually, as are source files containing ``sbuildr: no-unity`` .
 
         :returns: :class:`sbuildr.Profile`
         """
         if name not in self.profiles:
             build_dir = self.files.add_writable_dir(self.files.add_exclude_dir(os.path.abspath(build_dir or os.path.join(self.build_dir, name))))
             G_LOGGER.verbose(f"Setting build directory for profile: {name} to: {build_dir}")
-            self.profiles[name] = Profile(flags=flags, build_dir=build_dir, suffix=file_suffix)
+            self.profiles[name] = Profile(flags=flags, build_dir=build_dir, suffix=file_suffix, unity_batch_size=unity_batch_size)
         return self.profiles[name]
 
 
@@ -311,7 +483,30 @@ class Project(object):
         return candidates[0]
 
 
-    def configure(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None, BackendType: type=RBuildBackend) -> None:
+    def dependencies(self, targets: List[ProjectTarget]=None) -> List[Dependency]:
+        """
+        Returns the dependencies required by the specified targets, as well as those required by the project's public headers.
+
+        :param targets: The targets whose dependencies to return. Defaults to all targets.
+
+        :returns: A list of unique dependencies.
+        """
+        targets = utils.default_value(targets, self.all_targets())
+        unique_deps: Set[Dependency] = set()
+        for target in targets:
+            unique_deps.update(target.dependencies)
+        return self.public_header_dependencies + [dep for dep in unique_deps if dep not in self.public_header_dependencies]
+
+
+    def _signature_roots(self, targets: List[ProjectTarget]=None) -> List[Tuple[str, str]]:
+        # Directories that paths in signatures are made relative to, so that signatures are the same wherever the project and dependency cache are located.
+        # The build directory is usually inside the project, so it must be checked first.
+        cache_roots = set([dep.cache_root for dep in self.dependencies(targets)] + [paths.dependency_cache_root()])
+        roots = [("${build}", self.build_dir), ("${root}", self.files.root_dir)] + [("${cache}", root) for root in cache_roots]
+        return sorted(roots, key=lambda root: len(os.path.normpath(root[1])), reverse=True)
+
+
+    def configure(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None, BackendType: type=RBuildBackend, dependency_jobs: int=None, update_dependencies: bool=False, clean_stale: bool=False) -> None:
         """
         Configure does 3 things:
         1. Finds dependencies for the specified targets. This involves potentially fetching and building dependencies if they do not exist in the cache.
@@ -323,19 +518,27 @@ class Project(object):
         :param targets: The targets for which to configure the project. Defaults to all targets.
         :param profile_names: The names of profiles for which to configure the project. Defaults to all profiles.
         :param BackendType: The type of backend to use. Since SBuildr is a meta-build system, it can support multiple backends to perform builds. For example, RBuild (i.e. ``sbuildr.backends.RBuildBackend``) can be used for fast incremental builds. Note that this should be a type rather than an instance of a backend.
+        :param dependency_jobs: The maximum number of dependencies to fetch and build concurrently. Defaults to the number of CPUs.
+        :param update_dependencies: Whether to resolve dependency versions again, even if they are recorded in the project's lockfile. By default, versions recorded in the lockfile are used as-is, and only new or modified dependencies are resolved.
+        :param clean_stale: Whether to remove stale build artifacts after configuring. See :func:`stale_artifacts` for details.
         """
         targets = utils.default_value(targets, self.all_targets())
         profile_names = utils.default_value(profile_names, self.all_profile_names())
 
         def find_dependencies():
-            unique_deps: Set[Dependency] = set()
-            for target in targets:
-                unique_deps.update(target.dependencies)
-
-            required_deps = self.public_header_dependencies + list(unique_deps)
+            required_deps = self.dependencies(targets)
+            if not required_deps:
+                return
+
+            lockfile = Lockfile(self.lockfile_path)
+            if not update_dependencies:
+                pinned = lockfile.pin(required_deps)
+                G_LOGGER.debug(f"Using versions from lockfile: {lockfile.path} for dependencies: {pinned}")
             G_LOGGER.info(f"Fetching dependencies: {required_deps}")
-            for dep in required_deps:
-                meta = dep.setup()
+            metas = DependencyResolver(dependency_jobs).resolve(required_deps)
+            lockfile.update(required_deps)
+            lockfile.save()
+            for dep, meta in metas.items():
                 self.files.add_include_dir(dep.include_dir())
                 [self.files.add_include_dir(dir) for dir in meta.include_dirs]
 
@@ -349,20 +552,25 @@ class Project(object):
                 for node in all_nodes:
                     all_nodes.extend(node.inputs)
                 graph = Graph(set(all_nodes))
+                # Batches include their sources directly, so they need the include directories of all of them. Sources must have been scanned first.
+                [node.update_include_dirs() for node in graph if isinstance(node, UnitySourceNode)]
+                roots = self._signature_roots(targets)
 
                 # Need to rename all the files in the build graph so that they have hashes.
                 for layer in graph.layers():
                     for node in layer:
                         if isinstance(node, CompiledNode):
-                            signature = node.compiler.signature(node.inputs[0].path, node.include_dirs, node.flags)
+                            precompiled_header = node.precompiled_header.path if node.precompiled_header else None
+                            signature = node.compiler.signature(node.inputs[0].path, node.include_dirs, node.flags, roots=roots, precompiled_header=precompiled_header)
                             node.path = paths.insert_suffix(node.path, f".{signature}")
                         elif isinstance(node, LinkedNode):
-                            signature = node.linker.signature([inp.path for inp in node.inputs], node.libs, node.lib_dirs, node.flags)
+                            signature = node.linker.signature([inp.path for inp in node.inputs], node.libs, node.lib_dirs, node.flags, roots=roots)
                             node.hashed_path = paths.insert_suffix(node.hashed_path, f".{signature}")
 
                 return graph
 
             self.graph = combined_graph()
+            self._record_artifacts([target[prof_name] for target in targets for prof_name in profile_names])
 
         def configure_backend():
             self.backend = BackendType(self.build_dir)
@@ -372,6 +580,8 @@ class Project(object):
         find_dependencies()
         configure_graph()
         configure_backend()
+        if clean_stale:
+            self.clean(stale=True, dry_run=False)
 
 
     def build(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None) -> float:
@@ -416,6 +626,12 @@ class Project(object):
 
         if not self.backend:
             G_LOGGER.critical(f"Backend has not been configured. Please call `configure()` prior to attempting to build")
+        if self.files.fingerprint_dir:
+            written = self.files.update_fingerprints([node for node in self.graph if isinstance(node, SourceNode)])
+            G_LOGGER.debug(f"Updated {plural('source fingerprint', len(written))}")
+        written = self._write_unity_sources([node for node in self.graph if isinstance(node, UnitySourceNode)])
+        if written:
+            G_LOGGER.debug(f"Wrote {plural('unity batch', len(written))}")
         status, time_elapsed = self.backend.build(nodes)
         if status.returncode:
             G_LOGGER.critical(f"Failed with to build. Reconfiguring the project or running a clean build may resolve this.")
@@ -425,14 +641,19 @@ class Project(object):
 
     # Sets up the environment correctly to be able to run the specified linked node.
     # TODO: Refactor into separate file with run() that does platform independent env vars.
-    def _run_linked_node(self, node: LinkedNode, *args, **kwargs) -> subprocess.CompletedProcess:
+    def _linked_node_env(self, node: LinkedNode) -> Dict[str, str]:
         loader_path = os.environ[paths.loader_path_env_var()]
-        G_LOGGER.verbose(f"Running linked node: {node}")
         for lib_dir in node.lib_dirs:
             loader_path += f"{os.path.pathsep}{lib_dir}"
         G_LOGGER.debug(f"Using loader paths: {loader_path}")
-        G_LOGGER.log(f"{paths.loader_path_env_var()}={loader_path} {node.path}\n", colors=[Color.BOLD, Color.GREEN])
-        return subprocess.run([node.path], *args, env={paths.loader_path_env_var(): loader_path}, **kwargs)
+        return {paths.loader_path_env_var(): loader_path}
+
+
+    def _run_linked_node(self, node: LinkedNode, *args, **kwargs) -> subprocess.CompletedProcess:
+        G_LOGGER.verbose(f"Running linked node: {node}")
+        env = self._linked_node_env(node)
+        G_LOGGER.log(f"{paths.loader_path_env_var()}={env[paths.loader_path_env_var()]} {node.path}\n", colors=[Color.BOLD, Color.GREEN])
+        return subprocess.run([node.path], *args, env=env, **kwargs)
 
 
     def run(self, targets: List[ProjectTarget], profile_names: List[str]=[]) -> None:
@@ -467,45 +688,67 @@ class Project(object):
         return list(self.tests.values())
 
 
-    def run_tests(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None):
+    def run_tests(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None, jobs: int=None, timeout: float=None, junit_xml: str=None, use_cache: bool=True, durations_path: str=None) -> List[runner.TestResult]:
         """
         Run tests from this project. Runs all tests from the project for all profiles by default.
+        Tests are run concurrently, and their output is captured. Results are displayed in order, along with the output of any tests that fail.
 
         :param targets: The test targets to run. Raises an exception if the target is not a test target.
         :param profile_names: The profiles for which to run the tests. Defaults to all profiles.
+        :param jobs: The maximum number of tests to run at once. Defaults to the number of job slots (see :mod:`sbuildr.misc.jobs`).
+        :param timeout: The number of seconds after which each test is killed and considered failed. Defaults to no timeout.
+        :param junit_xml: A path at which to write the results in JUnit XML format.
+        :param use_cache: Whether to skip tests that passed previously, if neither the test executables nor the shared libraries they load, nor their environments, have changed since. Such tests are reported as cached.
+        :param durations_path: The path of the file in which to record test durations for :func:`shard_tests` . Defaults to a file in the build directory.
+
+        :returns: The result of each test, for each profile.
         """
-        for target in targets:
+        tests = utils.default_value(targets, self.test_targets())
+        profile_names = utils.default_value(profile_names, self.all_profile_names())
+        for target in tests:
             if target.name not in self.tests:
                 G_LOGGER.critical(f"Could not find test: {target.name} in project.\n\tAvailable tests:\n\t\t{list(self.tests.keys())}")
 
-        tests = utils.default_value(targets, self.test_targets())
-        profile_names = utils.default_value(profile_names, self.all_profile_names())
         if not tests:
             G_LOGGER.warning(f"No tests found. Have you registered tests using project.test()?")
-            return
+            return []
 
         class TestResult:
             def __init__(self):
                 self.failed = 0
                 self.passed = 0
+                self.cached = 0
 
-        def run_test(test, prof_name):
-            G_LOGGER.log(f"\nRunning test: {test}, for profile: {prof_name}", colors=[Color.BOLD, Color.GREEN])
-            status = self._run_linked_node(test[prof_name])
-            if status.returncode:
-                G_LOGGER.log(f"\nFAILED {test}, for profile: {prof_name}:\n{test[prof_name].path}", colors=[Color.BOLD, Color.RED])
+        test_results = defaultdict(TestResult)
+        failed_targets = defaultdict(set)
+
+        def report(result: runner.TestResult):
+            prof_name = result.case.profile
+            if prof_name not in test_results:
+                G_LOGGER.log(f"\n{utils.wrap_str(f' Profile: {prof_name} ')}", colors=[Color.BOLD, Color.GREEN])
+            test = self.tests[result.case.name]
+            if not result.passed:
+                reason = "TIMED OUT" if result.status == runner.TestResult.TIMEOUT else "FAILED"
+                G_LOGGER.log(f"\n{reason} {test}, for profile: {prof_name}:\n{test[prof_name].path}\n{result.output}", colors=[Color.BOLD, Color.RED])
                 test_results[prof_name].failed += 1
                 failed_targets[prof_name].add(test[prof_name].name)
+            elif result.status == runner.TestResult.CACHED:
+                G_LOGGER.log(f"\nCACHED {test}", colors=[Color.BOLD, Color.GREEN])
+                test_results[prof_name].passed += 1
+                test_results[prof_name].cached += 1
             else:
-                G_LOGGER.log(f"\nPASSED {test}", colors=[Color.BOLD, Color.GREEN])
+                G_LOGGER.log(f"\nPASSED {test} ({result.duration:.3f} seconds)", colors=[Color.BOLD, Color.GREEN])
+                G_LOGGER.verbose(result.output)
                 test_results[prof_name].passed += 1
 
-        test_results = defaultdict(TestResult)
-        failed_targets = defaultdict(set)
-        for prof_name in profile_names:
-            G_LOGGER.log(f"\n{utils.wrap_str(f' Profile: {prof_name} ')}", colors=[Color.BOLD, Color.GREEN])
-            for test in tests:
-                run_test(test, prof_name)
+        cases = [runner.TestCase(test.name, prof_name, [test[prof_name].path], self._linked_node_env(test[prof_name])) for prof_name in profile_names for test in tests]
+        cache = runner.TestCache(os.path.join(self.common_build_dir, Project.TEST_CACHE_NAME)) if use_cache else None
+        results = runner.run_tests(cases, max_workers=jobs, timeout=timeout, on_result=report, cache=cache)
+        if junit_xml:
+            runner.write_junit_xml(junit_xml, results)
+        durations = runner.TestDurations(durations_path or self._default_durations_path())
+        durations.record(results)
+        durations.save()
 
         # Display summary
         G_LOGGER.log(f"\n{utils.wrap_str(f' Test Results Summary ')}\n", colors=[Color.BOLD, Color.GREEN])
@@ -513,9 +756,235 @@ class Project(object):
             if result.passed or result.failed:
                 G_LOGGER.log(f"Profile: {prof_name}", colors=[Color.BOLD, Color.GREEN])
                 if result.passed:
-                    G_LOGGER.log(f"\tPASSED {plural('test', result.passed)}", colors=[Color.BOLD, Color.GREEN])
+                    G_LOGGER.log(f"\tPASSED {plural('test', result.passed)}{f' ({result.cached} cached)' if result.cached else ''}", colors=[Color.BOLD, Color.GREEN])
                 if result.failed:
                     G_LOGGER.log(f"\tFAILED {plural('test', result.failed)}: {failed_targets[prof_name]}", colors=[Color.BOLD, Color.RED])
+        return results
+
+
+    def benchmark_targets(self) -> List[ProjectTarget]:
+        """
+        Returns all targets in this project that are benchmarks.
+
+        :returns: A list of targets.
+        """
+        return list(self.benchmarks.values())
+
+
+    def run_benchmarks(self, targets: List[ProjectTarget]=None, profile_name: str="release", warmup: int=1, repetitions: int=10, cpu: int=None, baseline: str=None, threshold: float=0.05, update_baseline: bool=False) -> Dict[str, bench.BenchmarkStats]:
+        """
+        Runs benchmarks from this project one at a time, and reports timing statistics for each. Runs all benchmarks by default.
+
+        :param targets: The benchmark targets to run. Raises an exception if the target is not a benchmark target.
+        :param profile_name: The profile for which to run the benchmarks. Defaults to "release".
+        :param warmup: The number of untimed runs of each benchmark before timing begins.
+        :param repetitions: The number of timed runs of each benchmark.
+        :param cpu: The index of a CPU to which to pin benchmarks. Defaults to no pinning.
+        :param baseline: The path of a baseline file to compare results against.
+        :param threshold: The relative increase in median time over the baseline, e.g. 0.05 for 5%, beyond which a benchmark is considered to have regressed.
+        :param update_baseline: Whether to record the results in the baseline file, instead of comparing against it. Requires ``baseline``.
+
+        :returns: Statistics for each benchmark, keyed by target name. Raises an exception after running all benchmarks if any regressed.
+        """
+        benchmarks = utils.default_value(targets, self.benchmark_targets())
+        for target in benchmarks:
+            if target.name not in self.benchmarks:
+                G_LOGGER.critical(f"Could not find benchmark: {target.name} in project.\n\tAvailable benchmarks:\n\t\t{list(self.benchmarks.keys())}")
+        if profile_name not in self.profiles:
+            G_LOGGER.critical(f"Profile: {profile_name} does not exist in the project. Available profiles: {self.all_profile_names()}")
+        if update_baseline and not baseline:
+            G_LOGGER.critical(f"Cannot update the baseline since no baseline file was specified")
+
+        if not benchmarks:
+            G_LOGGER.warning(f"No benchmarks found. Have you registered benchmarks using project.benchmark()?")
+            return {}
+
+        base = bench.Baseline(baseline) if baseline else None
+        results = {}
+        regressions = []
+        G_LOGGER.log(f"\n{utils.wrap_str(f' Profile: {profile_name} ')}", colors=[Color.BOLD, Color.GREEN])
+        for target in benchmarks:
+            node = target[profile_name]
+            G_LOGGER.log(f"\nRunning benchmark: {target}, for profile: {profile_name}", colors=[Color.BOLD, Color.GREEN])
+            stats = bench.run_benchmark([node.path], self._linked_node_env(node), warmup=warmup, repetitions=repetitions, cpu=cpu)
+            results[target.name] = stats
+            change = base.change(target.name, stats) if base and not update_baseline else None
+            if change is None:
+                G_LOGGER.log(f"{target.name}: {stats}", colors=[Color.BOLD, Color.GREEN])
+            elif change > threshold:
+                G_LOGGER.log(f"REGRESSED {target.name}: {stats}. {change:+.1%} compared to baseline, exceeding threshold of {threshold:.1%}", colors=[Color.BOLD, Color.RED])
+                regressions.append(target.name)
+            else:
+                G_LOGGER.log(f"{target.name}: {stats}. {change:+.1%} compared to baseline", colors=[Color.BOLD, Color.GREEN])
+
+        if base and update_baseline:
+            base.update(results)
+            base.save()
+        if regressions:
+            G_LOGGER.critical(f"{plural('benchmark', len(regressions))} regressed by more than {threshold:.1%}: {regressions}")
+        return results
+
+
+    def _default_durations_path(self) -> str:
+        return os.path.join(self.common_build_dir, Project.TEST_DURATIONS_NAME)
+
+
+    def shard_tests(self, index: int, count: int, targets: List[ProjectTarget]=None, durations_path: str=None) -> List[ProjectTarget]:
+        """
+        Splits tests into ``count`` shards with roughly equal total running time, for example, to run them on several machines, and returns the tests in one shard.
+        Running times are taken from the durations recorded by :func:`run_tests` . Tests without recorded durations are estimated from the total size of their source files,
+        since test executables are generally not built on a machine before sharding. The split depends only on the recorded durations and the source files,
+        so machines that share these compute the same shards.
+
+        :param index: The index of the shard to return, starting from 1.
+        :param count: The total number of shards.
+        :param targets: The test targets to shard. Defaults to all tests.
+        :param durations_path: The path of the file containing recorded durations. Defaults to the file in the build directory.
+
+        :returns: The tests in the shard, in the same order as the ``targets`` argument.
+        """
+        if count < 1 or not 1 <= index <= count:
+            G_LOGGER.critical(f"Invalid shard: {index}/{count}. The shard index must be between 1 and the number of shards.")
+        tests = utils.default_value(targets, self.test_targets())
+        durations = runner.TestDurations(durations_path or self._default_durations_path())
+
+        def source_size(test: ProjectTarget) -> int:
+            # All profiles of a target are built from the same sources.
+            node = next(iter(test.values()))
+            sources = [inp.inputs[0].path for inp in node.inputs if isinstance(inp, CompiledNode)]
+            return sum([os.path.getsize(path) for path in sources if os.path.exists(path)])
+
+        sizes = {test.name: source_size(test) for test in tests}
+        known = {test.name: durations.get(test.name) for test in tests if durations.get(test.name) is not None}
+        # Estimate missing durations by scaling source sizes to the durations of tests with history.
+        known_size = sum([sizes[name] for name in known])
+        seconds_per_byte = sum(known.values()) / known_size if known and known_size else None
+        weights = {}
+        for test in tests:
+            if test.name in known:
+                weights[test.name] = known[test.name]
+            elif seconds_per_byte is not None:
+                weights[test.name] = sizes[test.name] * seconds_per_byte
+            elif known:
+                weights[test.name] = sum(known.values()) / len(known)
+            else:
+                weights[test.name] = sizes[test.name]
+
+        shard = set(runner.partition(weights, count)[index - 1])
+        selected = [test for test in tests if test.name in shard]
+        G_LOGGER.info(f"Shard {index}/{count} contains {plural('test', len(selected))} ({len(known)} of {len(tests)} with recorded durations): {[test.name for test in selected]}")
+        return selected
+
+
+    def dependent_targets(self, nodes: List[Node], targets: List[ProjectTarget]=None) -> List[ProjectTarget]:
+        """
+        Finds targets that transitively depend on the specified nodes, by following the outputs of each node through the build graph.
+
+        :param nodes: The nodes whose dependents to find, for example, SourceNodes for files that have changed.
+        :param targets: The targets to consider. Defaults to all targets.
+
+        :returns: A list of targets, in the same order as the ``targets`` argument.
+        """
+        targets = utils.default_value(targets, self.all_targets())
+        visited = set()
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if node not in visited:
+                visited.add(node)
+                stack.extend(node.outputs)
+        return [target for target in targets if any([node in visited for node in target.values()])]
+
+
+    def affected_tests(self, since: str, targets: List[ProjectTarget]=None) -> List[ProjectTarget]:
+        """
+        Finds tests whose inputs have changed since a git revision or a point in time, by following the build graph from changed source files, including headers, to test targets.
+        If the build configuration script or the dependency lockfile changed, all tests are considered affected.
+
+        :param since: A git revision, e.g. "origin/master", or a point in time, in seconds since the epoch, optionally prefixed with "@", or in ISO 8601 format.
+                If ``since`` is both a git revision and a timestamp, e.g. an abbreviated commit hash consisting only of digits, it is treated as a revision.
+        :param targets: The test targets to consider. Defaults to all tests.
+
+        :returns: A list of affected tests, in the same order as the ``targets`` argument.
+        """
+        tests = utils.default_value(targets, self.test_targets())
+        # Headers are only part of the graph once the files that include them have been scanned.
+        if any([node.include_dirs is None for node in self.files.graph if isinstance(node, SourceNode)]):
+            self.files.scan_all()
+        source_nodes = {os.path.realpath(node.path): node for node in self.files.graph if isinstance(node, SourceNode)}
+        config_files = [self.config_file] + ([self.lockfile_path] if os.path.exists(self.lockfile_path) else [])
+
+        # Revisions take precedence, since abbreviated commit hashes may look like timestamps.
+        if changes.is_revision(since, self.files.root_dir):
+            changed = changes.changed_since_revision(since, self.files.root_dir)
+        else:
+            timestamp = changes.parse_timestamp(since)
+            if timestamp is None:
+                G_LOGGER.critical(f"{since} is neither a git revision nor a point in time")
+            changed = changes.changed_since_time(timestamp, list(source_nodes.keys()) + config_files)
+        changed = set([os.path.realpath(path) for path in changed])
+        G_LOGGER.debug(f"Files changed since {since}: {sorted(changed)}")
+
+        if any([os.path.realpath(path) in changed for path in config_files]):
+            G_LOGGER.info(f"Build configuration has changed since {since}. All tests are affected.")
+            return tests
+
+        changed_nodes = [node for path, node in source_nodes.items() if path in changed]
+        affected = self.dependent_targets(changed_nodes, tests)
+        G_LOGGER.info(f"{plural('source file', len(changed_nodes))} changed since {since}, affecting {plural('test', len(affected))}: {[test.name for test in affected]}")
+        return affected
+
+
+    def watch(self, targets: List[ProjectTarget]=None, profile_names: List[str]=None, debounce: float=0.25, run_tests: bool=True, iterations: int=None) -> None:
+        """
+        Watches the project's directories for changes. When files change, rescans only the changed files, then rebuilds the targets that depend on them and re-runs any affected tests. Configuration should be run prior to calling this function.
+
+        :param targets: The targets to rebuild. Defaults to all targets.
+        :param profile_names: The profiles for which to rebuild targets. Defaults to all profiles.
+        :param debounce: The number of seconds to wait for further changes before rebuilding.
+        :param run_tests: Whether to run affected tests after rebuilding.
+        :param iterations: The maximum number of rebuilds to perform. Watches indefinitely by default.
+        """
+        targets = utils.default_value(targets, self.all_targets())
+        profile_names = utils.default_value(profile_names, self.all_profile_names())
+        if not self.backend:
+            G_LOGGER.critical(f"Backend has not been configured. Please call `configure()` prior to attempting to watch")
+
+        file_watcher = watcher.create_watcher(self.files.watch_dirs(), self.files.exclude_dirs)
+        G_LOGGER.info(f"Watching {len(file_watcher.dirs)} directories for changes using {type(file_watcher).__name__}. Press Ctrl+C to stop.")
+
+        iteration = 0
+        while iterations is None or iteration < iterations:
+            changed_nodes = self.files.update(file_watcher.wait(debounce=debounce))
+            if not changed_nodes:
+                continue
+            iteration += 1
+            G_LOGGER.info(f"Detected changes in: {[node.path for node in changed_nodes]}")
+
+            # Include directories may have changed, in which case the build commands need to be regenerated.
+            old_include_dirs = {node: node.include_dirs for node in self.files.graph if isinstance(node, SourceNode)}
+            rescanned = self.files.rescan(changed_nodes)
+            if any([node.include_dirs != old_include_dirs.get(node) for node in rescanned]):
+                # Pull in any new headers so that the backend tracks them as well.
+                stack = list(rescanned)
+                while stack:
+                    node = stack.pop()
+                    if node not in self.graph:
+                        self.graph.add(node)
+                    stack.extend([inp for inp in node.inputs if inp not in self.graph])
+                self.backend.configure(self.graph)
+
+            affected = self.dependent_targets(changed_nodes, targets)
+            if not affected:
+                G_LOGGER.info(f"No targets depend on the changed files.")
+                continue
+            try:
+                self.build(affected, profile_names)
+                affected_tests = [target for target in affected if target.name in self.tests and self.tests[target.name] is target]
+                if run_tests and affected_tests:
+                    self.run_tests(affected_tests, profile_names)
+            except SBuildrException:
+                G_LOGGER.error(f"Failed to rebuild {[target.name for target in affected]}. Waiting for further changes.")
 
 
     def install_targets(self) -> List[ProjectTarget]:
@@ -541,9 +1010,12 @@ class Project(object):
         header_install_path: str=paths.default_header_install_path(),
         library_install_path: str=paths.default_library_install_path(),
         executable_install_path: str=paths.default_executable_install_path(),
-        dry_run: bool=True):
+        dry_run: bool=True,
+        link_mode: sync.LinkMode=sync.LinkMode.REFLINK,
+        compare_hashes: bool=False) -> sync.SyncStats:
         """
         Install the specified targets for the specified profiles.
+        Installation is incremental: files are copied concurrently, and only if the installed file is missing or differs in size or modification time from the file being installed.
 
         :param targets: The targets to install. Defaults to all non-internal project targets.
         :param profile_names: The profiles for which to install. Defaults to the "release" profile.
@@ -552,6 +1024,10 @@ class Project(object):
         :param library_install_path: The path to which to install libraries. This defaults to one of the default locations for the host OS.
         :param executable_install_path: The path to which to install executables. This defaults to one of the default locations for the host OS.
         :param dry_run: Whether to perform a dry-run only, with no file copying. Defaults to True.
+        :param link_mode: How to copy files. See :class:`sbuildr.misc.sync.LinkMode` for details. Defaults to reflinks where supported, falling back to copies.
+        :param compare_hashes: Whether to compare file contents when modification times differ, to avoid copying files that were rebuilt without changing.
+
+        :returns: A summary of the files that were copied and skipped, or None for dry-runs.
         """
         targets = utils.default_value(targets, self.install_targets())
         profile_names = utils.default_value(profile_names, [self.install_profile()])
@@ -560,30 +1036,35 @@ class Project(object):
         if dry_run:
             G_LOGGER.warning(f"Install dry-run, will not copy files.")
 
-        def install_target(target, prof_name):
-            node: LinkedNode = target[prof_name]
-            install_dir = library_install_path if target.is_lib else executable_install_path
-            install_path = os.path.join(install_dir, os.path.basename(node.path))
-            if dry_run:
-                G_LOGGER.info(f"Would install target: {node.path} to {install_path}")
-            else:
-                if utils.copy_path(node.path, install_path):
-                    G_LOGGER.info(f"Installed target: {node.path} to {install_path}")
-
+        files: List[Tuple[str, str]] = []
         for prof_name in profile_names:
             for target in targets:
-                install_target(target, prof_name)
+                node: LinkedNode = target[prof_name]
+                install_dir = library_install_path if target.is_lib else executable_install_path
+                files.append((node.path, os.path.join(install_dir, os.path.basename(node.path))))
+        for header in headers:
+            files.append((header, os.path.join(header_install_path, os.path.basename(header))))
 
-        def install_header(header):
-            install_path = os.path.join(header_install_path, os.path.basename(header))
-            if dry_run:
-                G_LOGGER.info(f"Would install header: {header} to {install_path}")
-            else:
-                if utils.copy_path(header, install_path):
-                    G_LOGGER.info(f"Installed header: {header} to {install_path}")
+        # Files are copied concurrently, so each destination must only be written once.
+        sources: Dict[str, str] = {}
+        for src, dst in files:
+            if dst in sources and sources[dst] != src:
+                G_LOGGER.critical(f"Cannot install both {sources[dst]} and {src} to {dst}")
+            sources[dst] = src
+        files = [(src, dst) for dst, src in sources.items()]
 
-        for header in headers:
-            install_header(header)
+        if dry_run:
+            for src, dst in files:
+                G_LOGGER.info(f"Would install: {src} to {dst}")
+            return None
+
+        stats = sync.sync_files(files, link_mode, compare_hashes)
+        for path in stats.copied:
+            G_LOGGER.info(f"Installed: {path}")
+        for path in stats.skipped:
+            G_LOGGER.verbose(f"Up to date: {path}")
+        G_LOGGER.info(f"Installed {plural('file', len(files))}: {stats}")
+        return stats
 
 
     def uninstall(self,
@@ -638,18 +1119,138 @@ class Project(object):
             uninstall_header(header)
 
 
-    def clean(self, nuke: bool=False, dry_run: bool=True):
+    def _artifacts_manifest_path(self) -> str:
+        return os.path.join(self.common_build_dir, Project.ARTIFACTS_MANIFEST_NAME)
+
+
+    def _load_artifact_owners(self) -> Dict[str, List[str]]:
+        # Maps the path of each target node to the paths of artifacts in the common build directory that it has been built from.
+        path = self._artifacts_manifest_path()
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            contents = json.load(f)
+        if contents.get("version") != Project.ARTIFACTS_MANIFEST_VERSION:
+            return {}
+        return contents["owners"]
+
+
+    def _save_artifact_owners(self, owners: Dict[str, List[str]]):
+        with utils.atomic_write(self._artifacts_manifest_path()) as f:
+            json.dump({"version": Project.ARTIFACTS_MANIFEST_VERSION, "owners": owners}, f, indent=4, sort_keys=True)
+
+
+    # Returns the directories that may contain stale artifacts: the common build directory, and its subdirectories for generated unity batches and token fingerprints.
+    def _artifact_dirs(self) -> List[str]:
+        return [self.common_build_dir] + [os.path.join(self.common_build_dir, subdir) for subdir in [Project.UNITY_SUBDIR, Project.FINGERPRINTS_SUBDIR]]
+
+
+    def _owned_artifacts(self, node: Node) -> Set[str]:
+        # Returns the artifacts in the artifact directories that are built for the specified node. Source files are excluded, since they are not build artifacts,
+        # but generated unity batches, and fingerprints of source files, are included.
+        owned = set()
+        stack = [node]
+        visited = set()
+        while stack:
+            current = stack.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            if not isinstance(current, SourceNode) or isinstance(current, UnitySourceNode):
+                owned.add(current.path)
+            owned.update([artifact.path for artifact in current.artifacts()])
+            stack.extend(current.inputs)
+        artifact_dirs = self._artifact_dirs()
+        return set([path for path in owned if path and os.path.dirname(path) in artifact_dirs])
+
+
+    def _record_artifacts(self, nodes: List[Node]):
+        # Records the artifacts that each target node is built from, in addition to those recorded for earlier configurations.
+        owners = self._load_artifact_owners()
+        for node in nodes:
+            owners[node.path] = sorted(set(owners.get(node.path, [])) | self._owned_artifacts(node))
+        self._save_artifact_owners(owners)
+
+
+    def _forget_artifacts(self, paths: List[str]):
+        removed = set(paths)
+        owners = self._load_artifact_owners()
+        owners = {owner: [path for path in owned if path not in removed] for owner, owned in owners.items()}
+        self._save_artifact_owners({owner: owned for owner, owned in owners.items() if owned})
+
+
+    def stale_artifacts(self) -> List[str]:
+        """
+        Finds build artifacts that are no longer referenced by the project's build graph. Object files and libraries are named using a signature of the commands used to build them,
+        so whenever flags, include directories or libraries change, new artifacts are built, and the old ones become stale. Similarly, unity batches are named after the source files they contain,
+        so they become stale when batches change, and fingerprints become stale when source files are removed. Configuration should be run prior to calling this function.
+
+        If the project was configured for only some targets or profiles, an artifact is only considered stale if every target and profile it was previously built for is part of the graph,
+        since the remaining artifacts may belong to targets or profiles that were not configured. Artifacts that were not recorded by a previous configuration are kept in this case.
+
+        :returns: The paths of stale artifacts.
+        """
+        if not self.graph:
+            G_LOGGER.critical(f"Project has not been configured. Please call `configure()` prior to attempting to find stale artifacts")
+        if not os.path.isdir(self.common_build_dir):
+            return []
+
+        referenced = set()
+        for node in self.graph:
+            referenced.add(node.path)
+            referenced.update([artifact.path for artifact in node.artifacts()])
+        target_nodes = [node for target in self.all_targets() for node in target.values()]
+        complete = all([node in self.graph for node in target_nodes])
+
+        configured = set([node.path for node in target_nodes if node in self.graph])
+        artifact_owners: Dict[str, Set[str]] = defaultdict(set)
+        for owner, owned in self._load_artifact_owners().items():
+            for path in owned:
+                artifact_owners[path].add(owner)
+
+        # Everything in the subdirectories is generated by sbuildr, but the common build directory may contain other files, e.g. the saved project.
+        candidates = [os.path.join(self.common_build_dir, name) for name in sorted(os.listdir(self.common_build_dir))]
+        candidates = [path for path in candidates if Project.HASHED_ARTIFACT.match(path)]
+        for dir in self._artifact_dirs()[1:]:
+            if os.path.isdir(dir):
+                candidates.extend([os.path.join(dir, name) for name in sorted(os.listdir(dir))])
+
+        stale = []
+        for path in candidates:
+            if path in referenced or not os.path.isfile(path):
+                continue
+            if complete or (artifact_owners[path] and artifact_owners[path] <= configured):
+                stale.append(path)
+        return stale
+
+
+    def clean(self, nuke: bool=False, dry_run: bool=True, stale: bool=False):
         """
         Removes build directories and project artifacts.
 
         :param nuke: Whether to remove all build directories associated with the project, including profile build directories.
         :param dry_run: Whether this is a dry-run, in which case SBuildr will only display which directories would be removed rather than removing them. Defaults to True.
+        :param stale: Whether to remove only stale build artifacts, as per :func:`stale_artifacts` , rather than build directories.
         """
         # TODO(3): Add per-target cleaning.
         to_remove = []
         if dry_run:
             G_LOGGER.warning(f"Clean dry-run, will not remove files.")
 
+        if stale:
+            to_remove = self.stale_artifacts()
+            size = sum([os.path.getsize(path) for path in to_remove])
+            G_LOGGER.info(f"{'Would remove' if dry_run else 'Removing'} {plural('stale artifact', len(to_remove))} ({size} bytes)")
+            for path in to_remove:
+                if dry_run:
+                    G_LOGGER.info(f"Would remove: {path}")
+                else:
+                    G_LOGGER.verbose(f"Removing: {path}")
+                    os.remove(path)
+            if not dry_run and to_remove:
+                self._forget_artifacts(to_remove)
+            return
+
         # By default, cleans all targets for all profiles.
         to_remove = [self.profiles[prof_name].build_dir for prof_name in self.all_profile_names()] + [self.common_build_dir]
         G_LOGGER.info(f"Cleaning targets for profiles: {self.all_profile_names()}")
@@ -0,0 +1,343 @@
+# Runs test executables concurrently, and collects their results.
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import jobs, sync, utils
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+import xml.etree.ElementTree as ET
+import subprocess
+import threading
+import hashlib
+import json
+import time
+import re
+import os
+
+class TestCase(object):
+    # Keeps pytest from collecting this class when it is imported by test modules.
+    __test__ = False
+
+    def __init__(self, name: str, profile: str, cmd: List[str], env: Dict[str, str]=None):
+        """
+        A single test executable to run for a single profile.
+
+        :param name: The name of the test target.
+        :param profile: The name of the profile.
+        :param cmd: The command to run.
+        :param env: The environment in which to run the command.
+        """
+        self.name = name
+        self.profile = profile
+        self.cmd = cmd
+        self.env = env
+
+
+class TestResult(object):
+    __test__ = False
+
+    PASSED = "passed"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    # The test passed previously, and neither it nor its inputs have changed since, so it was not run.
+    CACHED = "cached"
+
+    def __init__(self, case: TestCase, status: str, returncode: int, output: str, duration: float):
+        """
+        The result of running a :class:`TestCase` .
+
+        :param case: The test that was run.
+        :param status: One of ``PASSED``, ``FAILED``, ``TIMEOUT`` or ``CACHED``.
+        :param returncode: The return code of the test, or None if it timed out.
+        :param output: The combined standard output and standard error of the test.
+        :param duration: The time taken to run the test, in seconds.
+        """
+        self.case = case
+        self.status = status
+        self.returncode = returncode
+        self.output = output
+        self.duration = duration
+
+
+    @property
+    def passed(self) -> bool:
+        return self.status in [TestResult.PASSED, TestResult.CACHED]
+
+
+def _decode(output) -> str:
+    if output is None:
+        return ""
+    return output.decode(errors="replace") if isinstance(output, bytes) else output
+
+
+def run_test(case: TestCase, timeout: float=None) -> TestResult:
+    """
+    Runs a test, capturing its output.
+
+    :param case: The test to run.
+    :param timeout: The number of seconds after which to kill the test. Defaults to no timeout.
+
+    :returns: The result of the test.
+    """
+    start = time.time()
+    try:
+        status = subprocess.run(case.cmd, env=case.env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    except subprocess.TimeoutExpired as err:
+        output = _decode(err.stdout) + f"\nTimed out after {timeout} seconds"
+        return TestResult(case, TestResult.TIMEOUT, None, output, time.time() - start)
+    except OSError as err:
+        return TestResult(case, TestResult.FAILED, None, f"Failed to run: {' '.join(case.cmd)} with:\n{err}", time.time() - start)
+    result = TestResult.FAILED if status.returncode else TestResult.PASSED
+    return TestResult(case, result, status.returncode, _decode(status.stdout), time.time() - start)
+
+
+def _dynamic_section(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Reads the names of the shared libraries required by an ELF file, and the run paths used to find them.
+
+    :returns: A tuple of (needed libraries, run paths). Both are empty if the file is not an ELF file, for example, a script. Returns None if the file could not be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != b"\x7fELF":
+                return [], []
+        status = subprocess.run(["readelf", "--dynamic", "--wide", path], capture_output=True)
+    except OSError:
+        return None
+    if status.returncode:
+        return None
+    output = status.stdout.decode(errors="replace")
+    needed = re.findall(r"\(NEEDED\)\s+Shared library: \[(.*)\]", output)
+    runpaths = []
+    for entry in re.findall(r"\((?:RUNPATH|RPATH)\)\s+Library r(?:un)?path: \[(.*)\]", output):
+        runpaths.extend([dir.replace("$ORIGIN", os.path.dirname(path)) for dir in entry.split(os.path.pathsep) if dir])
+    return needed, runpaths
+
+
+class TestCache(object):
+    __test__ = False
+
+    CACHE_VERSION = 1
+
+    def __init__(self, path: str):
+        """
+        Records tests that passed, along with a key identifying everything they ran with: the contents of the test executable and the shared libraries it loads, its arguments and its environment.
+        A test whose key has not changed since it last passed does not need to be run again.
+
+        Shared libraries are found by following the dynamic dependencies of the executable through the directories in its run path and the loader path of its environment.
+        Libraries in the default system search paths are not considered.
+
+        :param path: The path of the file in which to store the cache.
+        """
+        self.path = path
+        self.results: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                contents = json.load(f)
+            if contents.get("version") == TestCache.CACHE_VERSION:
+                self.results = contents["results"]
+        self.lock = threading.Lock()
+        # Maps (path, size, modification time) to file hashes, since many tests load the same libraries.
+        self.hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+    @staticmethod
+    def _id(case: TestCase) -> str:
+        return f"{case.profile}/{case.name}"
+
+
+    def _file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        id = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if id in self.hashes:
+                return self.hashes[id]
+        file_hash = sync.file_hash(path)
+        with self.lock:
+            self.hashes[id] = file_hash
+        return file_hash
+
+
+    def _libraries(self, exe: str, loader_dirs: List[str]) -> List[str]:
+        libraries = []
+        stack = [exe]
+        while stack:
+            section = _dynamic_section(stack.pop())
+            if section is None:
+                return None
+            needed, runpaths = section
+            for name in needed:
+                candidates = [os.path.join(dir, name) for dir in runpaths + loader_dirs]
+                path = next((os.path.realpath(cand) for cand in candidates if os.path.isfile(cand)), None)
+                if path and path not in libraries:
+                    libraries.append(path)
+                    stack.append(path)
+        return libraries
+
+
+    def key(self, case: TestCase) -> str:
+        """
+        Computes the cache key for a test.
+
+        :returns: The key, or None if the test cannot be cached, for example, because its dependencies could not be determined.
+        """
+        exe = case.cmd[0]
+        if not os.path.isfile(exe):
+            return None
+        env = case.env or {}
+        loader_dirs = [dir for dir in env.get("LD_LIBRARY_PATH", "").split(os.path.pathsep) if dir]
+        libraries = self._libraries(exe, loader_dirs)
+        if libraries is None:
+            G_LOGGER.debug(f"Could not determine libraries loaded by: {exe}. Its results will not be cached.")
+            return None
+
+        hasher = hashlib.blake2b()
+        hasher.update(json.dumps([case.cmd, sorted(env.items())]).encode())
+        for path in [exe] + sorted(libraries):
+            hasher.update(f"{path}:{self._file_hash(path)}".encode())
+        return hasher.hexdigest()
+
+
+    def is_cached(self, case: TestCase, key: str) -> bool:
+        return key is not None and self.results.get(TestCache._id(case)) == key
+
+
+    def update(self, result: TestResult, key: str):
+        with self.lock:
+            if result.status == TestResult.PASSED and key is not None:
+                self.results[TestCache._id(result.case)] = key
+            elif not result.passed:
+                self.results.pop(TestCache._id(result.case), None)
+
+
+    def save(self):
+        with utils.atomic_write(self.path) as f:
+            json.dump({"version": TestCache.CACHE_VERSION, "results": self.results}, f)
+
+
+class TestDurations(object):
+    __test__ = False
+
+    DURATIONS_VERSION = 1
+
+    def __init__(self, path: str):
+        """
+        Records how long each test took to run, summed over profiles, for use when sharding tests.
+
+        :param path: The path of the file in which to store durations.
+        """
+        self.path = path
+        self.durations: Dict[str, float] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                contents = json.load(f)
+            if contents.get("version") == TestDurations.DURATIONS_VERSION:
+                self.durations = contents["durations"]
+
+
+    def get(self, name: str) -> float:
+        """
+        Returns the recorded duration of a test, or None if there is none.
+        """
+        return self.durations.get(name)
+
+
+    def record(self, results: List[TestResult]):
+        """
+        Records the durations of tests that were run. Cached results are ignored, and durations of other tests are preserved.
+        """
+        durations = {}
+        for result in results:
+            if result.status != TestResult.CACHED:
+                durations[result.case.name] = durations.get(result.case.name, 0.0) + result.duration
+        self.durations.update(durations)
+
+
+    def save(self):
+        with utils.atomic_write(self.path) as f:
+            json.dump({"version": TestDurations.DURATIONS_VERSION, "durations": self.durations}, f, indent=4, sort_keys=True)
+
+
+def partition(weights: Dict[str, float], count: int) -> List[List[str]]:
+    """
+    Splits items into ``count`` groups with roughly equal total weight, by assigning the heaviest remaining item to the lightest group (longest processing time first).
+    The result depends only on the weights, so every machine computes the same partition.
+
+    :param weights: Maps item names to weights.
+    :param count: The number of groups.
+
+    :returns: The names of the items in each group, sorted.
+    """
+    groups = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for name in sorted(weights.keys(), key=lambda name: (-weights[name], name)):
+        index = loads.index(min(loads))
+        groups[index].append(name)
+        loads[index] += weights[name]
+    G_LOGGER.debug(f"Partitioned into groups with weights: {loads}")
+    return [sorted(group) for group in groups]
+
+
+def run_tests(cases: List[TestCase], max_workers: int=None, timeout: float=None, on_result: Callable[[TestResult], None]=None, cache: TestCache=None) -> List[TestResult]:
+    """
+    Runs tests concurrently. Each running test holds a slot from :attr:`sbuildr.misc.jobs.G_JOB_SLOTS` , so tests do not oversubscribe the machine when run alongside builds.
+
+    :param cases: The tests to run.
+    :param max_workers: The maximum number of tests to run at once. Defaults to the number of job slots.
+    :param timeout: The number of seconds after which to kill each test. Defaults to no timeout.
+    :param on_result: A function to call with each result. Results are reported in the same order as ``cases``, as soon as all earlier tests have completed.
+    :param cache: A cache of passing results. Tests that passed previously, and have not changed since, are not run again, and are reported as ``CACHED``. The cache is updated and saved with the new results.
+
+    :returns: The results, in the same order as ``cases``.
+    """
+    def run(case: TestCase) -> TestResult:
+        key = cache.key(case) if cache else None
+        if cache and cache.is_cached(case, key):
+            return TestResult(case, TestResult.CACHED, 0, "", 0.0)
+
+        with jobs.G_JOB_SLOTS.reserve(1):
+            G_LOGGER.verbose(f"Running: {' '.join(case.cmd)}")
+            result = run_test(case, timeout)
+        if cache:
+            cache.update(result, key)
+        return result
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers or jobs.G_JOB_SLOTS.total, 1)) as executor:
+            # Futures are consumed in submission order, so results are reported in a deterministic order, regardless of which tests finish first.
+            for future in [executor.submit(run, case) for case in cases]:
+                result = future.result()
+                results.append(result)
+                if on_result:
+                    on_result(result)
+    finally:
+        if cache:
+            cache.save()
+    return results
+
+
+def write_junit_xml(path: str, results: List[TestResult]):
+    """
+    Writes test results in JUnit XML format, with one test suite per profile.
+
+    :param path: The path of the file to write.
+    :param results: The test results.
+    """
+    suites = {}
+    for result in results:
+        suites.setdefault(result.case.profile, []).append(result)
+
+    root = ET.Element("testsuites", tests=str(len(results)), failures=str(len([res for res in results if not res.passed])), time=f"{sum([res.duration for res in results]):.3f}")
+    for profile, suite_results in suites.items():
+        suite = ET.SubElement(root, "testsuite", name=profile, tests=str(len(suite_results)), failures=str(len([res for res in suite_results if not res.passed])), time=f"{sum([res.duration for res in suite_results]):.3f}")
+        for result in suite_results:
+            case = ET.SubElement(suite, "testcase", name=result.case.name, classname=profile, time=f"{result.duration:.3f}")
+            if result.status == TestResult.TIMEOUT:
+                ET.SubElement(case, "failure", message="Timed out", type=TestResult.TIMEOUT)
+            elif not result.passed:
+                ET.SubElement(case, "failure", message=f"Exited with return code: {result.returncode}", type=TestResult.FAILED)
+            ET.SubElement(case, "system-out").text = result.output
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+    G_LOGGER.info(f"Wrote test results to: {path}")
@@ -0,0 +1,131 @@
+from sbuildr.logger import G_LOGGER
+from sbuildr.misc import utils
+
+from typing import Dict, List, Tuple
+import struct
+import pickle
+import json
+import mmap
+import os
+
+# The current project API version. Projects saved with a different version need to be reconfigured.
+# This is defined here rather than in the project module so that saved projects can be checked cheaply.
+PROJECT_API_VERSION = 4
+
+# A versioned on-disk format for exported projects. The layout is:
+#   MAGIC | header length (little-endian uint64) | header (JSON) | sections
+# The header contains arbitrary metadata, e.g. the project API version, as well as a table of contents
+# that maps section names to their offsets, lengths and encodings. Sections are only decoded when accessed,
+# so readers that need only part of the project do not need to deserialize all of it.
+class ProjectSnapshot(object):
+    MAGIC = b"SBUILDR\0"
+    FORMAT_VERSION = 1
+    HEADER_LENGTH = struct.Struct("<Q")
+    # Sections of exported projects. See Project.export() for details.
+    TARGETS_SECTION = "targets"
+    FILES_SECTION = "files"
+    PROJECT_SECTION = "project"
+
+    ENCODERS = {
+        "json": lambda obj: json.dumps(obj).encode(),
+        "pickle": pickle.dumps,
+    }
+    DECODERS = {
+        "json": lambda data: json.loads(data.decode()),
+        "pickle": pickle.loads,
+    }
+
+    def __init__(self, path: str):
+        """
+        Opens a snapshot for reading. Only the header is read up front. Raises a ValueError if the file is not a snapshot.
+        The snapshot is memory-mapped until it is closed, either with :func:`close` or by using it as a context manager.
+
+        :param path: The path to the snapshot.
+        """
+        self.path = path
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic_len = len(ProjectSnapshot.MAGIC)
+        if self.data[:magic_len] != ProjectSnapshot.MAGIC:
+            self.data.close()
+            raise ValueError(f"{self.path} is not an SBuildr project snapshot")
+        header_len, = ProjectSnapshot.HEADER_LENGTH.unpack_from(self.data, magic_len)
+        self.header_offset = magic_len + ProjectSnapshot.HEADER_LENGTH.size
+        header = json.loads(self.data[self.header_offset:self.header_offset + header_len].decode())
+
+        self.format_version: int = header["format_version"]
+        self.metadata: Dict = header["metadata"]
+        self.toc: Dict[str, Dict] = header["sections"]
+        self.sections_offset = self.header_offset + header_len
+        self._cache: Dict[str, object] = {}
+        G_LOGGER.debug(f"Opened snapshot: {self.path} (format version: {self.format_version}) with sections: {list(self.toc.keys())}")
+
+
+    def close(self):
+        """
+        Closes the snapshot. Sections that have already been decoded remain available.
+        """
+        self.data.close()
+
+
+    def __enter__(self) -> "ProjectSnapshot":
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    @staticmethod
+    def is_snapshot(path: str) -> bool:
+        with open(path, "rb") as f:
+            return f.read(len(ProjectSnapshot.MAGIC)) == ProjectSnapshot.MAGIC
+
+
+    @staticmethod
+    def write(path: str, metadata: Dict, sections: Dict[str, Tuple[str, object]]) -> None:
+        """
+        Writes a snapshot to the specified path.
+
+        :param path: The path at which to write the snapshot.
+        :param metadata: JSON-serializable metadata to store in the header.
+        :param sections: Maps section names to tuples of (encoding, object). The encoding must be one of the keys in ``ProjectSnapshot.ENCODERS``.
+        """
+        toc = {}
+        blobs: List[bytes] = []
+        offset = 0
+        for name, (encoding, obj) in sections.items():
+            blob = ProjectSnapshot.ENCODERS[encoding](obj)
+            toc[name] = {"offset": offset, "length": len(blob), "encoding": encoding}
+            blobs.append(blob)
+            offset += len(blob)
+            G_LOGGER.verbose(f"Snapshot section: {name} ({encoding}) is {len(blob)} bytes")
+
+        header = json.dumps({"format_version": ProjectSnapshot.FORMAT_VERSION, "metadata": metadata, "sections": toc}).encode()
+        # Readers must never observe partially written snapshots.
+        with utils.atomic_write(path, "wb") as f:
+            f.write(ProjectSnapshot.MAGIC)
+            f.write(ProjectSnapshot.HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            [f.write(blob) for blob in blobs]
+
+
+    def section(self, name: str) -> object:
+        """
+        Decodes and returns the specified section. Sections are cached after they are decoded for the first time.
+
+        :param name: The name of the section.
+
+        :returns: The decoded section.
+        """
+        if name not in self._cache:
+            if name not in self.toc:
+                G_LOGGER.critical(f"Snapshot: {self.path} does not contain section: {name}. Available sections: {list(self.toc.keys())}")
+            if self.data.closed:
+                G_LOGGER.critical(f"Cannot load section: {name} since snapshot: {self.path} has been closed")
+            entry = self.toc[name]
+            start = self.sections_offset + entry["offset"]
+            G_LOGGER.verbose(f"Loading section: {name} from {self.path}")
+            self._cache[name] = ProjectSnapshot.DECODERS[entry["encoding"]](self.data[start:start + entry["length"]])
+        return self._cache[name]
@@ -0,0 +1,151 @@
+# Groups source files into unity (jumbo) batches. Each batch is a generated source file that includes several
+# source files, so that headers they share are only parsed once when the batch is compiled as a single translation unit.
+from sbuildr.project.file_manager import COMMENT_OR_LITERAL_REGEX
+from sbuildr.logger import G_LOGGER
+
+from typing import Dict, List, Set, Tuple
+from collections import Counter
+import hashlib
+import re
+import os
+
+# Only C++ sources can be included in batches, which are themselves C++ sources.
+UNITY_EXTENSIONS = set([".cpp", ".cc", ".cxx", ".c++"])
+# Source files containing this marker, e.g. in a comment, are never included in batches.
+NO_UNITY_MARKER = "sbuildr: no-unity"
+DEFINE_REGEX = re.compile(r"^\s*#\s*define\s+(\w+)", re.MULTILINE)
+UNDEF_REGEX = re.compile(r"^\s*#\s*undef\s+(\w+)", re.MULTILINE)
+PREPROCESSOR_REGEX = re.compile(r"^\s*#.*$", re.MULTILINE)
+# Matches the start of a namespace definition, e.g. `namespace detail {` or `namespace {`, capturing the name, if any.
+NAMESPACE_REGEX = re.compile(r"^(?:inline\s+)?namespace\s*([\w:\s]*)$")
+USING_NAMESPACE_REGEX = re.compile(r"^using\s+namespace\s+([\w:\s]+)$")
+TYPE_DEFINITION_REGEX = re.compile(r"^(?:template\s*<.*>\s*)?(?:struct|class|union|enum(?:\s+class|\s+struct)?)\s+(\w+)[^(]*$", re.DOTALL)
+# Matches the name at the end of a declarator, e.g. `helper` in `static int helper` or `count` in `static int count`.
+DECLARED_NAME_REGEX = re.compile(r"(\w+)\s*$")
+STATIC_REGEX = re.compile(r"\bstatic\b")
+LINKAGE_SCOPE = 'extern ""'
+
+def _scan(contents: str) -> Tuple[Set[str], Set[str]]:
+    # Returns the names that a source file defines with internal linkage at namespace scope, qualified by their namespaces, along with the namespaces it uses at namespace scope.
+    # Both would leak into the source files following it in a batch. File-local names are those declared ``static`` or in anonymous namespaces, as well as types defined in the source file.
+    # Declarations are found by tracking braces rather than by parsing C++, so unusual declarations, e.g. of function pointers or operators, are not detected.
+    contents = COMMENT_OR_LITERAL_REGEX.sub(lambda match: '""' if match.group(0)[0] in "\"'" else " ", contents)
+    contents = PREPROCESSOR_REGEX.sub("", contents.replace("\\\n", ""))
+
+    locals, used_namespaces = set(), set()
+    # Each scope is the name of a namespace, an empty string for an anonymous namespace, LINKAGE_SCOPE for a linkage specification,
+    # or None for any other braces, e.g. a function or class body.
+    scopes: List[str] = []
+
+    def at_namespace_scope() -> bool:
+        return all([scope is not None for scope in scopes])
+
+    def declare(statement: str, is_definition: bool):
+        match = USING_NAMESPACE_REGEX.match(statement)
+        if match:
+            used_namespaces.add("".join(match.group(1).split()))
+            return
+        name = None
+        type_match = TYPE_DEFINITION_REGEX.match(statement)
+        if type_match:
+            name = type_match.group(1) if is_definition else None
+        elif STATIC_REGEX.search(statement) or "" in scopes:
+            name_match = DECLARED_NAME_REGEX.search(re.split(r"[(=\[{]", statement, maxsplit=1)[0])
+            name = name_match.group(1) if name_match else None
+        if name:
+            locals.add("::".join([scope for scope in scopes if scope and scope != LINKAGE_SCOPE] + [name]))
+
+    parts = re.split(r"([{};])", contents)
+    # Each statement is followed by the brace or semicolon that ends it.
+    for statement, delimiter in zip(parts[::2], parts[1::2]):
+        statement = " ".join(statement.split())
+        if delimiter == "{":
+            namespace = NAMESPACE_REGEX.match(statement) if at_namespace_scope() else None
+            if namespace:
+                scopes.append("".join(namespace.group(1).split()))
+            elif statement == LINKAGE_SCOPE and at_namespace_scope():
+                scopes.append(LINKAGE_SCOPE)
+            else:
+                if at_namespace_scope() and statement:
+                    declare(statement, is_definition=True)
+                scopes.append(None)
+        elif delimiter == "}":
+            if scopes:
+                scopes.pop()
+        elif at_namespace_scope() and statement:
+            declare(statement, is_definition=False)
+    return locals, used_namespaces
+
+
+def _incompatibility(path: str, contents: str) -> str:
+    # Returns why a source file cannot be included in a batch, or None if it can.
+    if os.path.splitext(path)[1] not in UNITY_EXTENSIONS:
+        return "it is not a C++ source file"
+    if NO_UNITY_MARKER in contents:
+        return f"it contains '{NO_UNITY_MARKER}'"
+    # Macros would leak into the source files following this one in the batch.
+    leaked = set(DEFINE_REGEX.findall(contents)) - set(UNDEF_REGEX.findall(contents))
+    if leaked:
+        return f"it defines macros that it does not undefine: {sorted(leaked)}"
+    _, used_namespaces = _scan(contents)
+    if used_namespaces:
+        return f"it uses namespaces at namespace scope: {sorted(used_namespaces)}"
+    return None
+
+
+def _is_boundary(name: str, batch_size: int) -> bool:
+    return int(hashlib.blake2b(name.encode(), digest_size=8).hexdigest(), 16) % batch_size == 0
+
+
+def unity_batches(paths: List[str], batch_size: int, root: str) -> Tuple[List[List[str]], List[str]]:
+    """
+    Groups source files into batches of at most ``batch_size`` files.
+
+    Batches end at source files whose names hash to a boundary, rather than every ``batch_size`` files, so that adding or removing a source file only changes the batch containing it,
+    instead of shifting every batch after it. Source files that cannot safely be compiled together with others are excluded, for example, because they define macros,
+    because they use namespaces at namespace scope, or because they define file-local names that another source file also defines.
+    File-local names are those declared ``static`` or in anonymous namespaces, as well as types defined in source files.
+    These are found by tracking braces rather than by parsing C++, so some declarations, e.g. of function pointers or operators, are not detected.
+
+    :param paths: The paths of the source files.
+    :param batch_size: The maximum number of source files in each batch.
+    :param root: The directory that paths are made relative to before hashing, so that batches do not depend on where the project is located.
+
+    :returns: The batches, each of which is a list of paths, and the paths of the excluded source files.
+    """
+    if batch_size < 1:
+        G_LOGGER.critical(f"Unity batch size must be at least 1, but {batch_size} was specified")
+
+    contents: Dict[str, str] = {}
+    excluded = []
+    for path in paths:
+        with open(path, "r") as f:
+            contents[path] = f.read()
+        reason = _incompatibility(path, contents[path])
+        if reason:
+            G_LOGGER.verbose(f"Excluding: {path} from unity batches since {reason}")
+            excluded.append(path)
+
+    candidates = [path for path in paths if path not in excluded]
+    file_locals = {path: _scan(contents[path])[0] for path in candidates}
+    local_counts = Counter([name for path in candidates for name in file_locals[path]])
+    for path in candidates:
+        collisions = sorted([name for name in file_locals[path] if local_counts[name] > 1])
+        if collisions:
+            G_LOGGER.verbose(f"Excluding: {path} from unity batches since other source files define the same file-local names: {collisions}")
+            excluded.append(path)
+
+    batches: List[List[str]] = []
+    batch = []
+    for path in sorted([path for path in candidates if path not in excluded]):
+        batch.append(path)
+        if len(batch) == batch_size or _is_boundary(os.path.relpath(path, root), batch_size):
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches, excluded
+
+
+def batch_contents(paths: List[str]) -> str:
+    return "".join([f'#include "{path}"\n' for path in paths])
@@ -0,0 +1,249 @@
+from sbuildr.logger import G_LOGGER
+
+from typing import Dict, Set, List
+import select
+import struct
+import time
+import os
+
+# Watches a set of directories for changes to files. Subclasses implement _poll(), which waits for at most
+# timeout seconds and returns the paths of any files that were created, modified or removed in the meantime.
+class Watcher(object):
+    def __init__(self, dirs: Set[str], exclude_dirs: Set[str]=set()):
+        """
+        Watches directories for file changes.
+
+        :param dirs: The directories to watch. Subdirectories are watched as well.
+        :param exclude_dirs: Directories whose contents should be ignored, e.g. build directories.
+        """
+        self.exclude_dirs = set(exclude_dirs)
+        self.dirs: Set[str] = set()
+        for dir in dirs:
+            self.add_dir(dir)
+
+
+    def _is_excluded(self, path: str) -> bool:
+        return any([os.path.commonpath([path, dir]) == dir for dir in self.exclude_dirs])
+
+
+    def add_dir(self, dir: str):
+        dir = os.path.abspath(dir)
+        if os.path.isdir(dir) and dir not in self.dirs and not self._is_excluded(dir):
+            self.dirs.add(dir)
+            G_LOGGER.verbose(f"Watching directory: {dir}")
+
+
+    def _poll(self, timeout: float) -> Set[str]:
+        raise NotImplementedError()
+
+
+    def wait(self, debounce: float=0.25, timeout: float=None) -> Set[str]:
+        """
+        Blocks until at least one file changes, then keeps collecting changes until none have occurred for ``debounce`` seconds.
+
+        :param debounce: The number of seconds without changes after which the collected changes are returned.
+        :param timeout: The maximum number of seconds to wait for the first change. Waits forever by default.
+
+        :returns: The absolute paths of all files that changed.
+        """
+        changed: Set[str] = set()
+        start = time.time()
+        while not changed:
+            remaining = None if timeout is None else timeout - (time.time() - start)
+            if remaining is not None and remaining <= 0:
+                return changed
+            changed.update(self._poll(debounce if remaining is None else min(debounce, remaining)))
+
+        while True:
+            new_changes = self._poll(debounce)
+            if not new_changes:
+                break
+            changed.update(new_changes)
+        changed = set([path for path in changed if not self._is_excluded(path)])
+        G_LOGGER.debug(f"Detected changes in: {changed}")
+        return changed
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, dirs: Set[str], exclude_dirs: Set[str]=set(), interval: float=0.1):
+        """
+        A watcher that periodically checks timestamps. The index of watched files is kept in memory between polls, so only directories whose timestamps changed are listed again.
+
+        :param interval: The number of seconds between polls.
+        """
+        self.interval = interval
+        # Maps directory paths to their timestamps, and file paths to (timestamp, size) tuples.
+        self.dir_stamps: Dict[str, float] = {}
+        self.file_stamps: Dict[str, tuple] = {}
+        super().__init__(dirs, exclude_dirs)
+
+
+    def _scan_dir(self, dir: str) -> Set[str]:
+        changed = set()
+        try:
+            self.dir_stamps[dir] = os.stat(dir).st_mtime
+            entries = list(os.scandir(dir))
+        except FileNotFoundError:
+            return changed
+        for entry in entries:
+            if entry.is_dir():
+                if entry.path not in self.dirs:
+                    Watcher.add_dir(self, entry.path)
+                    if entry.path in self.dirs:
+                        changed.update(self._scan_dir(entry.path))
+            elif entry.path not in self.file_stamps:
+                self.file_stamps[entry.path] = self._stamp(entry.path)
+                changed.add(entry.path)
+        return changed
+
+
+    @staticmethod
+    def _stamp(path: str) -> tuple:
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+
+    def add_dir(self, dir: str):
+        dir = os.path.abspath(dir)
+        if dir in self.dirs:
+            return
+        super().add_dir(dir)
+        if dir in self.dirs:
+            # Populate the index without reporting pre-existing files as changes.
+            self._scan_dir(dir)
+
+
+    def _poll(self, timeout: float) -> Set[str]:
+        deadline = time.time() + timeout
+        while True:
+            changed = set()
+            # Only list directories whose timestamps changed, since that indicates files being added or removed.
+            for dir in list(self.dirs):
+                try:
+                    stamp = os.stat(dir).st_mtime
+                except FileNotFoundError:
+                    self.dirs.discard(dir)
+                    continue
+                if stamp != self.dir_stamps.get(dir):
+                    changed.update(self._scan_dir(dir))
+
+            for path, stamp in list(self.file_stamps.items()):
+                new_stamp = self._stamp(path)
+                if new_stamp != stamp:
+                    changed.add(path)
+                    if new_stamp is None:
+                        del self.file_stamps[path]
+                    else:
+                        self.file_stamps[path] = new_stamp
+
+            if changed or time.time() >= deadline:
+                return changed
+            time.sleep(min(self.interval, max(deadline - time.time(), 0)))
+
+
+class InotifyWatcher(Watcher):
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, dirs: Set[str], exclude_dirs: Set[str]=set()):
+        """
+        A watcher that uses the Linux inotify API. Raises an OSError if inotify is unavailable.
+        """
+        # ctypes is comparatively slow to import, so only import it when inotify is actually used.
+        import ctypes.util
+        import ctypes
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("Could not find the C library")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Failed to initialize inotify")
+        # Maps watch descriptors to directories.
+        self.watches: Dict[int, str] = {}
+        super().__init__(dirs, exclude_dirs)
+
+
+    def add_dir(self, dir: str):
+        dir = os.path.abspath(dir)
+        if dir in self.dirs:
+            return
+        super().add_dir(dir)
+        if dir not in self.dirs:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, dir.encode(), InotifyWatcher.WATCH_MASK)
+        if wd < 0:
+            # Already imported by the constructor, so this is cheap.
+            import ctypes
+            G_LOGGER.warning(f"Could not watch directory: {dir} (errno: {ctypes.get_errno()})")
+            self.dirs.discard(dir)
+            return
+        self.watches[wd] = dir
+        # inotify watches are not recursive, so subdirectories need to be watched individually.
+        for entry in os.scandir(dir):
+            if entry.is_dir():
+                self.add_dir(entry.path)
+
+
+    def _poll(self, timeout: float) -> Set[str]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = InotifyWatcher.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += InotifyWatcher.EVENT_HEADER.size
+            name = buffer[offset:offset + name_len].rstrip(b"\0").decode()
+            offset += name_len
+            if wd not in self.watches or not name:
+                continue
+            path = os.path.join(self.watches[wd], name)
+            if mask & InotifyWatcher.IN_ISDIR:
+                if mask & (InotifyWatcher.IN_CREATE | InotifyWatcher.IN_MOVED_TO):
+                    self.add_dir(path)
+                    # Files may have been written to the new directory before the watch was added.
+                    changed.update([entry.path for entry in os.scandir(path) if entry.is_file()] if os.path.isdir(path) else [])
+            else:
+                changed.add(path)
+        return changed
+
+
+    def __del__(self):
+        if getattr(self, "fd", -1) >= 0:
+            os.close(self.fd)
+
+
+def create_watcher(dirs: Set[str], exclude_dirs: Set[str]=set()) -> Watcher:
+    """
+    Creates an inotify-based watcher if possible, falling back to a polling watcher otherwise.
+
+    :param dirs: The directories to watch.
+    :param exclude_dirs: Directories whose contents should be ignored.
+
+    :returns: :class:`Watcher`
+    """
+    try:
+        return InotifyWatcher(dirs, exclude_dirs)
+    except (OSError, AttributeError) as err:
+        G_LOGGER.debug(f"Could not use inotify ({err}), falling back to polling.")
+        return PollingWatcher(dirs, exclude_dirs)
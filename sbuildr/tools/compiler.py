@@ -2,9 +2,10 @@ from sbuildr.tools.flags import BuildFlags
 from sbuildr.logger import G_LOGGER
 from sbuildr.tools import utils
 
-from typing import List, Union
+from typing import List, Tuple, Union
 import copy
 import abc
+import os
 
 # Responsible for translating sbuildr.tools.flags.BuildFlags to actual command-line flags.
 # This class defines everything about each compiler by supplying a unified interface.
@@ -61,6 +62,39 @@ class CompilerDef(abc.ABC):
         """
         pass
 
+    @staticmethod
+    def precompiled_header_extension() -> str:
+        """
+        Specifies the file extension of precompiled headers.
+        For example, this would return ".pch" for Clang.
+
+        Returns:
+            str: The file extension.
+        """
+        pass
+
+    @staticmethod
+    def precompile_header() -> List[str]:
+        """
+        Specifies command-line arguments for compiling the input file into a precompiled header.
+        These must precede the input file. For example, this would return ["-x", "c++-header"] for Clang.
+
+        Returns:
+            List[str]: The required arguments.
+        """
+        pass
+
+    @staticmethod
+    def include_precompiled_header(path: str) -> List[str]:
+        """
+        Specifies command-line arguments for using the specified precompiled header.
+        For example, this would return ["-include-pch", "path"] for Clang.
+
+        Returns:
+            List[str]: The required arguments.
+        """
+        pass
+
 # For conventions that are common among Linux compilers.
 class LinuxCompilerDef(CompilerDef):
     @staticmethod
@@ -88,24 +122,48 @@ class LinuxCompilerDef(CompilerDef):
             compiler_flags.append("-fPIC")
         if build_flags._debug:
             compiler_flags.append("-g")
-        for define in build_flags._defines:
+        # Sets are iterated in an order that depends on the interpreter's hash seed, so sort them to keep commands and signatures deterministic.
+        for define in sorted(build_flags._defines):
             compiler_flags.append(f"-D{define}")
         return compiler_flags
 
+    @staticmethod
+    def precompile_header() -> List[str]:
+        return ["-x", "c++-header"]
+
 class ClangDef(LinuxCompilerDef):
     @staticmethod
     def executable() -> str:
         return "clang"
 
+    @staticmethod
+    def precompiled_header_extension() -> str:
+        return ".pch"
+
+    @staticmethod
+    def include_precompiled_header(path: str) -> List[str]:
+        return ["-include-pch", path]
+
 class GCCDef(LinuxCompilerDef):
     @staticmethod
     def executable() -> str:
         return "gcc"
 
+    @staticmethod
+    def precompiled_header_extension() -> str:
+        return ".gch"
+
+    # GCC uses header.gch in place of header when it exists, even if header itself does not.
+    @staticmethod
+    def include_precompiled_header(path: str) -> List[str]:
+        return ["-include", os.path.splitext(path)[0]]
+
 # Responsible for generating commands that will compile a given source file with the given flags
 class Compiler(object):
     def __init__(self, cdef: Union[type, CompilerDef]):
         self.cdef = cdef
+        # Maps canonical flags to their hashes, since the same flags are used to compute signatures for many files.
+        self._flag_hashes = {}
 
     def __str__(self):
         return self.cdef.executable()
@@ -114,18 +172,41 @@ class Compiler(object):
     # - i.e. compiler, include directories and compile options.
     # If two signatures are the same for an input file, it means the resulting object file(s) would be identical.
     # This helps name object files uniquely, e.g. for release/debug builds.
-    def signature(self, input_path: str, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags()) -> str:
-        sig = [self.cdef.executable()] + [input_path] + self.cdef.parse_flags(flags) + include_dirs
+    # Paths under any of the specified roots, e.g. the project root, are made relative to them, so that signatures do not change when the project is moved.
+    def signature(self, input_path: str, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags(), roots: List[Tuple[str, str]]=[], precompiled_header: str=None) -> str:
+        sig = [self.cdef.executable(), self._flags_hash(flags), utils.relative_path(input_path, roots)] + [utils.relative_path(dir, roots) for dir in include_dirs]
+        if precompiled_header:
+            sig.append(utils.relative_path(precompiled_header, roots))
         return utils.str_hash(sig)
 
+    def _flags_hash(self, flags: BuildFlags) -> str:
+        # Compilers unpickled from older projects do not have a cache.
+        if not hasattr(self, "_flag_hashes"):
+            self._flag_hashes = {}
+        key = flags._key()
+        if key not in self._flag_hashes:
+            self._flag_hashes[key] = utils.str_hash(self.cdef.parse_flags(flags))
+        return self._flag_hashes[key]
+
     # Generates the command required to compile the input file with the specified options.
-    def compile(self, input_path: str, output_path: str, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags()) -> List[str]:
+    # The precompiled header, if specified, must have been compiled with the same flags.
+    def compile(self, input_path: str, output_path: str, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags(), precompiled_header: str=None) -> List[str]:
         compiler_flags = self.cdef.parse_flags(flags)
+        if precompiled_header:
+            compiler_flags += self.cdef.include_precompiled_header(precompiled_header)
         includes = [self.cdef.include(dir) for dir in include_dirs]
         # The full command, including the output file and the compile-only flag.
         cmd = [self.cdef.executable(), input_path] + compiler_flags + includes + [self.cdef.compile_only(), self.cdef.output(output_path)]
         G_LOGGER.verbose(f"Compile Command: {' '.join(cmd)}")
         return cmd
 
+    # Generates the command required to compile the input header into a precompiled header.
+    def precompile(self, input_path: str, output_path: str, include_dirs: List[str]=[], flags: BuildFlags=BuildFlags()) -> List[str]:
+        compiler_flags = self.cdef.parse_flags(flags)
+        includes = [self.cdef.include(dir) for dir in include_dirs]
+        cmd = [self.cdef.executable()] + self.cdef.precompile_header() + [input_path] + compiler_flags + includes + [self.cdef.output(output_path)]
+        G_LOGGER.verbose(f"Precompile Command: {' '.join(cmd)}")
+        return cmd
+
 clang = Compiler(ClangDef)
 gcc = Compiler(GCCDef)
@@ -25,6 +25,11 @@ class BuildFlags(object):
         self._defines: Set[str] = set()
         self._raw: List[str] = []
 
+    # Internal only, should not need to be called by the user.
+    # A canonical representation of the flags, which does not depend on the order in which macros were defined.
+    def _key(self) -> tuple:
+        return (self._o, self._std, self._march, self._fpic, self._shared, self._debug, tuple(sorted(self._defines)), tuple(self._raw))
+
     # Internal only, should not need to be called by the user.
     def _enable_shared(self) -> 'BuildFlags':
         self._shared = True
@@ -2,7 +2,7 @@ from sbuildr.tools.flags import BuildFlags
 from sbuildr.tools import compiler, utils
 from sbuildr.logger import G_LOGGER
 
-from typing import List, Union
+from typing import List, Tuple, Union
 import abc
 import os
 
@@ -112,6 +112,8 @@ class GCCDef(LinuxLinkerDef):
 class Linker(object):
     def __init__(self, ldef: Union[type, LinkerDef]):
         self.ldef = ldef
+        # Maps canonical flags to their hashes, since the same flags are used to compute signatures for many targets.
+        self._flag_hashes = {}
 
     def __str__(self):
         return self.ldef.executable()
@@ -119,11 +121,23 @@ class Linker(object):
     # Generates a signature for a given combination of input file and options.
     # If two signatures are the same for an input file, it means the resulting file(s) would be identical.
     # The signature is everything that makes the resulting object file unique - i.e. linker, input file, link directories and linker options.
-    def signature(self, input_paths: List[str], libs: List[str]=[], lib_dirs: List[str]=[], flags: BuildFlags=BuildFlags()) -> str:
+    # Paths under any of the specified roots, e.g. the build directory, are made relative to them, so that signatures do not change when the project is moved.
+    def signature(self, input_paths: List[str], libs: List[str]=[], lib_dirs: List[str]=[], flags: BuildFlags=BuildFlags(), roots: List[Tuple[str, str]]=[]) -> str:
         # Order of inputs does not matter, but order of libs does.
-        sig = [self.ldef.executable()] + list(sorted(input_paths)) + self.ldef.parse_flags(flags) + libs + lib_dirs
+        input_paths = sorted([utils.relative_path(path, roots) for path in input_paths])
+        libs = [utils.relative_path(lib, roots) if os.path.isabs(lib) else lib for lib in libs]
+        sig = [self.ldef.executable(), self._flags_hash(flags)] + input_paths + libs + [utils.relative_path(dir, roots) for dir in lib_dirs]
         return utils.str_hash(sig)
 
+    def _flags_hash(self, flags: BuildFlags) -> str:
+        # Linkers unpickled from older projects do not have a cache.
+        if not hasattr(self, "_flag_hashes"):
+            self._flag_hashes = {}
+        key = flags._key()
+        if key not in self._flag_hashes:
+            self._flag_hashes[key] = utils.str_hash(self.ldef.parse_flags(flags))
+        return self._flag_hashes[key]
+
     # Generates the command required to link the inputs files with the specified options.
     def link(self, input_paths: List[str], output_path: str, libs: List[str]=[], lib_dirs: List[str]=[], flags: BuildFlags=BuildFlags()) -> List[str]:
         G_LOGGER.debug(f"self.ldef: {self.ldef}")
@@ -1,4 +1,5 @@
 from sbuildr.logger import G_LOGGER
+from typing import List, Tuple
 import hashlib
 import sys
 import os
@@ -14,6 +15,25 @@ def str_hash(obj) -> str:
         str: The resulting hash.
     """
     in_str = " ".join(obj).strip()
-    generated_hash = hashlib.md5(in_str.encode()).hexdigest()
+    # BLAKE2 is faster than MD5, and a 16 byte digest keeps hashed file names the same length as before.
+    generated_hash = hashlib.blake2b(in_str.encode(), digest_size=16).hexdigest()
     G_LOGGER.verbose(f"Generated hash {generated_hash} from '{in_str}'")
     return generated_hash
+
+
+def relative_path(path: str, roots: List[Tuple[str, str]]=[]) -> str:
+    """
+    Expresses a path relative to the first root directory that contains it, so that it does not depend on where that directory is located.
+    For example, with roots ``[("${root}", "/home/user/project")]``, ``/home/user/project/src/a.cpp`` becomes ``${root}/src/a.cpp``.
+
+    :param path: The path.
+    :param roots: Tuples of (placeholder, directory). More specific directories should come first.
+
+    :returns: The path relative to a root, prefixed with the root's placeholder, or the normalized path if no root contains it.
+    """
+    path = os.path.normpath(path)
+    for placeholder, root in roots:
+        root = os.path.normpath(root)
+        if path == root or path.startswith(root + os.path.sep):
+            return placeholder + path[len(root):]
+    return path
@@ -3,12 +3,20 @@ from sbuildr.graph.graph import Graph
 from sbuildr.backends.rbuild import RBuildBackend
 from sbuildr.tools import compiler, linker
 from sbuildr.tools.flags import BuildFlags
+from sbuildr.misc.jobs import JobSlots, JobServer
+from sbuildr.misc import jobs
 from test_tools import PATHS, ROOT, TESTS_ROOT
 import subprocess
+import tempfile
+import threading
+import time
 import shutil
+import sys
 import pytest
 import os
 
+SBUILDR_ROOT = os.path.abspath(os.path.join(TESTS_ROOT, os.path.pardir))
+
 def create_build_graph(compiler, linker):
     flags = BuildFlags().O(3).std(17).march("native").fpic()
     # Headers
@@ -60,3 +68,106 @@ class TestRBuild(object):
         gen = RBuildBackend(PATHS["build"])
         gen.configure(graph)
         status, time_elapsed = gen.build([])
+
+RESERVE_SCRIPT = "from sbuildr.misc.jobs import G_JOB_SLOTS\nwith G_JOB_SLOTS.reserve() as count:\n    print(count)\n"
+
+class TestJobSlots(object):
+    def test_reserves_up_to_max_count(self):
+        slots = JobSlots(4)
+        with slots.reserve(3) as first:
+            assert first == 3
+            with slots.reserve() as second:
+                assert second == 1
+                assert slots.available == 0
+        assert slots.available == 4
+
+    def test_waits_for_available_slots(self):
+        slots = JobSlots(2)
+        reserved = []
+        def reserve():
+            with slots.reserve() as count:
+                reserved.append(count)
+
+        with slots.reserve():
+            thread = threading.Thread(target=reserve)
+            thread.start()
+            time.sleep(0.1)
+            # All slots are taken, so the thread must wait.
+            assert not reserved
+        thread.join()
+        assert reserved == [2]
+
+    def test_default_reservations_share_slots(self):
+        slots = JobSlots(4)
+        with slots.reserve(1):
+            # The slots are shared fairly with the reservation that is already held.
+            with slots.reserve() as count:
+                assert count == 2
+                assert slots.available == 1
+        with slots.reserve() as count:
+            assert count == 4
+
+    def test_shares_jobserver_with_other_clients(self):
+        server = JobServer.create(2)
+        first = JobSlots(3, jobserver=JobServer.from_makeflags(server.makeflags(3)))
+        second = JobSlots(3, jobserver=JobServer.from_makeflags(server.makeflags(3)))
+        with first.reserve() as first_count:
+            assert first_count == 3
+            # Every client owns one slot implicitly, but all tokens have been taken by the first client.
+            with second.reserve() as second_count:
+                assert second_count == 1
+        with second.reserve() as second_count:
+            assert second_count == 3
+
+    @pytest.mark.parametrize("fifo", [False, True])
+    def test_exports_jobserver(self, monkeypatch, fifo):
+        monkeypatch.delenv("MAKEFLAGS", raising=False)
+        monkeypatch.setattr(jobs, "_MAKE_SUPPORTS_FIFO", fifo)
+        slots = JobSlots(3, export=True)
+        kwargs = slots.subprocess_kwargs(env=dict(os.environ, PYTHONPATH=SBUILDR_ROOT))
+        assert slots.jobserver.makeflags(3) in kwargs["env"]["MAKEFLAGS"]
+        # This process's environment should not be modified.
+        assert "MAKEFLAGS" not in os.environ
+
+        # Child processes should take slots from the same jobserver.
+        with slots.reserve(2):
+            status = subprocess.run([sys.executable, "-c", RESERVE_SCRIPT], capture_output=True, **kwargs)
+            assert status.stdout.decode().strip() == "2"
+
+    @pytest.mark.skipif(shutil.which("make") is None, reason="Requires make")
+    def test_exported_jobserver_is_usable_by_make(self, monkeypatch):
+        monkeypatch.delenv("MAKEFLAGS", raising=False)
+        slots = JobSlots(3, export=True)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script_path = os.path.join(tmpdir, "reserve.py")
+            with open(script_path, "w") as f:
+                f.write(RESERVE_SCRIPT)
+            with open(os.path.join(tmpdir, "Makefile"), "w") as f:
+                f.write(f"all:\n\t+{sys.executable} {script_path}\n")
+            # make should accept the jobserver, whatever its version, and pass it on to its recipes.
+            with slots.reserve(1):
+                status = subprocess.run(["make", "-s", "-C", tmpdir], capture_output=True, **slots.subprocess_kwargs(env=dict(os.environ, PYTHONPATH=SBUILDR_ROOT)))
+            assert status.returncode == 0, status.stderr.decode()
+            assert status.stdout.decode().strip() == "3"
+
+    def test_connects_to_jobserver_lazily(self, monkeypatch):
+        monkeypatch.setenv("MAKEFLAGS", "-j4 --jobserver-auth=998,999")
+        slots = JobSlots.from_environment()
+        assert slots.jobserver is None and slots.total == 4
+        # The jobserver is not usable, so there is only one slot.
+        with slots.reserve() as count:
+            assert count == 1
+        assert slots.total == 1
+
+    def test_uses_make_jobserver(self, monkeypatch):
+        monkeypatch.delenv("MAKEFLAGS", raising=False)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            script_path = os.path.join(tmpdir, "reserve.py")
+            with open(script_path, "w") as f:
+                f.write(RESERVE_SCRIPT)
+            # The recipe is prefixed with '+' so that make passes its jobserver to it.
+            with open(os.path.join(tmpdir, "Makefile"), "w") as f:
+                f.write(f"all:\n\t+{sys.executable} {script_path}\n")
+            status = subprocess.run(["make", "-s", "-j3", "-C", tmpdir], capture_output=True, env=dict(os.environ, PYTHONPATH=SBUILDR_ROOT))
+            assert status.returncode == 0, status.stderr.decode()
+            assert status.stdout.decode().strip() == "3"
@@ -1,18 +1,30 @@
 from sbuildr.dependencies.dependency import Dependency
-from sbuildr.dependencies.meta import DependencyMetadata
+from sbuildr.dependencies.cache import DependencyCache, parse_size
+from sbuildr.dependencies import archive
+from sbuildr.dependencies.meta import DependencyMetadata, LibraryMetadata
 from sbuildr.dependencies.fetchers.git_fetcher import GitFetcher
 from sbuildr.dependencies.fetchers.copy_fetcher import CopyFetcher
 from sbuildr.dependencies.builders.sbuildr_builder import SBuildrBuilder
-from sbuildr.logger import G_LOGGER
+from sbuildr.dependencies.resolver import DependencyResolver
+from sbuildr.dependencies.lockfile import Lockfile
+from sbuildr.dependencies.builder import DependencyBuilder
+from sbuildr.project.project import Project
+from sbuildr.misc.locks import FileLock
+from sbuildr.logger import G_LOGGER, SBuildrException
 import sbuildr.logger as logger
-from sbuildr.misc import paths
+from sbuildr.misc import paths, sync
 from test_tools import PATHS, ROOT, TESTS_ROOT
 
+from typing import List
+import http.server
 import subprocess
+import threading
+import functools
 import tempfile
 import filecmp
 import pytest
 import shutil
+import time
 import sys
 import os
 
@@ -54,6 +66,106 @@ class TestGitFetcher(object):
             commit_hash = head_status.stdout.strip().decode(sys.stdout.encoding)
             assert commit_hash == fetcher2_commit_hash
 
+# Creates a repository with a few commits, along with a bare clone that can be used as a remote.
+class LocalGitRemote(object):
+    def __init__(self, root: str):
+        self.work_dir = os.path.join(root, "work")
+        self.url = os.path.join(root, "remote.git")
+        os.makedirs(root, exist_ok=True)
+        self.git(["init", "-b", "master", self.work_dir])
+        self.commits = [self.commit("first"), self.commit("second")]
+        self.git(["tag", "-a", "v1.0", "-m", "Version 1.0", self.commits[0]], cwd=self.work_dir)
+        self.git(["clone", "--bare", self.work_dir, self.url])
+
+    def git(self, args, cwd=None) -> str:
+        status = subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@test"] + args, cwd=cwd or os.path.dirname(self.work_dir), capture_output=True)
+        assert not status.returncode, status.stderr
+        return status.stdout.strip().decode()
+
+    def commit(self, contents: str) -> str:
+        with open(os.path.join(self.work_dir, "file.txt"), "w") as f:
+            f.write(contents)
+        self.git(["add", "file.txt"], cwd=self.work_dir)
+        self.git(["commit", "-m", contents], cwd=self.work_dir)
+        return self.git(["rev-parse", "HEAD"], cwd=self.work_dir)
+
+    def push(self, contents: str) -> str:
+        commit = self.commit(contents)
+        self.git(["push", self.url, "master"], cwd=self.work_dir)
+        return commit
+
+class TestLocalGitFetcher(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.remote = LocalGitRemote(os.path.join(self.tmpdir.name, "remote"))
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def make_fetcher(self, name="checkout", **kwargs) -> GitFetcher:
+        fetcher = GitFetcher(url=self.remote.url, **kwargs)
+        fetcher.set_dest_dir(os.path.join(self.tmpdir.name, name))
+        fetcher.set_cache_dir(self.cache_dir)
+        return fetcher
+
+    def head(self, fetcher: GitFetcher) -> str:
+        return self.remote.git(["rev-parse", "HEAD"], cwd=fetcher.dest_dir)
+
+    def test_version_does_not_fetch(self):
+        fetcher = self.make_fetcher()
+        assert fetcher.version() == self.remote.commits[-1]
+        assert not os.path.exists(fetcher.dest_dir)
+        assert not os.path.exists(fetcher._mirror_dir())
+
+    def test_version_resolves_annotated_tags(self):
+        assert self.make_fetcher(tag="v1.0").version() == self.remote.commits[0]
+
+    def test_version_is_cached_for_ttl(self):
+        assert self.make_fetcher().version() == self.remote.commits[-1]
+        new_commit = self.remote.push("third")
+        # A new fetcher in the same cache should use the cached version until it expires.
+        assert self.make_fetcher().version() == self.remote.commits[-1]
+        assert self.make_fetcher(version_ttl=0).version() == new_commit
+
+    def test_version_falls_back_to_cache_when_remote_is_unavailable(self):
+        commit = self.make_fetcher().version()
+        shutil.rmtree(self.remote.url)
+        assert self.make_fetcher(version_ttl=0).version() == commit
+
+    def test_concurrent_version_saves_are_not_lost(self):
+        fetchers = [self.make_fetcher(name=f"checkout{index}") for index in range(8)]
+        threads = [threading.Thread(target=fetcher._save_version, args=(f"key{index}", "commit")) for index, fetcher in enumerate(fetchers)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert sorted(self.make_fetcher()._load_versions().keys()) == [f"key{index}" for index in range(8)]
+        # No temporary files are left behind.
+        assert sorted(os.listdir(self.cache_dir)) == sorted([GitFetcher.VERSIONS_FILENAME, f"{GitFetcher.VERSIONS_FILENAME}.lock"])
+
+    def test_fetch_is_shallow_and_uses_mirror(self):
+        fetcher = self.make_fetcher()
+        fetcher.fetch()
+        assert self.head(fetcher) == self.remote.commits[-1]
+        assert self.remote.git(["rev-parse", "--is-shallow-repository"], cwd=fetcher.dest_dir) == "true"
+        assert os.path.isdir(fetcher._mirror_dir())
+        assert os.path.exists(os.path.join(fetcher.dest_dir, "file.txt"))
+
+    def test_can_fetch_different_commits(self):
+        fetcher = self.make_fetcher(commit=self.remote.commits[0])
+        fetcher.fetch()
+        assert self.head(fetcher) == self.remote.commits[0]
+        fetcher = self.make_fetcher(tag=None, branch="master")
+        fetcher.fetch()
+        assert self.head(fetcher) == self.remote.commits[-1]
+
+    def test_second_checkout_fetches_from_mirror(self):
+        self.make_fetcher(name="first").fetch()
+        # Once the mirror contains the commit, the remote is no longer required.
+        shutil.rmtree(self.remote.url)
+        fetcher = self.make_fetcher(name="second")
+        fetcher.fetch()
+        assert self.head(fetcher) == self.remote.commits[-1]
+
 class TestCopyFetcher(object):
     def setup_method(self):
         self.fetcher = CopyFetcher(ROOT)
@@ -68,6 +180,82 @@ class TestCopyFetcher(object):
             assert not dircmp.left_only
             assert not dircmp.right_only
 
+class TestIncrementalCopyFetcher(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "dep")
+        self.write("unchanged.cpp", "int unchanged;")
+        self.write("changed.cpp", "int changed;")
+        self.write(os.path.join("stale", "stale.cpp"), "int stale;")
+        os.symlink("unchanged.cpp", os.path.join(self.source, "link.cpp"))
+        self.dest_dir = os.path.join(self.tmpdir.name, "dest")
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def write(self, relpath: str, contents: str, mtime: float=1000):
+        path = os.path.join(self.source, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+        os.utime(path, (mtime, mtime))
+
+    def fetch(self, **kwargs) -> CopyFetcher:
+        fetcher = CopyFetcher(self.source, **kwargs)
+        fetcher.set_dest_dir(self.dest_dir)
+        fetcher.fetch()
+        return fetcher
+
+    def dest_mtime(self, relpath: str) -> int:
+        return os.stat(os.path.join(self.dest_dir, relpath)).st_mtime_ns
+
+    def test_only_copies_changes(self):
+        self.fetch()
+        unchanged_inode = os.stat(os.path.join(self.dest_dir, "unchanged.cpp")).st_ino
+
+        self.write("changed.cpp", "int changed = 1;", mtime=2000)
+        self.write("new.cpp", "int added;")
+        shutil.rmtree(os.path.join(self.source, "stale"))
+        stats = sync.sync_tree(self.source, self.dest_dir)
+
+        assert os.stat(os.path.join(self.dest_dir, "unchanged.cpp")).st_ino == unchanged_inode
+        assert self.dest_mtime("unchanged.cpp") == 1000 * 10**9
+        assert self.dest_mtime("changed.cpp") == 2000 * 10**9
+        assert sorted([os.path.basename(path) for path in stats.copied]) == ["changed.cpp", "new.cpp"]
+        assert not os.path.exists(os.path.join(self.dest_dir, "stale"))
+        assert os.readlink(os.path.join(self.dest_dir, "link.cpp")) == "unchanged.cpp"
+        dircmp = filecmp.dircmp(self.source, self.dest_dir)
+        assert not dircmp.left_only and not dircmp.right_only and not dircmp.diff_files
+
+    def test_compare_hashes_skips_touched_files(self):
+        self.fetch()
+        self.write("unchanged.cpp", "int unchanged;", mtime=2000)
+        assert os.path.join(self.dest_dir, "unchanged.cpp") in sync.sync_tree(self.source, self.dest_dir).copied
+        self.write("unchanged.cpp", "int unchanged;", mtime=3000)
+        stats = sync.sync_tree(self.source, self.dest_dir, compare_hashes=True)
+        assert os.path.join(self.dest_dir, "unchanged.cpp") in stats.skipped
+
+    def test_hardlink_mode(self):
+        self.fetch(link_mode=sync.LinkMode.HARDLINK)
+        assert os.path.samefile(os.path.join(self.source, "changed.cpp"), os.path.join(self.dest_dir, "changed.cpp"))
+
+    @pytest.mark.parametrize("link_mode", [sync.LinkMode.COPY, sync.LinkMode.REFLINK])
+    def test_copies_are_independent(self, link_mode):
+        self.fetch(link_mode=link_mode)
+        assert not os.path.samefile(os.path.join(self.source, "changed.cpp"), os.path.join(self.dest_dir, "changed.cpp"))
+        with open(os.path.join(self.dest_dir, "changed.cpp")) as f:
+            assert f.read() == "int changed;"
+
+    def test_preserved_paths_are_not_removed(self):
+        fetcher = self.fetch()
+        build_dir = os.path.join(self.dest_dir, "build")
+        os.makedirs(build_dir)
+        with open(os.path.join(build_dir, "object.o"), "w") as f:
+            f.write("object")
+        fetcher.set_preserved_paths(["build"])
+        fetcher.fetch()
+        assert os.path.exists(os.path.join(build_dir, "object.o"))
+
 class TestSBuildrBuilder(object):
     def setup_method(self):
         self.builder = SBuildrBuilder()
@@ -84,6 +272,13 @@ class TestSBuildrBuilder(object):
         assert os.path.exists(os.path.join(self.header_dir, "math.hpp"))
         assert os.path.exists(os.path.join(self.lib_dir, paths.name_to_libname("math")))
 
+    def test_runs_build_script_in_process(self):
+        cwd = os.getcwd()
+        project = self.builder._run_build_script(ROOT)
+        assert isinstance(project, Project)
+        assert "math" in project.libraries
+        assert os.getcwd() == cwd
+
     def teardown_method(self):
         shutil.rmtree(PATHS["build"], ignore_errors=True)
 
@@ -119,3 +314,547 @@ class TestDependencyMetadata(object):
         loaded_meta = DependencyMetadata.load(f.name)
         assert os.path.exists(f.name) and loaded_meta.META_API_VERSION == self.dummy_meta.META_API_VERSION
         assert loaded_meta.META_API_VERSION != DependencyMetadata.META_API_VERSION
+
+# A builder that does not build anything, but keeps track of how many times it was invoked.
+class CountingBuilder(DependencyBuilder):
+    def __init__(self, delay: float=0):
+        self.delay = delay
+        self.installs = 0
+        self.requested_libraries = []
+
+    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+        time.sleep(self.delay)
+        self.installs += 1
+        self.requested_libraries.append(libraries)
+        for name in libraries or []:
+            os.makedirs(lib_dir, exist_ok=True)
+            with open(os.path.join(lib_dir, paths.name_to_libname(name)), "w") as f:
+                f.write(name)
+        return DependencyMetadata({name: LibraryMetadata(os.path.join(lib_dir, paths.name_to_libname(name)), libs=[], lib_dirs=[lib_dir]) for name in libraries or []}, [])
+
+class IncrementalBuilder(CountingBuilder):
+    # Writes build artifacts into the source directory, and records which of them already existed.
+    def __init__(self):
+        super().__init__()
+        self.reused = []
+
+    def output_dirs(self) -> List[str]:
+        return ["build"]
+
+    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+        artifact = os.path.join(source_dir, "build", "object.o")
+        self.reused.append(os.path.exists(artifact))
+        os.makedirs(os.path.dirname(artifact), exist_ok=True)
+        with open(artifact, "w") as f:
+            f.write("object")
+        return super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+
+class TestRequestedLibraries(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_root = os.path.join(self.tmpdir.name, "cache")
+        self.source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(self.source)
+        self.builder = CountingBuilder()
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def make_dependency(self, libraries: List[str]) -> Dependency:
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), self.builder, cache_root=self.cache_root)
+        [dep.library(name) for name in libraries]
+        return dep
+
+    def test_only_requested_libraries_are_built(self):
+        dep = self.make_dependency(["b", "a"])
+        dep.setup()
+        assert self.builder.requested_libraries == [["a", "b"]]
+        assert dep.library("a").library.path == os.path.join(dep.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR, "liba.so")
+
+    def test_package_is_reused_for_subset_of_libraries(self):
+        self.make_dependency(["a", "b"]).setup()
+        self.make_dependency(["a"]).setup()
+        assert self.builder.installs == 1
+
+    def test_package_is_rebuilt_with_union_of_libraries(self):
+        self.make_dependency(["a"]).setup()
+        dep = self.make_dependency(["b"])
+        meta = dep.setup()
+        assert self.builder.requested_libraries == [["a"], ["a", "b"]]
+        assert sorted(meta.libraries.keys()) == ["a", "b"]
+
+    def test_rebuilt_package_is_never_missing(self, monkeypatch):
+        self.make_dependency(["a"]).setup()
+        dep = self.make_dependency(["b"])
+        # Open files from the existing package remain usable after it is replaced.
+        existing = open(os.path.join(self.cache_root, "packages", "dep-1.0", Dependency.PACKAGE_LIBRARY_SUBDIR, "liba.so"))
+        removed = []
+        rmtree = shutil.rmtree
+        def record_rmtree(path, *args, **kwargs):
+            rmtree(path, *args, **kwargs)
+            removed.append((path, os.path.exists(os.path.join(dep.cache_root, "packages", "dep-1.0", Dependency.METADATA_FILENAME))))
+        monkeypatch.setattr(shutil, "rmtree", record_rmtree)
+
+        dep.setup()
+        assert removed and all([package_exists for _, package_exists in removed])
+        with existing:
+            assert existing.read() == "a"
+        # Only the complete package remains.
+        assert os.listdir(os.path.dirname(dep.package_root)) == ["dep-1.0"]
+
+    def test_relative_source_paths_do_not_depend_on_working_directory(self, monkeypatch):
+        monkeypatch.chdir(self.tmpdir.name)
+        dep = Dependency(CopyFetcher("dep", version="1.0"), self.builder, cache_root="cache")
+        # Build scripts of nested dependencies may change the working directory while dependencies are set up.
+        monkeypatch.chdir(self.source)
+        dep.setup()
+        assert dep.fetcher.source() == self.source
+        assert dep.package_root == os.path.join(self.cache_root, "packages", "dep-1.0")
+
+class TestDependencyResolver(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_root = os.path.join(self.tmpdir.name, "cache")
+        self.sources = []
+        for name in ["dep_a", "dep_b"]:
+            path = os.path.join(self.tmpdir.name, name)
+            os.makedirs(path)
+            self.sources.append(path)
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def test_deduplicates_diamond_dependencies(self):
+        builder = CountingBuilder(delay=0.1)
+        # Two separate Dependency instances referring to the same name and version, e.g. from different nested projects.
+        first = Dependency(CopyFetcher(self.sources[0], version="1.0"), builder, cache_root=self.cache_root)
+        second = Dependency(CopyFetcher(self.sources[0], version="1.0"), builder, cache_root=self.cache_root)
+        metas = DependencyResolver().resolve([first, second, first])
+        assert builder.installs == 1
+        assert set(metas.keys()) == set([first, second])
+        assert first.package_root == second.package_root
+
+    def test_sets_up_independent_dependencies_concurrently(self):
+        delay = 0.5
+        builder = CountingBuilder(delay=delay)
+        deps = [Dependency(CopyFetcher(source), builder, cache_root=self.cache_root) for source in self.sources]
+        resolver = DependencyResolver(max_workers=2)
+        start = time.time()
+        resolver.resolve(deps)
+        assert time.time() - start < delay * len(deps)
+        assert builder.installs == len(deps)
+
+    def test_reports_order_and_times(self):
+        deps = [Dependency(CopyFetcher(source), CountingBuilder(), cache_root=self.cache_root) for source in self.sources]
+        resolver = DependencyResolver(max_workers=1)
+        resolver.resolve(deps)
+        assert resolver.order == deps
+        assert all([resolver.times[dep] >= 0 for dep in deps])
+
+    def test_nested_resolves_do_not_evict_packages_of_enclosing_resolves(self):
+        nested_source = os.path.join(self.tmpdir.name, "nested")
+        os.makedirs(nested_source)
+        stale = Dependency(CopyFetcher(self.sources[0], version="0.1"), CountingBuilder(), cache_root=self.cache_root)
+        stale.setup()
+
+        class NestingBuilder(CountingBuilder):
+            # Resolves its own dependencies, like the build script of a nested project.
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                nested = Dependency(CopyFetcher(nested_source, version="1.0"), CountingBuilder(), cache_root=cache_root)
+                DependencyResolver(max_cache_size=0).resolve([nested])
+                self.nested_root = nested.package_root
+                return super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+
+        cache_root = self.cache_root
+        first = Dependency(CopyFetcher(self.sources[0], version="1.0"), CountingBuilder(), cache_root=self.cache_root)
+        nesting_builder = NestingBuilder()
+        second = Dependency(CopyFetcher(self.sources[1], version="1.0"), nesting_builder, cache_root=self.cache_root)
+        DependencyResolver(max_workers=1, max_cache_size=0).resolve([first, second])
+        assert all([os.path.exists(path) for path in [first.package_root, second.package_root, nesting_builder.nested_root]])
+        # Garbage is still collected once the outermost resolve finishes.
+        assert not os.path.exists(stale.package_root)
+
+    def test_nested_resolves_share_bound_on_concurrent_setups(self):
+        running = [0]
+        max_running = [0]
+        lock = threading.Lock()
+
+        class ConcurrencyBuilder(CountingBuilder):
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                with lock:
+                    running[0] += 1
+                    max_running[0] = max(max_running[0], running[0])
+                time.sleep(0.1)
+                with lock:
+                    running[0] -= 1
+                return super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+
+        nested_sources = []
+        for name in ["nested_a", "nested_b"]:
+            nested_sources.append(os.path.join(self.tmpdir.name, name))
+            os.makedirs(nested_sources[-1])
+
+        class NestingBuilder(CountingBuilder):
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                nested = [Dependency(CopyFetcher(source), ConcurrencyBuilder(), cache_root=cache_root) for source in nested_sources]
+                DependencyResolver(max_workers=4).resolve(nested)
+                return super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+
+        cache_root = self.cache_root
+        deps = [Dependency(CopyFetcher(self.sources[0]), NestingBuilder(), cache_root=self.cache_root), Dependency(CopyFetcher(self.sources[1]), ConcurrencyBuilder(), cache_root=self.cache_root)]
+        DependencyResolver(max_workers=1).resolve(deps)
+        assert max_running[0] == 1
+
+    def test_nested_dependency_with_same_name_is_rejected(self):
+        class SelfDependentBuilder(CountingBuilder):
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                DependencyResolver().resolve([Dependency(CopyFetcher(source, version="2.0"), CountingBuilder(), cache_root=cache_root)])
+                return super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+
+        source, cache_root = self.sources[0], self.cache_root
+        with pytest.raises(SBuildrException, match="is required while it is being set up"):
+            DependencyResolver().resolve([Dependency(CopyFetcher(source, version="1.0"), SelfDependentBuilder(), cache_root=cache_root)])
+
+# A builder that installs a library, then fails, e.g. due to a compiler error or an interruption.
+class FailingBuilder(DependencyBuilder):
+    def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+        os.makedirs(lib_dir)
+        with open(os.path.join(lib_dir, "libpartial.so"), "w") as f:
+            f.write("")
+        G_LOGGER.critical("Build failed")
+
+class TestDependencyCache(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_root = os.path.join(self.tmpdir.name, "cache")
+        self.source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(self.source)
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def test_setup_waits_for_lock_held_by_other_process(self):
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), CountingBuilder(), cache_root=self.cache_root)
+        delay = 1.0
+        holder = subprocess.Popen([sys.executable, "-c", f"import time, sys; sys.path.insert(0, {repr(SBUILDR_ROOT)}); from sbuildr.misc.locks import FileLock; lock = FileLock({repr(dep.lock_path())}); lock.acquire(); print('locked', flush=True); time.sleep({delay})"], stdout=subprocess.PIPE)
+        assert holder.stdout.readline().strip() == b"locked"
+        assert not FileLock(dep.lock_path()).acquire(blocking=False)
+        start = time.time()
+        dep.setup()
+        assert time.time() - start >= delay / 2
+        holder.wait()
+        assert FileLock(dep.lock_path()).acquire(blocking=False)
+
+    def test_refetch_preserves_build_dir(self):
+        source = os.path.join(self.source, "file.cpp")
+        with open(source, "w") as f:
+            f.write("int file;")
+        builder = IncrementalBuilder()
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), builder, cache_root=self.cache_root)
+        dep.setup()
+        os.utime(source, (2000, 2000))
+        dep.setup(force=True)
+        assert builder.reused == [False, True]
+        assert os.path.getmtime(os.path.join(dep.fetcher.dest_dir, "file.cpp")) == 2000
+
+    def test_failed_install_does_not_leave_partial_package(self):
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), FailingBuilder(), cache_root=self.cache_root)
+        with pytest.raises(Exception):
+            dep.setup()
+        assert os.listdir(os.path.join(self.cache_root, Dependency.CACHE_PACKAGES_SUBDIR)) == []
+        # A subsequent setup with a working builder should succeed.
+        dep.builder = CountingBuilder()
+        dep.setup()
+        assert os.path.exists(os.path.join(dep.package_root, Dependency.METADATA_FILENAME))
+
+    def test_metadata_paths_point_to_package_root(self):
+        class LibraryBuilder(DependencyBuilder):
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                return DependencyMetadata({"test": LibraryMetadata(os.path.join(lib_dir, "libtest.so"), libs=[], lib_dirs=[lib_dir])}, [header_dir])
+
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), LibraryBuilder(), cache_root=self.cache_root)
+        meta = dep.setup()
+        lib_dir = os.path.join(dep.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR)
+        assert meta.libraries["test"].path == os.path.join(lib_dir, "libtest.so")
+        assert meta.libraries["test"].lib_dirs == [lib_dir]
+        assert meta.include_dirs == [dep.include_dir()]
+
+class TestDependencyCacheGC(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = DependencyCache(os.path.join(self.tmpdir.name, "cache"))
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def make_entry(self, subdir: str, name: str, dependency_name: str, size: int, last_used: float) -> str:
+        path = os.path.join(self.cache.root, subdir, name)
+        os.makedirs(path)
+        with open(os.path.join(path, "data"), "wb") as f:
+            f.write(b"0" * size)
+        self.cache.touch(path, dependency_name)
+        index_path = self.cache._index_path(path)
+        os.utime(index_path, (last_used, last_used))
+        return path
+
+    @pytest.mark.parametrize("size, expected", [
+        ("1024", 1024),
+        ("2K", 2048),
+        ("1.5M", int(1.5 * (1 << 20))),
+        ("10GB", 10 * (1 << 30)),
+        ("10g", 10 * (1 << 30)),
+    ])
+    def test_parse_size(self, size, expected):
+        assert parse_size(size) == expected
+
+    def test_evicts_least_recently_used_first(self):
+        old = self.make_entry("packages", "dep-1.0", "dep", 100, last_used=1000)
+        new = self.make_entry("packages", "dep-2.0", "dep", 100, last_used=2000)
+        source = self.make_entry("sources", "dep", "dep", 100, last_used=3000)
+        evicted = self.cache.collect_garbage(max_size=200)
+        assert [entry.path for entry in evicted] == [old]
+        assert not os.path.exists(old)
+        assert os.path.exists(new) and os.path.exists(source)
+        assert self.cache.size() == 200
+
+    def test_dry_run_does_not_evict(self):
+        path = self.make_entry("packages", "dep-1.0", "dep", 100, last_used=1000)
+        evicted = self.cache.collect_garbage(max_size=0, dry_run=True)
+        assert [entry.path for entry in evicted] == [path]
+        assert os.path.exists(path)
+
+    def test_does_not_evict_kept_or_locked_entries(self):
+        kept = self.make_entry("packages", "kept-1.0", "kept", 100, last_used=1000)
+        locked = self.make_entry("packages", "locked-1.0", "locked", 100, last_used=1000)
+        evictable = self.make_entry("packages", "other-1.0", "other", 100, last_used=2000)
+        lock = FileLock(self.cache.lock_path("locked"))
+        lock.acquire()
+        try:
+            evicted = self.cache.collect_garbage(max_size=0, keep=set([kept]))
+        finally:
+            lock.release()
+        assert [entry.path for entry in evicted] == [evictable]
+        assert os.path.exists(kept) and os.path.exists(locked)
+
+    def test_does_not_evict_packages_referenced_by_lockfiles(self):
+        source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(source)
+        dep = Dependency(CopyFetcher(source, version="1.0"), CountingBuilder(), cache_root=self.cache.root)
+        dep.setup()
+        # Another project pins the package, which is now the least recently used entry in the cache.
+        lockfile = Lockfile(os.path.join(self.tmpdir.name, "other_project", Lockfile.DEFAULT_NAME))
+        os.makedirs(os.path.dirname(lockfile.path))
+        lockfile.update([dep])
+        lockfile.save()
+        os.utime(self.cache._index_path(dep.package_root), (1000, 1000))
+        newer = self.make_entry("packages", "other-1.0", "other", 100, last_used=2000)
+
+        evicted = self.cache.collect_garbage(max_size=0)
+        assert dep.package_root not in [entry.path for entry in evicted]
+        assert os.path.exists(dep.package_root) and not os.path.exists(newer)
+
+        # Once the lockfile pins another version, the package may be evicted.
+        lockfile.entries["dep"]["version"] = "2.0"
+        lockfile.save()
+        assert dep.package_root in [entry.path for entry in self.cache.collect_garbage(max_size=0)]
+        assert not os.path.exists(dep.package_root)
+
+    def test_setup_records_usage(self):
+        source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(source)
+        dep = Dependency(CopyFetcher(source, version="1.0"), CountingBuilder(), cache_root=self.cache.root)
+        dep.setup()
+        entries = self.cache.entries()
+        assert set([entry.path for entry in entries]) == set([dep.package_root, dep.fetcher.dest_dir])
+        assert all([entry.dependency_name == "dep" for entry in entries])
+
+    def test_resolver_enforces_budget(self):
+        sources = []
+        for name in ["dep_a", "dep_b"]:
+            sources.append(os.path.join(self.tmpdir.name, name))
+            os.makedirs(sources[-1])
+        unused = self.make_entry("packages", "unused-1.0", "unused", 100, last_used=1000)
+        deps = [Dependency(CopyFetcher(source), CountingBuilder(), cache_root=self.cache.root) for source in sources]
+        DependencyResolver(max_cache_size=0).resolve(deps)
+        assert not os.path.exists(unused)
+        # Packages used by the project must never be evicted.
+        assert all([os.path.exists(dep.package_root) for dep in deps])
+
+# A fetcher that tracks how many times versions are resolved.
+class CountingCopyFetcher(CopyFetcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolutions = 0
+
+    def version(self) -> str:
+        self.resolutions += 1
+        return super().version()
+
+class TestLockfile(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_root = os.path.join(self.tmpdir.name, "cache")
+        self.source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(self.source)
+        self.path = os.path.join(self.tmpdir.name, Lockfile.DEFAULT_NAME)
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def make_dependency(self, version="1.0") -> Dependency:
+        return Dependency(CountingCopyFetcher(self.source, version=version), CountingBuilder(), cache_root=self.cache_root)
+
+    def lock(self, dep: Dependency):
+        dep.setup()
+        lockfile = Lockfile(self.path)
+        lockfile.update([dep])
+        lockfile.save()
+
+    def test_records_dependencies(self):
+        dep = self.make_dependency()
+        self.lock(dep)
+        entry = Lockfile(self.path).entries["dep"]
+        assert entry == {"fetcher": "CountingCopyFetcher", "source": "dep", "version": "1.0"}
+
+    def test_lockfile_is_relocatable(self):
+        self.lock(self.make_dependency())
+        # Another checkout of the same project, with its own copy of the dependency's source code.
+        checkout = os.path.join(self.tmpdir.name, "checkout")
+        os.makedirs(os.path.join(checkout, "dep"))
+        shutil.copy(self.path, os.path.join(checkout, Lockfile.DEFAULT_NAME))
+        dep = Dependency(CountingCopyFetcher(os.path.join(checkout, "dep"), version="2.0"), CountingBuilder(), cache_root=self.cache_root)
+        assert Lockfile(os.path.join(checkout, Lockfile.DEFAULT_NAME)).pin([dep]) == [dep]
+
+    def test_pinned_dependency_skips_resolution(self):
+        self.lock(self.make_dependency())
+        dep = self.make_dependency(version="2.0")
+        assert Lockfile(self.path).pin([dep]) == [dep]
+        dep.setup()
+        assert dep.fetcher.resolutions == 0
+        assert dep.version == "1.0"
+        assert dep.builder.installs == 0
+
+    def test_modified_dependency_is_not_pinned(self):
+        self.lock(self.make_dependency())
+        other_source = os.path.join(self.tmpdir.name, "other", "dep")
+        os.makedirs(other_source)
+        dep = Dependency(CountingCopyFetcher(other_source), CountingBuilder(), cache_root=self.cache_root)
+        assert Lockfile(self.path).pin([dep]) == []
+        dep.setup()
+        assert dep.fetcher.resolutions == 1
+
+class TestPackageArchives(object):
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "dep")
+        os.makedirs(self.source)
+        self.archive_dir = os.path.join(self.tmpdir.name, "archives")
+        # Pack a package built on one "machine"
+        dep = self.make_dependency("first_cache")
+        dep.setup()
+        self.archive_path = dep.pack(self.archive_dir)
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def make_dependency(self, cache_name: str, archive_dir: str=None, builder: DependencyBuilder=None) -> Dependency:
+        dep = Dependency(CopyFetcher(self.source, version="1.0"), builder or CountingBuilder(), cache_root=os.path.join(self.tmpdir.name, cache_name), archive_dir=archive_dir)
+        dep.library("a")
+        return dep
+
+    def check_unpacked(self, dep: Dependency, meta: DependencyMetadata):
+        assert dep.builder.installs == 0
+        lib_path = os.path.join(dep.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR, "liba.so")
+        assert os.path.exists(lib_path)
+        assert meta.libraries["a"].path == lib_path
+        assert dep.library("a").library.path == lib_path
+
+    def test_archive_is_keyed_by_version_and_builder(self):
+        assert os.path.basename(self.archive_path) == f"dep-1.0-{CountingBuilder().signature()}{archive.ARCHIVE_EXTENSION}"
+
+    def test_setup_uses_archive(self):
+        dep = self.make_dependency("second_cache", archive_dir=self.archive_dir)
+        self.check_unpacked(dep, dep.setup())
+
+    def test_setup_uses_archive_over_http(self):
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=self.archive_dir)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            dep = self.make_dependency("second_cache", archive_dir=f"http://127.0.0.1:{server.server_port}/")
+            self.check_unpacked(dep, dep.setup())
+            # Missing archives are built from source.
+            other = Dependency(CopyFetcher(self.source, version="2.0"), CountingBuilder(), cache_root=os.path.join(self.tmpdir.name, "third_cache"), archive_dir=dep.archive_dir)
+            other.setup()
+            assert other.builder.installs == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_archive_from_different_builder_is_ignored(self):
+        class OtherBuilder(CountingBuilder):
+            def signature(self) -> str:
+                return "other"
+
+        dep = self.make_dependency("second_cache", archive_dir=self.archive_dir, builder=OtherBuilder())
+        dep.setup()
+        assert dep.builder.installs == 1
+
+    def test_archive_includes_transitive_dependencies(self):
+        inner_source = os.path.join(self.tmpdir.name, "inner")
+        os.makedirs(inner_source)
+        inner = Dependency(CopyFetcher(inner_source, version="2.0"), CountingBuilder(), cache_root=os.path.join(self.tmpdir.name, "first_cache"))
+        inner.library("b")
+        inner.setup()
+
+        class DependentBuilder(CountingBuilder):
+            def install(self, source_dir: str, header_dir: str, lib_dir: str, exec_dir: str, libraries: List[str]=None) -> DependencyMetadata:
+                meta = super().install(source_dir, header_dir, lib_dir, exec_dir, libraries)
+                for lib in meta.libraries.values():
+                    lib.lib_dirs.append(os.path.join(inner.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR))
+                meta.include_dirs.append(inner.include_dir())
+                meta.dependencies = {"inner": inner.package_root}
+                return meta
+
+        dep = Dependency(CopyFetcher(self.source, version="3.0"), DependentBuilder(), cache_root=os.path.join(self.tmpdir.name, "first_cache"))
+        dep.library("a")
+        dep.setup()
+        archive_dir = os.path.join(self.tmpdir.name, "dependent_archives")
+        dep.pack(archive_dir)
+
+        # The package is unpacked on another machine, where the inner dependency has not been set up.
+        unpacked = Dependency(CopyFetcher(self.source, version="3.0"), DependentBuilder(), cache_root=os.path.join(self.tmpdir.name, "second_cache"), archive_dir=archive_dir)
+        unpacked.library("a")
+        meta = unpacked.setup()
+        assert unpacked.builder.installs == 0
+        inner_root = os.path.join(os.path.dirname(unpacked.package_root), "inner-2.0")
+        assert meta.dependencies == {"inner": inner_root}
+        assert meta.libraries["a"].lib_dirs == [os.path.join(unpacked.package_root, Dependency.PACKAGE_LIBRARY_SUBDIR), os.path.join(inner_root, Dependency.PACKAGE_LIBRARY_SUBDIR)]
+        assert os.path.join(inner_root, Dependency.PACKAGE_HEADER_SUBDIR) in meta.include_dirs
+        inner_meta = DependencyMetadata.load(os.path.join(inner_root, DependencyMetadata.FILENAME))
+        assert os.path.exists(inner_meta.libraries["b"].path) and inner_meta.libraries["b"].path.startswith(inner_root)
+
+    def test_unversioned_archives_are_keyed_by_source(self):
+        with open(os.path.join(self.source, "file.cpp"), "w") as f:
+            f.write("int file;")
+        dep = Dependency(CopyFetcher(self.source), CountingBuilder(), cache_root=os.path.join(self.tmpdir.name, "unversioned_cache"))
+        dep.setup()
+        name = dep.archive_name()
+        assert name != f"dep-{CountingBuilder().signature()}{archive.ARCHIVE_EXTENSION}"
+        dep.pack(self.archive_dir)
+
+        with open(os.path.join(self.source, "file.cpp"), "w") as f:
+            f.write("int file = 1;")
+        changed = Dependency(CopyFetcher(self.source), CountingBuilder(), cache_root=os.path.join(self.tmpdir.name, "changed_cache"), archive_dir=self.archive_dir)
+        changed.setup()
+        assert changed.archive_name() != name
+        # Archives of other source code are not used.
+        assert changed.builder.installs == 1
+
+    def test_unpack_package_without_dependency(self):
+        packages_dir = os.path.join(self.tmpdir.name, "second_cache", Dependency.CACHE_PACKAGES_SUBDIR)
+        meta = archive.unpack_package(self.archive_path, packages_dir)
+        assert meta.libraries["a"].path == os.path.join(packages_dir, "dep-1.0", Dependency.PACKAGE_LIBRARY_SUBDIR, "liba.so")
+        assert os.listdir(packages_dir) == ["dep-1.0"]
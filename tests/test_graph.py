@@ -1,5 +1,9 @@
+from sbuildr.graph.node import Node, Library, SourceNode, CompiledNode, LinkedNode
+from sbuildr.tools import compiler, linker
+from sbuildr.tools.flags import BuildFlags
 from sbuildr.graph.graph import Graph
-from sbuildr.graph.node import Node, Library
+import subprocess
+import os
 
 def linear_graph():
     # Constructs a linear graph:
@@ -88,3 +92,63 @@ class TestNodes(object):
     def test_library_node_has_no_path(self):
         libstdcpp = Library("stdc++")
         assert not libstdcpp.path
+
+    def test_compiled_node_publishes_only_changed_objects(self, tmp_path):
+        header = tmp_path / "value.hpp"
+        source = tmp_path / "value.cpp"
+        header.write_text("// A comment\nconstexpr int VALUE = 1;\n")
+        source.write_text('#include "value.hpp"\nint value() { return VALUE; }\n')
+        node = CompiledNode(str(tmp_path / "value.o"), SourceNode(str(source), [SourceNode(str(header))], include_dirs=[str(tmp_path)]), compiler.gcc)
+
+        compiled, public = node.artifacts()
+        assert compiled.path == node.compiled_path
+        assert public.path == node.path and public.dependencies == [node]
+
+        def build():
+            for artifact in node.artifacts():
+                for cmd in artifact.commands:
+                    subprocess.run(cmd, check=True, capture_output=True)
+
+        build()
+        published_mtime = os.stat(node.path).st_mtime_ns
+        # Changing a comment does not change the object, so the published object, on which links depend, must not be touched.
+        header.write_text("// A different comment\nconstexpr int VALUE = 1;\n")
+        build()
+        assert os.stat(node.path).st_mtime_ns == published_mtime
+
+        header.write_text("// A different comment\nconstexpr int VALUE = 2;\n")
+        build()
+        assert os.stat(node.path).st_mtime_ns != published_mtime
+        assert open(node.path, "rb").read() == open(node.compiled_path, "rb").read()
+
+    def test_library_interface_changes_only_with_exports(self, tmp_path):
+        source = tmp_path / "value.cpp"
+        source.write_text("int value() { return 1; }\n")
+        flags = BuildFlags().fpic()
+        obj = CompiledNode(str(tmp_path / "value.o"), SourceNode(str(source), include_dirs=[]), compiler.gcc, flags=flags)
+        lib = LinkedNode(str(tmp_path / "libvalue.so"), [obj], linker.gcc, hashed_path=str(tmp_path / "libvalue.0123456789abcdef.so"), flags=flags + BuildFlags()._enable_shared())
+        exe = LinkedNode(str(tmp_path / "exe"), [obj], linker.gcc, hashed_path=str(tmp_path / "exe"), flags=flags)
+
+        assert [artifact.path for artifact in lib.artifacts()] == [lib.hashed_path, lib.path, lib.interface_path]
+        assert [artifact.path for artifact in exe.artifacts()] == [exe.hashed_path, exe.path]
+
+        def build():
+            for node in [obj, lib]:
+                for artifact in node.artifacts():
+                    for cmd in artifact.commands + artifact.always:
+                        subprocess.run(cmd, check=True, capture_output=True)
+
+        build()
+        interface = open(lib.interface_path).read()
+        assert "value" in interface
+        interface_mtime = os.stat(lib.interface_path).st_mtime_ns
+
+        # Changing a function body changes the library, but not its interface.
+        source.write_text("int value() { return 2; }\n")
+        build()
+        assert os.stat(lib.interface_path).st_mtime_ns == interface_mtime
+
+        source.write_text("int value() { return 2; }\nint other() { return 3; }\n")
+        build()
+        assert os.stat(lib.interface_path).st_mtime_ns != interface_mtime
+        assert "other" in open(lib.interface_path).read()
@@ -1,15 +1,30 @@
-from sbuildr.project.file_manager import FileManager
+from sbuildr.project.file_manager import FileManager, _token_hash
+from sbuildr.project.watcher import PollingWatcher, InotifyWatcher
+from sbuildr.project.snapshot import ProjectSnapshot
 from sbuildr.project.project import Project
-from sbuildr.graph.node import Library
+from sbuildr.project import runner, bench, unity
+from sbuildr.dependencies.dependency import Dependency
+from sbuildr.dependencies.lockfile import Lockfile
+from sbuildr.graph.node import Library, CompiledNode, UnitySourceNode
 from sbuildr.backends.rbuild import RBuildBackend
-from sbuildr.logger import G_LOGGER
+from sbuildr.backends.backend import Backend
+from sbuildr.tools import compiler, linker
+from sbuildr.tools.flags import BuildFlags
+from sbuildr.logger import G_LOGGER, SBuildrException
 import sbuildr.logger as logger
 
 from test_tools import PATHS, TESTS_ROOT, ROOT
+from test_dependencies import CountingBuilder, CountingCopyFetcher
 
+import xml.etree.ElementTree as ET
+import subprocess
 import tempfile
+import pickle
+import sys
+import pytest
 import shutil
 import glob
+import time
 import os
 
 G_LOGGER.verbosity = logger.Verbosity.VERBOSE
@@ -124,7 +139,249 @@ class TestProject(object):
         assert loaded_project.PROJECT_API_VERSION == self.project.PROJECT_API_VERSION
         assert loaded_project.PROJECT_API_VERSION != Project.PROJECT_API_VERSION
 
-    # TODO: Test run, run_tests, install, uninstall
+    def test_export_creates_snapshot(self):
+        f = tempfile.NamedTemporaryFile()
+        self.project.export(f.name)
+        snapshot = ProjectSnapshot(f.name)
+        assert snapshot.metadata["api_version"] == Project.PROJECT_API_VERSION
+        assert snapshot.metadata["profiles"] == self.project.all_profile_names()
+        # Target metadata can be read without loading the rest of the project.
+        targets = snapshot.section(ProjectSnapshot.TARGETS_SECTION)
+        assert sorted([(target["name"], target["kind"]) for target in targets]) == [("test", "executables"), ("test", "libraries"), ("test2", "tests")]
+        assert ProjectSnapshot.PROJECT_SECTION not in snapshot._cache
+
+    def test_load_restores_file_index(self):
+        f = tempfile.NamedTemporaryFile()
+        self.project.export(f.name)
+        loaded_project = Project.load(f.name)
+        # The file index is only loaded when it is first accessed.
+        assert loaded_project.files._files is None
+        assert loaded_project.files.files == self.project.files.files
+        assert sorted(loaded_project.libraries.keys()) == sorted(self.project.libraries.keys())
+
+    def test_export_does_not_modify_project(self):
+        files = self.project.files.files
+        f = tempfile.NamedTemporaryFile()
+        self.project.export(f.name)
+        assert self.project.files.files is files
+
+    def test_snapshot_can_be_closed(self):
+        f = tempfile.NamedTemporaryFile()
+        self.project.export(f.name)
+        with ProjectSnapshot(f.name) as snapshot:
+            targets = snapshot.section(ProjectSnapshot.TARGETS_SECTION)
+        assert snapshot.data.closed
+        # Decoded sections remain available.
+        assert snapshot.section(ProjectSnapshot.TARGETS_SECTION) == targets
+        with pytest.raises(SBuildrException):
+            snapshot.section(ProjectSnapshot.FILES_SECTION)
+
+    def test_pickled_file_manager_rebuilds_file_index(self):
+        loaded = pickle.loads(pickle.dumps(self.project.files))
+        assert loaded.files == self.project.files.files
+
+    def test_lockfile_defaults_to_build_script_directory(self):
+        assert self.project.lockfile_path == os.path.join(os.path.dirname(os.path.abspath(__file__)), Lockfile.DEFAULT_NAME)
+
+    def test_configure_uses_lockfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, "dep")
+            os.makedirs(source)
+            self.project.lockfile_path = os.path.join(tmpdir, Lockfile.DEFAULT_NAME)
+
+            def configure_with_dependency(version: str, **kwargs) -> Dependency:
+                dep = Dependency(CountingCopyFetcher(source, version=version), CountingBuilder(), cache_root=os.path.join(tmpdir, "cache"))
+                self.project.public_header_dependencies = [dep]
+                self.project.configure(targets=[], **kwargs)
+                return dep
+
+            dep = configure_with_dependency("1.0")
+            assert Lockfile(self.project.lockfile_path).entries["dep"]["version"] == "1.0"
+            # Subsequent configures use the locked version without resolving it.
+            dep = configure_with_dependency("2.0")
+            assert dep.fetcher.resolutions == 0 and dep.version == "1.0"
+            dep = configure_with_dependency("2.0", update_dependencies=True)
+            assert dep.fetcher.resolutions == 1 and dep.version == "2.0"
+            assert Lockfile(self.project.lockfile_path).entries["dep"]["version"] == "2.0"
+
+    def test_precompiled_header(self):
+        exe = self.project.executable("pch", sources=["tests/test.cpp"], libs=[Library("stdc++"), self.lib], precompiled_header="utils.hpp")
+        test = self.project.test("pch_test", sources=["tests/test.cpp"], libs=[Library("stdc++"), self.lib], precompiled_header="utils.hpp")
+        self.project.configure(targets=[exe, test, self.lib])
+
+        pch_paths = set()
+        for profile_name in self.project.all_profile_names():
+            # Targets built with the same options share a precompiled header.
+            objs = [inp for target in [exe, test] for inp in target[profile_name].inputs if isinstance(inp, CompiledNode)]
+            pchs = set([obj.precompiled_header for obj in objs])
+            assert len(pchs) == 1
+            pch = pchs.pop()
+            assert pch.inputs[0].path == PATHS["utils.hpp"]
+            assert all([pch in obj.inputs for obj in objs])
+            pch_paths.add(pch.path)
+            assert not any([inp.precompiled_header for inp in self.lib[profile_name].inputs if isinstance(inp, CompiledNode)])
+        # Each profile uses different flags, and so requires its own precompiled header.
+        assert len(pch_paths) == len(self.project.all_profile_names())
+
+    def test_dependent_targets(self):
+        factorial_cpp = self.project.files.source("factorial.cpp")
+        test_cpp = self.project.files.source("tests/test.cpp")
+        # The library and everything that links against it depend on factorial.cpp
+        assert self.project.dependent_targets([factorial_cpp]) == [self.lib, self.exec, self.test]
+        assert self.project.dependent_targets([test_cpp]) == [self.exec, self.test]
+        assert self.project.dependent_targets([test_cpp], targets=[self.lib, self.test]) == [self.test]
+
+    def test_dependent_targets_through_headers(self):
+        self.project.files.scan_all()
+        utils_hpp = self.project.files.graph.find_node_with_path(PATHS["utils.hpp"])
+        assert self.project.dependent_targets([utils_hpp]) == [self.lib, self.exec, self.test]
+
+    def test_run_tests(self, monkeypatch):
+        monkeypatch.setenv("LD_LIBRARY_PATH", "")
+        # Stand in for the built test executable with a script, so that the test does not require a compiler.
+        for prof_name, node in self.test.items():
+            os.makedirs(os.path.dirname(node.path), exist_ok=True)
+            with open(node.path, "w") as f:
+                f.write(f"#!/bin/sh\necho {prof_name}\n" + ("exit 1\n" if prof_name == "debug" else ""))
+            os.chmod(node.path, 0o755)
+
+        junit_xml = os.path.join(self.project.build_dir, "junit.xml")
+        results = self.project.run_tests([self.test], ["release", "debug"], jobs=2, timeout=10, junit_xml=junit_xml)
+        assert [(result.case.profile, result.passed, result.output.strip()) for result in results] == [("release", True, "release"), ("debug", False, "debug")]
+        assert os.path.exists(junit_xml)
+
+    def write_script(self, path: str, contents: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"#!/bin/sh\n{contents}\n")
+        os.chmod(path, 0o755)
+
+    def test_run_benchmarks(self, monkeypatch):
+        monkeypatch.setenv("LD_LIBRARY_PATH", "")
+        bench_target = self.project.benchmark("bench", sources=["tests/test.cpp"], libs=[Library("stdc++"), self.lib])
+        assert self.project.benchmark_targets() == [bench_target]
+        assert bench_target in self.project.all_targets()
+        self.write_script(bench_target["release"].path, "sleep 0.05")
+
+        baseline = os.path.join(self.project.build_dir, "baseline.json")
+        # Results cannot be recorded without a baseline file.
+        with pytest.raises(SBuildrException):
+            self.project.run_benchmarks([bench_target], warmup=0, repetitions=1, update_baseline=True)
+        results = self.project.run_benchmarks([bench_target], warmup=0, repetitions=3, baseline=baseline, update_baseline=True)
+        assert len(results["bench"].samples) == 3
+        assert results["bench"].median >= 0.05
+        # Comparing against the baseline should pass if timings have not changed much...
+        self.project.run_benchmarks([bench_target], warmup=0, repetitions=3, baseline=baseline, threshold=1.0)
+        # ...and fail if they have.
+        self.write_script(bench_target["release"].path, "sleep 0.3")
+        with pytest.raises(SBuildrException):
+            self.project.run_benchmarks([bench_target], warmup=0, repetitions=3, baseline=baseline, threshold=1.0)
+
+    def test_incremental_install(self):
+        # Stand in for built targets, so that the test does not require a compiler.
+        for target in [self.lib, self.exec]:
+            self.write_script(target["release"].path, target.name)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            install_dirs = {name: os.path.join(tmpdir, name) for name in ["include", "lib", "bin"]}
+            def install(**kwargs):
+                return self.project.install(targets=[self.lib, self.exec], profile_names=["release"], headers=["factorial.hpp"], header_install_path=install_dirs["include"], library_install_path=install_dirs["lib"], executable_install_path=install_dirs["bin"], dry_run=False, **kwargs)
+
+            assert self.project.install(targets=[self.lib], profile_names=["release"], library_install_path=install_dirs["lib"]) is None
+            assert not os.path.exists(install_dirs["lib"])
+
+            stats = install()
+            assert len(stats.copied) == 3 and not stats.skipped
+            assert os.path.exists(os.path.join(install_dirs["lib"], os.path.basename(self.lib["release"].path)))
+            assert os.path.exists(os.path.join(install_dirs["include"], "factorial.hpp"))
+
+            stats = install()
+            assert not stats.copied and len(stats.skipped) == 3
+            # Rebuilding a target without changing it should not cause it to be reinstalled if hashes are compared.
+            later = time.time() + 10
+            os.utime(self.exec["release"].path, (later, later))
+            assert len(install(compare_hashes=True).copied) == 0
+            self.write_script(self.exec["release"].path, "changed")
+            assert install().copied == [os.path.join(install_dirs["bin"], os.path.basename(self.exec["release"].path))]
+
+    def test_install_rejects_conflicting_destinations(self):
+        for target in [self.lib, self.exec]:
+            self.write_script(target["release"].path, target.name)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Installing the same file more than once should only copy it once.
+            stats = self.project.install(targets=[self.lib, self.lib], profile_names=["release"], headers=["factorial.hpp", "factorial.hpp"], header_install_path=tmpdir, library_install_path=tmpdir, dry_run=False)
+            assert sorted(stats.copied) == sorted([os.path.join(tmpdir, "factorial.hpp"), os.path.join(tmpdir, os.path.basename(self.lib["release"].path))])
+
+            # Different files with the same name cannot be installed to the same directory.
+            other = Project(root=ROOT, build_dir=os.path.join(tmpdir, "build"))
+            other_lib = other.library("test", sources=["factorial.cpp"], libs=[Library("stdc++")])
+            with pytest.raises(SBuildrException):
+                self.project.install(targets=[self.lib, other_lib], profile_names=["release"], library_install_path=tmpdir)
+
+    def create_stale_artifacts(self):
+        os.makedirs(self.project.common_build_dir, exist_ok=True)
+        factorial_obj = [node.path for node in self.project.graph if isinstance(node, CompiledNode) and os.path.basename(node.path).startswith("factorial.")][0]
+        artifacts = {
+            "current": factorial_obj,
+            # Built with flags that are no longer used.
+            "superseded": os.path.join(self.project.common_build_dir, f"factorial.{'0' * 32}.o"),
+            # Built from a source file that is no longer part of the project.
+            "orphaned": os.path.join(self.project.common_build_dir, f"removed.{'1' * 32}.o"),
+            # Not a hashed artifact.
+            "other": os.path.join(self.project.common_build_dir, Project.TEST_CACHE_NAME),
+        }
+        for path in artifacts.values():
+            with open(path, "w") as f:
+                f.write("artifact")
+        return artifacts
+
+    def test_clean_stale(self):
+        self.project.configure()
+        artifacts = self.create_stale_artifacts()
+        assert self.project.stale_artifacts() == sorted([artifacts["orphaned"], artifacts["superseded"]])
+
+        self.project.clean(stale=True)
+        assert all([os.path.exists(path) for path in artifacts.values()])
+        self.project.clean(stale=True, dry_run=False)
+        assert not os.path.exists(artifacts["superseded"]) and not os.path.exists(artifacts["orphaned"])
+        assert os.path.exists(artifacts["current"]) and os.path.exists(artifacts["other"])
+
+    def test_stale_artifacts_after_partial_configure(self):
+        self.project.configure(targets=[self.lib], profile_names=["release"])
+        artifacts = self.create_stale_artifacts()
+        # Artifacts that were not recorded by a previous configuration may belong to targets that were not configured, so they are kept.
+        assert self.project.stale_artifacts() == []
+
+    def touch_artifacts(self, project):
+        artifacts = set()
+        for node in project.graph:
+            artifacts.update([artifact.path for artifact in node.artifacts() if os.path.dirname(artifact.path) == project.common_build_dir])
+        for path in artifacts:
+            with open(path, "w") as f:
+                f.write("artifact")
+        return artifacts
+
+    def test_stale_artifacts_after_partial_profile_configure(self):
+        self.project.configure()
+        old_artifacts = self.touch_artifacts(self.project)
+        debug_artifacts = set([path for node in self.project.all_targets() for path in self.project._owned_artifacts(node["debug"])])
+
+        # Release artifacts are rebuilt with new flags, but the debug profile is not configured.
+        project = Project(root=ROOT, build_dir=PATHS["build"])
+        project.profile("release").flags = BuildFlags().O(2).std(17).fpic()
+        lib = project.library("test", sources=["factorial.cpp", "fibonacci.cpp"], libs=[Library("stdc++")])
+        project.executable("test", sources=["tests/test.cpp"], libs=[Library("stdc++"), lib])
+        project.test("test2", sources=["tests/test.cpp"], libs=[Library("stdc++"), lib])
+        project.configure(profile_names=["release"])
+        new_artifacts = self.touch_artifacts(project)
+
+        stale = project.stale_artifacts()
+        assert stale
+        assert sorted(old_artifacts - new_artifacts - debug_artifacts) == stale
+        assert not debug_artifacts & set(stale)
+
+    # TODO: Test run, uninstall
 
 class TestFileManager(object):
     def setup_method(self):
@@ -187,3 +444,483 @@ class TestFileManager(object):
         # Make sure that the source graph has been populated
         for file in ["factorial.hpp", "fibonacci.hpp", "test.cpp", "factorial.cpp", "fibonacci.cpp", "utils.hpp"]:
             assert self.manager.graph.find_node_with_path(PATHS[file])
+
+    def test_update_and_rescan(self):
+        factorial_cpp = self.manager.source(PATHS["factorial.cpp"])
+        self.manager.scan_all()
+        factorial_hpp = self.manager.graph.find_node_with_path(PATHS["factorial.hpp"])
+        include_dirs = factorial_cpp.include_dirs
+
+        changed = self.manager.update(set([PATHS["factorial.hpp"]]))
+        assert changed == [factorial_hpp]
+        rescanned = self.manager.rescan(changed)
+        # Files that include the changed file need to be rescanned as well.
+        assert factorial_hpp in rescanned and factorial_cpp in rescanned
+        assert factorial_cpp.include_dirs == include_dirs
+        assert factorial_hpp in factorial_cpp.inputs
+
+    def test_update_tracks_new_files(self):
+        with tempfile.NamedTemporaryFile(dir=PATHS["src"], suffix=".hpp") as f:
+            assert not self.manager.update(set([f.name]))
+            assert f.name in self.manager.files
+        self.manager.update(set([f.name]))
+        assert f.name not in self.manager.files
+
+    def test_token_hash_ignores_comments_and_whitespace(self):
+        assert _token_hash("int x = 1; // One\n") == _token_hash("/* Comment */\nint  x=1;")
+        assert _token_hash('auto s = "// Not a comment";') != _token_hash('auto s = "";')
+        assert _token_hash("#define A\nint x;") != _token_hash("#define A int x;")
+        assert _token_hash("int x = 1;") != _token_hash("int x = 2;")
+
+    def test_token_hash_keeps_whitespace_in_directives(self):
+        # The first defines a function-like macro, and the second an object-like one.
+        assert _token_hash("#define F(x) x\n") != _token_hash("#define F (x) x\n")
+        assert _token_hash("#define F(x) x\n") == _token_hash("#  define F(x)\t x // Identity\n")
+
+    def test_fingerprints_change_only_with_tokens(self, tmp_path):
+        header = tmp_path / "value.hpp"
+        source = tmp_path / "value.cpp"
+        header.write_text("constexpr int VALUE = 1;\n")
+        source.write_text('#include "value.hpp"\nint value() { return VALUE; }\n')
+        manager = FileManager(str(tmp_path))
+        manager.fingerprint_dir = manager.add_writable_dir(str(tmp_path / "fingerprints"))
+        source_node = manager.source(str(source))
+        manager.scan_all()
+        header_node = manager.graph.find_node_with_path(str(header))
+
+        assert source_node.artifacts()[0].path == source_node.fingerprint_path
+        assert sorted(manager.update_fingerprints([source_node])) == sorted([source_node.fingerprint_path, header_node.fingerprint_path])
+        assert manager.update_fingerprints([source_node]) == []
+
+        # Ensure the modification is visible even on file systems with coarse timestamps.
+        def rewrite(path, contents):
+            mtime = os.stat(path).st_mtime_ns
+            path.write_text(contents)
+            os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+        rewrite(header, "// The value.\nconstexpr  int VALUE = 1;\n")
+        assert manager.update_fingerprints([source_node]) == []
+        # Changing the tokens of a header changes the fingerprints of files that include it.
+        rewrite(header, "constexpr int VALUE = 2;\n")
+        assert sorted(manager.update_fingerprints([source_node])) == sorted([source_node.fingerprint_path, header_node.fingerprint_path])
+
+
+class TestWatcher(object):
+    def setup_method(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "file.cpp")
+        with open(self.path, "w") as f:
+            f.write("int main() {}")
+
+    def teardown_method(self):
+        self.dir.cleanup()
+
+    def make_watcher(self, WatcherType):
+        try:
+            return WatcherType(set([self.dir.name]))
+        except OSError:
+            pytest.skip(f"{WatcherType.__name__} is not supported on this platform")
+
+    @pytest.mark.parametrize("WatcherType", [PollingWatcher, InotifyWatcher])
+    def test_no_changes(self, WatcherType):
+        watcher = self.make_watcher(WatcherType)
+        assert not watcher.wait(debounce=0.05, timeout=0.2)
+
+    @pytest.mark.parametrize("WatcherType", [PollingWatcher, InotifyWatcher])
+    def test_detects_modification(self, WatcherType):
+        watcher = self.make_watcher(WatcherType)
+        # Make sure the timestamp changes, even on filesystems with coarse timestamps.
+        os.utime(self.path, (time.time() + 5, time.time() + 5))
+        assert self.path in watcher.wait(debounce=0.05, timeout=2)
+
+    @pytest.mark.parametrize("WatcherType", [PollingWatcher, InotifyWatcher])
+    def test_detects_new_files_in_new_dirs(self, WatcherType):
+        watcher = self.make_watcher(WatcherType)
+        new_dir = os.path.join(self.dir.name, "new_dir")
+        os.mkdir(new_dir)
+        new_path = os.path.join(new_dir, "new.hpp")
+        with open(new_path, "w") as f:
+            f.write("#pragma once")
+        changed = watcher.wait(debounce=0.2, timeout=2)
+        assert new_path in changed
+        assert new_dir in watcher.dirs
+
+    @pytest.mark.parametrize("WatcherType", [PollingWatcher, InotifyWatcher])
+    def test_ignores_excluded_dirs(self, WatcherType):
+        build_dir = os.path.join(self.dir.name, "build")
+        os.mkdir(build_dir)
+        try:
+            watcher = WatcherType(set([self.dir.name]), exclude_dirs=set([build_dir]))
+        except OSError:
+            pytest.skip(f"{WatcherType.__name__} is not supported on this platform")
+        with open(os.path.join(build_dir, "file.o"), "w") as f:
+            f.write("")
+        assert not watcher.wait(debounce=0.05, timeout=0.3)
+
+class TestRunner(object):
+    def shell_case(self, name: str, script: str, profile: str="release"):
+        return runner.TestCase(name, profile, ["sh", "-c", script])
+
+    def test_runs_tests_concurrently_in_order(self):
+        cases = [self.shell_case("slow", "sleep 0.5; echo slow"), self.shell_case("fast", "echo fast"), self.shell_case("failing", "echo oops >&2; exit 3")]
+        reported = []
+        start = time.time()
+        results = runner.run_tests(cases, max_workers=3, on_result=lambda result: reported.append(result.case.name))
+        assert time.time() - start < 1.0
+        assert reported == ["slow", "fast", "failing"]
+        assert [result.case.name for result in results] == reported
+        assert [result.status for result in results] == [runner.TestResult.PASSED, runner.TestResult.PASSED, runner.TestResult.FAILED]
+        assert results[0].output.strip() == "slow"
+        assert results[2].returncode == 3
+        assert results[2].output.strip() == "oops"
+
+    def test_timeout(self):
+        result = runner.run_test(self.shell_case("hangs", "echo started; sleep 5"), timeout=0.2)
+        assert result.status == runner.TestResult.TIMEOUT
+        assert not result.passed
+        assert "started" in result.output
+        assert result.duration < 5
+
+    def test_junit_xml(self):
+        cases = [self.shell_case("passes", "echo ok"), self.shell_case("fails", "exit 1"), self.shell_case("passes", "true", profile="debug")]
+        results = runner.run_tests(cases)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "results", "junit.xml")
+            runner.write_junit_xml(path, results)
+            root = ET.parse(path).getroot()
+        assert root.get("tests") == "3"
+        assert root.get("failures") == "1"
+        suites = {suite.get("name"): suite for suite in root.findall("testsuite")}
+        assert set(suites.keys()) == {"release", "debug"}
+        release_cases = suites["release"].findall("testcase")
+        assert [case.get("name") for case in release_cases] == ["passes", "fails"]
+        assert release_cases[0].find("failure") is None
+        assert release_cases[0].find("system-out").text.strip() == "ok"
+        assert release_cases[1].find("failure") is not None
+
+class TestAffectedTests(object):
+    def setup_method(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        sources = {
+            "a.hpp": "#pragma once\nint a();",
+            "a.cpp": '#include "a.hpp"\nint a() { return 1; }',
+            "test_a.cpp": '#include "a.hpp"\nint main() { return a() - 1; }',
+            "test_b.cpp": "int main() { return 0; }",
+            "build.py": "",
+        }
+        for name, contents in sources.items():
+            self.write(name, contents)
+        self.project = Project(root=self.root)
+        self.project.config_file = os.path.join(self.root, "build.py")
+        self.test_a = self.project.test("test_a", sources=["test_a.cpp", "a.cpp"])
+        self.test_b = self.project.test("test_b", sources=["test_b.cpp"])
+
+    def teardown_method(self):
+        self.dir.cleanup()
+
+    def write(self, name: str, contents: str):
+        with open(os.path.join(self.root, name), "w") as f:
+            f.write(contents)
+
+    def touch_later(self, name: str):
+        later = time.time() + 10
+        os.utime(os.path.join(self.root, name), (later, later))
+
+    def test_changed_since_timestamp(self):
+        since = str(time.time() + 5)
+        assert self.project.affected_tests(since) == []
+        # Changes to headers affect tests that include them.
+        self.touch_later("a.hpp")
+        assert self.project.affected_tests(since) == [self.test_a]
+        self.touch_later("test_b.cpp")
+        assert self.project.affected_tests(since, targets=[self.test_b]) == [self.test_b]
+
+    def test_changed_build_script_affects_all_tests(self):
+        self.touch_later("build.py")
+        assert self.project.affected_tests(str(time.time() + 5)) == [self.test_a, self.test_b]
+
+    def test_changed_since_git_revision(self):
+        git = ["git", "-c", "user.name=sbuildr", "-c", "user.email=sbuildr@example.com"]
+        subprocess.run(git + ["init", "-q"], cwd=self.root, check=True)
+        subprocess.run(git + ["add", "."], cwd=self.root, check=True)
+        subprocess.run(git + ["commit", "-q", "-m", "Initial commit"], cwd=self.root, check=True)
+        assert self.project.affected_tests("HEAD") == []
+
+        self.write("test_b.cpp", "int main() { return 1; }")
+        # Untracked files that are not part of the build graph do not affect any tests.
+        self.write("notes.txt", "")
+        assert self.project.affected_tests("HEAD") == [self.test_b]
+
+        # Revisions that look like timestamps should still be treated as revisions.
+        subprocess.run(git + ["branch", "20200110"], cwd=self.root, check=True)
+        assert self.project.affected_tests("20200110") == [self.test_b]
+        assert self.project.affected_tests("@20200110") == [self.test_a, self.test_b]
+        with pytest.raises(SBuildrException):
+            self.project.affected_tests("not-a-revision")
+
+@pytest.mark.skipif(shutil.which("gcc") is None or shutil.which("readelf") is None, reason="Requires gcc and readelf")
+class TestTestCache(object):
+    def setup_method(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.lib_dir = os.path.join(self.dir.name, "lib")
+        os.makedirs(self.lib_dir)
+        self.exe = os.path.join(self.dir.name, "test")
+        self.build_lib(0)
+        self.compile(["-x", "c", "-", "-o", self.exe, f"-L{self.lib_dir}", "-lvalue"], "int value(void); int main(void) { return value(); }")
+        self.cache = runner.TestCache(os.path.join(self.dir.name, "cache", "results.json"))
+
+    def teardown_method(self):
+        self.dir.cleanup()
+
+    def compile(self, args, source: str):
+        subprocess.run(["gcc"] + args, input=source.encode(), check=True)
+
+    def build_lib(self, retval: int):
+        self.compile(["-x", "c", "-", "-shared", "-fPIC", "-o", os.path.join(self.lib_dir, "libvalue.so")], f"int value(void) {{ return {retval}; }}")
+
+    def run(self, env=None):
+        case = runner.TestCase("test", "release", [self.exe], env or {"LD_LIBRARY_PATH": self.lib_dir})
+        return runner.run_tests([case], cache=self.cache)[0]
+
+    def test_finds_loaded_libraries(self):
+        case = runner.TestCase("test", "release", [self.exe], {"LD_LIBRARY_PATH": self.lib_dir})
+        assert self.cache._libraries(self.exe, [self.lib_dir]) == [os.path.realpath(os.path.join(self.lib_dir, "libvalue.so"))]
+        assert self.cache.key(case) is not None
+
+    def test_skips_unchanged_passing_tests(self):
+        assert self.run().status == runner.TestResult.PASSED
+        assert self.run().status == runner.TestResult.CACHED
+        # The cache should persist across runs.
+        self.cache = runner.TestCache(self.cache.path)
+        assert self.run().status == runner.TestResult.CACHED
+
+    def test_reruns_when_library_changes(self):
+        assert self.run().status == runner.TestResult.PASSED
+        self.build_lib(1)
+        assert self.run().status == runner.TestResult.FAILED
+        # Failures are never cached.
+        assert self.run().status == runner.TestResult.FAILED
+        self.build_lib(0)
+        assert self.run().status == runner.TestResult.PASSED
+
+    def test_reruns_when_environment_changes(self):
+        assert self.run().status == runner.TestResult.PASSED
+        assert self.run({"LD_LIBRARY_PATH": self.lib_dir, "SEED": "1"}).status == runner.TestResult.PASSED
+
+class TestShardTests(object):
+    def setup_method(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.project = Project(root=self.dir.name)
+        self.durations_path = os.path.join(self.dir.name, "durations.json")
+        # Source sizes: test0 is the largest, test3 the smallest.
+        for index, size in enumerate([400, 300, 200, 100]):
+            with open(os.path.join(self.dir.name, f"test{index}.cpp"), "w") as f:
+                f.write("int main() { return 0; }".ljust(size))
+            self.project.test(f"test{index}", sources=[f"test{index}.cpp"])
+
+    def teardown_method(self):
+        self.dir.cleanup()
+
+    def shards(self, count: int):
+        return [[test.name for test in self.project.shard_tests(index, count, durations_path=self.durations_path)] for index in range(1, count + 1)]
+
+    def test_partition_balances_weights(self):
+        groups = runner.partition({"a": 5, "b": 4, "c": 3, "d": 3, "e": 3}, 2)
+        assert groups == [["a", "d"], ["b", "c", "e"]]
+
+    def test_shards_cover_all_tests(self):
+        shards = self.shards(3)
+        assert sorted(sum(shards, [])) == sorted(self.project.tests.keys())
+
+    def test_falls_back_to_source_size(self):
+        assert self.shards(2) == [["test0", "test3"], ["test1", "test2"]]
+
+    def test_uses_recorded_durations(self):
+        assert self.shards(3) == [["test0"], ["test1"], ["test2", "test3"]]
+
+        durations = runner.TestDurations(self.durations_path)
+        result = lambda name, profile, status, duration: runner.TestResult(runner.TestCase(name, profile, []), status, 0, "", duration)
+        # Durations are summed across profiles. Cached results are ignored.
+        durations.record([result("test3", "release", runner.TestResult.PASSED, 4.5), result("test3", "debug", runner.TestResult.PASSED, 4.5)])
+        durations.record([result("test0", "release", runner.TestResult.PASSED, 1.0), result("test1", "release", runner.TestResult.CACHED, 0.0)])
+        durations.save()
+        assert runner.TestDurations(self.durations_path).get("test3") == 9.0
+        assert runner.TestDurations(self.durations_path).get("test1") is None
+        # Tests without history are estimated from their source sizes, at the rate of tests with history: test1 = 6, test2 = 4.
+        assert self.shards(3) == [["test3"], ["test1"], ["test0", "test2"]]
+
+    def test_invalid_shard(self):
+        with pytest.raises(SBuildrException):
+            self.project.shard_tests(3, 2)
+
+class TestBench(object):
+    def test_stats(self):
+        stats = bench.BenchmarkStats([1.0, 2.0, 3.0, 4.0, 100.0])
+        assert stats.median == 3.0
+        # The median absolute deviation is not skewed by the outlier.
+        assert stats.mad == 1.0
+        assert stats.min == 1.0 and stats.max == 100.0
+
+    def test_run_benchmark_with_warmup(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            counter = os.path.join(tmpdir, "runs")
+            stats = bench.run_benchmark(["sh", "-c", f"echo run >> {counter}"], warmup=2, repetitions=3)
+            with open(counter) as f:
+                assert len(f.readlines()) == 5
+        assert len(stats.samples) == 3
+
+    @pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU pinning is not supported on this platform")
+    def test_pins_to_cpu(self):
+        cpu = min(os.sched_getaffinity(0))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "affinity")
+            script = f"import os; open({repr(output)}, 'w').write(str(sorted(os.sched_getaffinity(0))))"
+            bench.run_benchmark([sys.executable, "-c", script], warmup=0, repetitions=1, cpu=cpu)
+            with open(output) as f:
+                assert f.read() == str([cpu])
+
+    def test_baseline(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baseline = bench.Baseline(os.path.join(tmpdir, "baseline.json"))
+            assert baseline.change("bench", bench.BenchmarkStats([1.0])) is None
+            baseline.update({"bench": bench.BenchmarkStats([1.0, 1.0, 1.0])})
+            baseline.save()
+            assert bench.Baseline(baseline.path).change("bench", bench.BenchmarkStats([1.1, 1.2, 1.2])) == pytest.approx(0.2)
+
+
+# Builds nothing, so that build steps performed by the project itself can be tested without a build tool.
+class NoopBackend(Backend):
+    def configure(self, build_graph):
+        pass
+
+    def build(self, nodes):
+        return subprocess.CompletedProcess([], 0), 0
+
+class TestUnity(object):
+    def setup_method(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        os.mkdir(os.path.join(self.root, "src"))
+        self.sources = [self.write(f"src/file{index}.cpp", f'#include "common.hpp"\nint file{index}() {{ return VALUE; }}\n') for index in range(20)]
+        self.write("src/common.hpp", "#pragma once\nconstexpr int VALUE = 1;\n")
+
+    def teardown_method(self):
+        self.dir.cleanup()
+
+    def write(self, name: str, contents: str) -> str:
+        path = os.path.join(self.root, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_batches_respect_size(self):
+        batches, excluded = unity.unity_batches(self.sources, 4, self.root)
+        assert not excluded
+        assert sorted(sum(batches, [])) == sorted(self.sources)
+        assert all([len(batch) <= 4 for batch in batches])
+
+    def test_batches_are_stable(self):
+        batches, _ = unity.unity_batches(self.sources, 4, self.root)
+        # Adding a source file only affects the batch that contains it.
+        new_source = self.write("src/file10a.cpp", "int file10a() { return 0; }\n")
+        new_batches, _ = unity.unity_batches(self.sources + [new_source], 4, self.root)
+        changed = [batch for batch in new_batches if batch not in batches]
+        assert len(changed) <= 2 and new_source in sum(changed, [])
+
+    def test_excludes_incompatible_sources(self):
+        sources = [
+            self.write("src/macro.cpp", "#define LOCAL 1\nint macro() { return LOCAL; }\n"),
+            self.write("src/undef.cpp", "#define LOCAL 1\nint undef() { return LOCAL; }\n#undef LOCAL\n"),
+            self.write("src/marked.cpp", "// sbuildr: no-unity\nint marked() { return 0; }\n"),
+            self.write("src/static_a.cpp", "static int helper() { return 0; }\n"),
+            self.write("src/static_b.cpp", "static int helper() { return 1; }\n"),
+            self.write("src/static_c.cpp", "static int other = 0;\n"),
+            self.write("src/plain.c", "int plain() { return 0; }\n"),
+        ]
+        batches, excluded = unity.unity_batches(sources, 8, self.root)
+        assert sorted(excluded) == sorted([sources[index] for index in [0, 2, 3, 4, 6]])
+        assert sorted(sum(batches, [])) == sorted([sources[1], sources[5]])
+
+    def test_excludes_sources_with_leaked_names(self):
+        sources = [
+            self.write("src/anon_a.cpp", "namespace {\n    int helper() { return 0; }\n}\n"),
+            self.write("src/anon_b.cpp", "namespace util {\nnamespace {\nint helper() { return 0; }\n}\n}\n"),
+            self.write("src/indented_a.cpp", "namespace util {\n    static int helper() { return 1; }\n}\n"),
+            self.write("src/using.cpp", "using namespace util;\nint used() { return 0; }\n"),
+            self.write("src/member.cpp", "struct A { static int helper() { return 0; } };\nint f() { static int count = 0; using namespace util; return count; }\n"),
+            self.write("src/extern_c.cpp", 'extern "C" {\n    static int helper(void) { return 0; }\n}\n'),
+        ]
+        batches, excluded = unity.unity_batches(sources, 8, self.root)
+        # util::helper is defined in two files, as is helper. Class members and function-local names are not file-local names.
+        assert sorted(excluded) == sorted([sources[index] for index in [0, 1, 2, 3, 5]])
+        assert sum(batches, []) == [sources[4]]
+
+    def test_batch_names_are_relocatable(self):
+        def batch_names(root):
+            project = Project(root=root)
+            project.profile("unity", unity_batch_size=4)
+            lib = project.library("lib", sources=[os.path.basename(path) for path in self.sources])
+            return sorted([os.path.basename(inp.inputs[0].path) for inp in lib["unity"].inputs if isinstance(inp.inputs[0], UnitySourceNode)])
+
+        names = batch_names(self.root)
+        with tempfile.TemporaryDirectory() as other:
+            moved = os.path.join(other, "moved")
+            shutil.copytree(self.root, moved)
+            assert names and batch_names(moved) == names
+
+    def test_clean_stale_removes_outdated_batches_and_fingerprints(self):
+        def build(sources):
+            project = Project(root=self.root, fingerprint_sources=True)
+            project.profile("unity", flags=BuildFlags().O(0), unity_batch_size=4)
+            lib = project.library("lib", sources=sources, compiler=compiler.gcc, linker=linker.gcc)
+            project.configure(BackendType=NoopBackend)
+            project.build()
+            batches = {obj.inputs[0].path: [inp.path for inp in obj.inputs[0].inputs] for obj in lib["unity"].inputs if isinstance(obj, CompiledNode) and isinstance(obj.inputs[0], UnitySourceNode)}
+            return project, batches
+
+        _, old_batches = build(self.sources)
+        # Removing a source file changes the batch that contained it, and makes its fingerprint stale.
+        removed = sorted(old_batches.values())[0][-1]
+        project, new_batches = build([path for path in self.sources if path != removed])
+        removed_fingerprint = project.files.fingerprint_path(removed)
+        outdated = sorted(set(old_batches) - set(new_batches))
+        assert os.path.exists(removed_fingerprint) and outdated
+        assert project.stale_artifacts() == outdated + [removed_fingerprint]
+
+        project.clean(stale=True, dry_run=False)
+        assert not os.path.exists(removed_fingerprint) and not any([os.path.exists(path) for path in outdated])
+        assert all([os.path.exists(path) for path in new_batches])
+        assert project.stale_artifacts() == []
+
+    def test_build_writes_batches(self):
+        project = Project(root=self.root)
+        project.profile("unity", flags=BuildFlags().O(0), unity_batch_size=4)
+        macro = self.write("src/macro.cpp", "#define LOCAL 1\nint macro() { return LOCAL; }\n")
+        lib = project.library("lib", sources=self.sources + [macro], compiler=compiler.gcc, linker=linker.gcc)
+        project.configure(targets=[lib], profile_names=["unity"], BackendType=NoopBackend)
+
+        objs = [inp for inp in lib["unity"].inputs if isinstance(inp, CompiledNode)]
+        batch_nodes = [obj.inputs[0] for obj in objs if isinstance(obj.inputs[0], UnitySourceNode)]
+        assert batch_nodes and all([node.include_dirs == [os.path.join(self.root, "src")] for node in batch_nodes])
+        batched = sum([[inp.path for inp in node.inputs] for node in batch_nodes], [])
+        individual = [obj.inputs[0].path for obj in objs if not isinstance(obj.inputs[0], UnitySourceNode)]
+        assert macro in individual
+        assert sorted(batched + individual) == sorted(self.sources + [macro])
+        # Profiles without a batch size compile sources individually.
+        assert len([inp for inp in lib["release"].inputs if isinstance(inp, CompiledNode)]) == len(self.sources) + 1
+
+        project.build(targets=[lib], profile_names=["unity"])
+        assert all([os.path.exists(node.path) for node in batch_nodes])
+        mtimes = [os.stat(node.path).st_mtime_ns for node in batch_nodes]
+        project.build(targets=[lib], profile_names=["unity"])
+        assert [os.stat(node.path).st_mtime_ns for node in batch_nodes] == mtimes
+
+        # Batches are recreated after the build directory is cleaned.
+        project.clean(dry_run=False)
+        project.build(targets=[lib], profile_names=["unity"])
+        assert all([os.path.exists(node.path) for node in batch_nodes])
+
+        # Batches must be compilable.
+        for node in batch_nodes:
+            subprocess.run(compiler.gcc.compile(node.path, node.path + ".o", node.include_dirs), check=True)
@@ -4,8 +4,10 @@ from sbuildr.graph.node import Library
 
 from test_tools import PATHS, TESTS_ROOT, ROOT
 
+from typing import List, Dict
 import subprocess
 import tempfile
+import pickle
 import shutil
 import sys
 import os
@@ -22,6 +24,41 @@ def test_public_imports():
     from sbuildr.dependencies.builders import SBuildrBuilder
     from sbuildr.dependencies.fetchers import CopyFetcher, GitFetcher
 
+# Modules that pull in most of SBuildr, and should therefore not be imported at startup.
+HEAVY_MODULES = ["sbuildr.project.project", "sbuildr.dependencies", "sbuildr.backends", "sbuildr.graph.node"]
+# Generous upper bound on the cumulative import time of SBuildr, in seconds.
+IMPORT_TIME_BUDGET = 0.5
+
+# Runs the specified arguments with `python -X importtime` and returns a mapping of module names to cumulative import times in seconds.
+def import_times(args: List[str]) -> Dict[str, float]:
+    status = subprocess.run([sys.executable, "-X", "importtime"] + args, capture_output=True, cwd=SBUILDR_ROOT, env=dict(os.environ, PYTHONPATH=SBUILDR_ROOT))
+    times = {}
+    for line in status.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+class TestImportTime(object):
+    def test_package_import_is_lazy(self):
+        times = import_times(["-c", "import sbuildr"])
+        assert "sbuildr" in times
+        for module in HEAVY_MODULES:
+            assert module not in times
+        assert times["sbuildr"] < IMPORT_TIME_BUDGET
+
+    def test_lazy_attributes_are_importable(self):
+        times = import_times(["-c", "import sbuildr; sbuildr.Project; sbuildr.dependencies.Dependency"])
+        assert "sbuildr.project.file_manager" in times and "sbuildr.dependencies" in times
+
+    def test_cli_help_does_not_import_project(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            times = import_times([SBUILDR_EXEC, "-p", os.path.join(tmpdir, "missing.sbuildr"), "--help"])
+        assert "sbuildr" in times
+        for module in HEAVY_MODULES:
+            assert module not in times
+
 class TestSBuildrExecutable(object):
     def setup_method(self):
         print(f"Creating build directory: {PATHS['build']}")
@@ -64,6 +101,26 @@ class TestSBuildrExecutable(object):
     def test_help_targets(self):
         self.check_subprocess(subprocess.run([SBUILDR_EXEC, "-p", self.saved_project.name, "help"]))
 
+    def test_help_does_not_load_project(self):
+        times = import_times([SBUILDR_EXEC, "-p", self.saved_project.name, "help"])
+        assert "sbuildr.project.snapshot" in times
+        assert "sbuildr.project.project" not in times
+
+    def test_outdated_project_complains(self):
+        with open(self.saved_project.name, "wb") as f:
+            pickle.dump(self.proj, f)
+        status = subprocess.run([SBUILDR_EXEC, "-p", self.saved_project.name, "help"], capture_output=True)
+        assert status.returncode and b"older API version" in status.stdout
+
+    def test_cache_gc_does_not_require_project(self):
+        with tempfile.TemporaryDirectory() as cache_root:
+            package = os.path.join(cache_root, "packages", "dep-1.0")
+            os.makedirs(package)
+            with open(os.path.join(package, "libdep.so"), "wb") as f:
+                f.write(b"0" * 1024)
+            self.check_subprocess(subprocess.run([SBUILDR_EXEC, "-p", "nonexistent", "cache", "gc", "--max-size", "0", "--cache-root", cache_root]))
+            assert not os.path.exists(package)
+
     def test_can_default_build_project(self):
         # Build both targets for all profiles.
         self.check_subprocess(subprocess.run([SBUILDR_EXEC, "-p", self.saved_project.name, "build"]))
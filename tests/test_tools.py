@@ -4,6 +4,7 @@ from typing import List
 import subprocess
 import pytest
 import shutil
+import sys
 import os
 
 TESTS_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, "examples"))
@@ -86,3 +87,65 @@ class TestLinkers(TestCompilers):
         libtest = TestLinkers.build_libtest(compiler, linker)
         test = TestLinkers.compile(compiler, PATHS["test.cpp"])
         assert os.path.exists(TestLinkers.link(linker, [test, libtest, "-lstdc++"], "test"))
+
+class TestPrecompiledHeaders(object):
+    def test_precompiled_header_commands(self):
+        assert compiler.clang.compile("a.cpp", "a.o", precompiled_header="b.hpp.pch")[2:-2] == ["-include-pch", "b.hpp.pch"]
+        assert compiler.gcc.compile("a.cpp", "a.o", precompiled_header="b.hpp.gch")[2:-2] == ["-include", "b.hpp"]
+        assert compiler.gcc.precompile("b.hpp", "b.hpp.gch")[:4] == ["gcc", "-x", "c++-header", "b.hpp"]
+
+    def test_gcc_uses_precompiled_header(self, tmp_path):
+        header = tmp_path / "heavy.hpp"
+        source = tmp_path / "a.cpp"
+        header.write_text("#include <vector>\n#define FROM_PCH 1\n")
+        source.write_text("int main() { std::vector<int> v; return FROM_PCH - 1; }\n")
+        flags = BuildFlags().O(2).std(17)
+        # Precompiled headers do not need to be next to the original header.
+        pch = str(tmp_path / "build" / "heavy.hpp.0123456789abcdef.gch")
+        os.makedirs(os.path.dirname(pch))
+        subprocess.run(compiler.gcc.precompile(str(header), pch, flags=flags), check=True)
+        # -H lists the headers that were used, with precompiled headers marked by a "!".
+        status = subprocess.run(compiler.gcc.compile(str(source), str(tmp_path / "a.o"), flags=flags, precompiled_header=pch) + ["-H"], capture_output=True)
+        assert status.returncode == 0
+        assert f"! {pch}" in status.stderr.decode()
+
+SBUILDR_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+SIGNATURE_SCRIPT = f"""
+from sbuildr.tools.flags import BuildFlags
+from sbuildr.tools import compiler, linker
+flags = BuildFlags().O(3).define("A").define("B").define("C").define("D")
+roots = [("${{root}}", "{ROOT}")]
+print(compiler.gcc.signature("{PATHS['factorial.cpp']}", ["{PATHS['include']}"], flags, roots=roots))
+print(linker.gcc.signature(["{PATHS['build']}/factorial.o"], ["stdc++"], [], flags, roots=roots))
+"""
+
+class TestSignatures(object):
+    def test_signatures_are_stable_across_interpreters(self):
+        def signatures(hash_seed):
+            env = dict(os.environ, PYTHONPATH=SBUILDR_ROOT, PYTHONHASHSEED=str(hash_seed))
+            return subprocess.run([sys.executable, "-c", SIGNATURE_SCRIPT], env=env, capture_output=True, check=True).stdout
+
+        assert len(set(signatures(seed) for seed in range(4))) == 1
+
+    def test_signatures_are_independent_of_define_order(self):
+        first = BuildFlags().define("A").define("B")
+        second = BuildFlags().define("B").define("A")
+        assert compiler.gcc.signature("a.cpp", flags=first) == compiler.gcc.signature("a.cpp", flags=second)
+
+    def test_signatures_are_relocatable(self):
+        def signature(root):
+            roots = [("${build}", os.path.join(root, "build")), ("${root}", root)]
+            return compiler.gcc.signature(os.path.join(root, "src", "a.cpp"), [os.path.join(root, "include")], roots=roots)
+
+        assert signature("/home/first/project") == signature("/tmp/second/project")
+        assert signature("/home/first/project") != compiler.gcc.signature("/home/first/project/src/a.cpp", ["/home/first/project/include"])
+
+    def test_linker_signatures_are_relocatable(self):
+        def signature(root):
+            roots = [("${build}", os.path.join(root, "build")), ("${root}", root)]
+            return linker.gcc.signature([os.path.join(root, "build", "a.o")], libs=[os.path.join(root, "lib", "libb.so"), "stdc++"], roots=roots)
+
+        assert signature("/home/first/project") == signature("/tmp/second/project")
+
+    def test_signatures_depend_on_flags(self):
+        assert compiler.gcc.signature("a.cpp", flags=BuildFlags().O(3)) != compiler.gcc.signature("a.cpp", flags=BuildFlags().O(0))